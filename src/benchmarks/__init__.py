@@ -0,0 +1,3 @@
+""" Standalone micro-benchmarks, run from `src` with
+`python -m benchmarks.<name>`. They are not collected by pytest.
+"""
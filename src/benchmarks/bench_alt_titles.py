@@ -0,0 +1,122 @@
+""" clean_alternative_title: the original chain of string operations, a
+rewrite with precompiled regexes and the guarded string operations it uses
+now.
+
+Before timing, all are checked to give identical output on the titles from
+the tests, every title in the DSC table and a large set of random titles
+built from the codes the cleaning looks for.
+"""
+import os
+import random
+import re
+import sys
+
+from benchmarks.harness import measure, report
+from refiners.cbs_refiner import clean_alternative_title
+from utils import csv_to_dict
+
+DSC_TABLE_CSV = os.path.join(os.path.dirname(__file__), '..', 'data',
+                             'DSC_table.csv')
+
+TEST_TITLES = [
+    'WoonbasePopulatieWoonruimtenJJJJVV', 'ABCJJJJVV', 'ABCVV', 'ABCJJJJTAB',
+    'ABCVVTAB', 'ABC', 'PWETSRGPERSOONJJJJBUSVV', 'JJJJBUS', 'VVBUS',
+    'JJJJTABVVTAB', 'CWIJJJJMMDDTABVV', 'GEMSTPLAATSJJJJMMBUSVV',
+    'b_handel_JJJJMM', 'PS ArbodienstenVV',
+]
+
+PIECES = ['JJJJ', 'VV', 'V', 'J', 'MM', 'DD', 'BUS', 'TAB', 'TA', 'BU', '_',
+          'A', 'b', 'jjjj', 'vv', 'bus', 'tab', ' ']
+
+
+def original_clean_alternative_title(alternative_title: str):
+    """ clean_alternative_title as it was before the rewrite. """
+    alternative_title = alternative_title.upper()
+
+    if alternative_title.endswith('VV'):
+        alternative_title = alternative_title[:-2]
+    if alternative_title.endswith('JJJJ'):
+        alternative_title = alternative_title[:-4]
+
+    if "JJJJMMDD" in alternative_title:
+        dd_index = alternative_title.find("JJJJMMDD")
+        alternative_title = alternative_title[:dd_index] + alternative_title[
+                                                           dd_index + 8:]
+    if "JJJJMM" in alternative_title:
+        mm_index = alternative_title.find("JJJJMM")
+        alternative_title = alternative_title[:mm_index] + alternative_title[
+                                                           mm_index + 6:]
+
+    alternative_title = alternative_title.replace('JJJJBUS', 'BUS').replace(
+        'VVBUS', 'BUS').replace('JJJJTAB', 'TAB').replace('VVTAB', 'TAB')
+
+    alternative_title = alternative_title.rstrip('_')
+
+    return alternative_title
+
+
+TITLE_SUFFIX = re.compile(r'(?:JJJJ)?(?:VV)?\Z')
+BUS_PREFIX = re.compile(r'(?:VV)?(?:JJJJ)?(?=BUS)')
+TAB_PREFIX = re.compile(r'(?:VV)?(?:JJJJ)?(?=TAB)')
+
+
+def regex_clean_alternative_title(alternative_title: str):
+    """ clean_alternative_title with the suffix and BUS/TAB steps as
+    regexes. The BUS and TAB passes can't be combined into one regex:
+    removing a prefix of BUS can form a new TAB ('JJJJTAJJJJBUS').
+    """
+    alternative_title = alternative_title.upper()
+    alternative_title = alternative_title[
+                        :TITLE_SUFFIX.search(alternative_title).start()]
+    alternative_title = alternative_title.replace(
+        'JJJJMMDD', '', 1).replace('JJJJMM', '', 1)
+    alternative_title = BUS_PREFIX.sub('', alternative_title)
+    alternative_title = TAB_PREFIX.sub('', alternative_title)
+    return alternative_title.rstrip('_')
+
+
+IMPLEMENTATIONS = {
+    'original': original_clean_alternative_title,
+    'regex': regex_clean_alternative_title,
+    'current': clean_alternative_title,
+}
+
+
+def random_titles(count: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return [''.join(rng.choice(PIECES) for _ in range(rng.randrange(12)))
+            for _ in range(count)]
+
+
+def check(titles: list[str]) -> list[str]:
+    """ Returns the titles for which the implementations differ. """
+    return [title for title in titles
+            if len({clean(title) for clean in IMPLEMENTATIONS.values()}) > 1]
+
+
+def main() -> int:
+    dsc_titles = list(csv_to_dict(DSC_TABLE_CSV))
+    fuzzed = random_titles(200000)
+    for name, titles in (('tests', TEST_TITLES), ('DSC table', dsc_titles),
+                         ('random', fuzzed)):
+        different = check(titles)
+        print(f"{name}: {len(titles)} titles, {len(different)} different")
+        if different:
+            print(different[:10])
+            return 1
+
+    titles = dsc_titles + TEST_TITLES
+    print(f"per title, averaged over {len(titles)} titles")
+    results = {name: measure(lambda clean=clean: [clean(title)
+                                                  for title in titles],
+                             number=100)
+               for name, clean in IMPLEMENTATIONS.items()}
+    for result in results.values():
+        result["best_us"] /= len(titles)
+        result["median_us"] /= len(titles)
+    report(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
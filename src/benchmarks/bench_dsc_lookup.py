@@ -0,0 +1,53 @@
+""" DSC table lookups: the dictionary built from the CSV versus the
+compiled, memory-mapped table, for titles in the table and titles that are
+not. Also reports the Python heap used by each representation.
+"""
+import os
+import tempfile
+import tracemalloc
+
+from benchmarks.harness import measure, report
+from dsc_mmap import MappedDSCTable, build
+from utils import csv_to_dict
+
+DSC_TABLE_CSV = os.path.join(os.path.dirname(__file__), '..', 'data',
+                             'DSC_table.csv')
+
+
+def heap_size(load) -> tuple[object, int]:
+    tracemalloc.start()
+    table = load()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return table, size
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        table_file = os.path.join(directory, 'DSC_table.map')
+        build(csv_to_dict(DSC_TABLE_CSV), table_file)
+
+        dictionary, dictionary_heap = heap_size(
+            lambda: csv_to_dict(DSC_TABLE_CSV))
+        mapped, mapped_heap = heap_size(lambda: MappedDSCTable(table_file))
+        titles = list(dictionary)[::10]
+        missing = [f"{title}X" for title in titles]
+
+        report({
+            "dict hit": measure(lambda: [dictionary.get(title)
+                                         for title in titles]),
+            "mmap hit": measure(lambda: [mapped.get(title)
+                                         for title in titles]),
+            "dict miss": measure(lambda: [dictionary.get(title)
+                                          for title in missing]),
+            "mmap miss": measure(lambda: [mapped.get(title)
+                                          for title in missing]),
+        })
+        print(f"{len(titles)} lookups per call, {len(dictionary)} entries, "
+              f"table file {os.path.getsize(table_file)} bytes")
+        print(f"heap: dict {dictionary_heap} bytes, mmap {mapped_heap} bytes")
+        mapped.close()
+
+
+if __name__ == '__main__':
+    main()
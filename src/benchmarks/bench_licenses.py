@@ -0,0 +1,54 @@
+""" Per-call cost of license resolution: the original chain of uncompiled
+re.search calls versus the license table with its LRU cache.
+"""
+import re
+
+from benchmarks.harness import measure, report
+from licenses import LicenseResolver, LICENSE_TABLE_CSV
+
+URIS = [
+    'https://creativecommons.org/licenses/by/4.0/',
+    'https://creativecommons.org/licenses/by-nc-nd/4.0/',
+    'https://creativecommons.org/publicdomain/zero/1.0/',
+    'https://doi.org/10.17026/fp39-0x58',
+]
+
+
+def regex_chain(license_string):
+    dataset_lic = ''
+    if re.search(r'creativecommons', license_string):
+        if re.search(r'/by/4\.0', license_string):
+            dataset_lic = "CC BY 4.0"
+        elif re.search(r'/by-nc/4\.0', license_string):
+            dataset_lic = "CC BY-NC 4.0"
+        elif re.search(r'/by-sa/4\.0', license_string):
+            dataset_lic = "CC BY-SA 4.0"
+        elif re.search(r'/by-nc-sa/4\.0', license_string):
+            dataset_lic = "CC BY-NC-SA 4.0"
+        elif re.search(r'/by-nc-nd/4\.0', license_string):
+            dataset_lic = "CC BY-NC-ND 4.0"
+        elif re.search(r'/by-nd/4\.0', license_string):
+            dataset_lic = "CC BY-ND 4.0"
+        elif re.search(r'zero/1\.0', license_string):
+            dataset_lic = "CC0 1.0"
+    elif re.search(r'10\.17026/fp39-0x58', license_string):
+        dataset_lic = "DANS Licence"
+    return dataset_lic
+
+
+def main():
+    cached = LicenseResolver.from_csv(LICENSE_TABLE_CSV)
+    uncached = LicenseResolver.from_csv(LICENSE_TABLE_CSV, cache_size=0)
+    report({
+        "re.search chain": measure(
+            lambda: [regex_chain(uri) for uri in URIS]),
+        "combined pattern": measure(
+            lambda: [uncached.resolve(uri) for uri in URIS]),
+        "combined pattern + LRU": measure(
+            lambda: [cached.resolve(uri) for uri in URIS]),
+    })
+    print(cached.cache.stats())
+
+
+if __name__ == '__main__':
+    main()
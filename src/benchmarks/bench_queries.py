@@ -0,0 +1,43 @@
+""" Per-call cost of the CBS id lookup: re-parsing the expression on every
+call versus the precompiled expression from the queries registry.
+"""
+import jmespath
+from jmespath.parser import Parser
+
+from benchmarks.harness import measure, report
+from queries import CBS_ID_QUERY, search
+
+METADATA = {
+    "datasetVersion": {
+        "metadataBlocks": {
+            "citation": {
+                "fields": [{"typeName": f"field{index}", "value": "value"}
+                           for index in range(10)] + [
+                    {
+                        "typeName": "otherId",
+                        "value": [{"otherIdValue": {"value": "12345"}}]
+                    }
+                ]
+            }
+        }
+    }
+}
+
+
+def uncached_search():
+    Parser.purge()
+    return jmespath.search(CBS_ID_QUERY, METADATA)
+
+
+def main():
+    report({
+        "parse every call": measure(uncached_search, number=5000),
+        "jmespath.search": measure(
+            lambda: jmespath.search(CBS_ID_QUERY, METADATA), number=5000),
+        "compiled registry": measure(
+            lambda: search('cbs_id', METADATA), number=5000),
+    })
+
+
+if __name__ == '__main__':
+    main()
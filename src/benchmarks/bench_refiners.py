@@ -0,0 +1,133 @@
+""" Throughput of every refiner, its hot paths and the HTTP endpoints on
+synthetic documents (see benchmarks.documents).
+
+    python -m benchmarks.bench_refiners --size large -o before.json
+    python -m benchmarks.bench_refiners --size large --compare before.json
+
+Refiners change the metadata in place, so every call refines a fresh copy;
+the cost of that copy is reported as 'copy' and included in the 'refine/'
+and 'http/' rows. With --compare the run exits with status 1 if any
+benchmark got slower than the threshold.
+"""
+import argparse
+import os
+import sys
+from contextlib import ExitStack
+
+from fastapi.testclient import TestClient
+
+from benchmarks.documents import SIZES, make_document
+from benchmarks.harness import compare, measure, report, save
+from fast_json import dumps, loads
+from providers import PROVIDERS, refine
+from refiners.cbs_refiner import clean_alternative_title, \
+    refine_alternative_titles, refine_keywords, refine_statline_table
+from refiners.cid_refiner import refine_distribution_date
+from refiners.liss_refiner import update_topic_classifications
+from utils import add_contact_email, csv_to_dict, format_license
+
+DSC_TABLE_CSV = os.path.join(os.path.dirname(__file__), '..', 'data',
+                             'DSC_table.csv')
+
+
+def field_value(document: dict, block: str, type_name: str):
+    fields = document['datasetVersion']['metadataBlocks'][block]['fields']
+    return next(field['value'] for field in fields
+                if field['typeName'] == type_name)
+
+
+def refiner_benchmarks(document: dict, dsc_dictionary: dict) -> dict:
+    """ Benchmarks of the refine_*_metadata functions and their hot paths,
+    by name.
+    """
+    serialized = dumps(document)
+    benchmarks = {'copy': lambda: loads(serialized)}
+    for provider in PROVIDERS:
+        benchmarks[f'refine/{provider}'] = (
+            lambda provider=provider: refine(provider, loads(serialized),
+                                             dsc_dictionary))
+
+    titles = field_value(document, 'citation', 'alternativeTitle')
+    keywords = field_value(document, 'citation', 'keyword')
+    links = field_value(document, 'CBSMetadata', 'statlineTabel')
+    topics = dumps(field_value(document, 'citation', 'topicClassification'))
+    license_ = document['datasetVersion']['license']
+    context = {'dsc_dictionary': dsc_dictionary}
+    benchmarks.update({
+        'cbs/alternative_titles':
+            lambda: refine_alternative_titles(titles, context),
+        'cbs/clean_alternative_title':
+            lambda: [clean_alternative_title(title) for title in titles],
+        'cbs/keywords': lambda: refine_keywords(keywords),
+        'cbs/statline': lambda: refine_statline_table(links),
+        'cid/distribution_date':
+            lambda: refine_distribution_date('2023-10-29T07:58:43.398551'),
+        'datastation/license': lambda: format_license(license_),
+        'liss/topic_classifications':
+            lambda: update_topic_classifications(loads(topics), {}),
+        'sicada/contact_email':
+            lambda: add_contact_email(loads(serialized), 'info@sicada.nl'),
+    })
+    return benchmarks
+
+
+def http_benchmarks(client: TestClient, document: dict) -> dict:
+    """ Benchmarks of the single document endpoints, by name. """
+    body = dumps({"metadata": document})
+    headers = {'content-type': 'application/json'}
+
+    def post(provider: str):
+        response = client.post(f'/metadata-refinement/{provider}',
+                               content=body, headers=headers)
+        assert response.status_code == 200, response.text
+
+    return {f'http/{provider}': (lambda provider=provider: post(provider))
+            for provider in PROVIDERS}
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', choices=SIZES, default='medium')
+    parser.add_argument('-k', '--only', default='',
+                        help="Only run benchmarks whose name contains this.")
+    parser.add_argument('--no-http', action='store_true',
+                        help="Skip the HTTP endpoint benchmarks.")
+    parser.add_argument('-o', '--output', help="Save the results as JSON.")
+    parser.add_argument('--compare', help="JSON results to compare with.")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Slowdown that counts as a regression.")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    dsc_dictionary = csv_to_dict(DSC_TABLE_CSV)
+    document = make_document(**SIZES[args.size],
+                             dsc_titles=list(dsc_dictionary))
+    print(f"document size: {len(dumps(document)) / 1024:.1f} KiB")
+
+    benchmarks = refiner_benchmarks(document, dsc_dictionary)
+    with ExitStack() as stack:
+        if not args.no_http:
+            # The app finds its DSC table relative to the working directory.
+            os.chdir(os.path.join(os.path.dirname(__file__), '..'))
+            from main import app
+            client = stack.enter_context(TestClient(app))
+            benchmarks.update(http_benchmarks(client, document))
+
+        results = {name: measure(func, number=None, repeat=args.repeat)
+                   for name, func in benchmarks.items()
+                   if args.only in name}
+    report(results)
+
+    if args.output:
+        save(results, args.output, size=args.size)
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): "
+                  f"{', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
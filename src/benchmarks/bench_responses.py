@@ -0,0 +1,61 @@
+""" Latency (p50/p99) and peak RSS of encoding a large refined CBS document:
+FastAPI's default path (jsonable_encoder + JSONResponse) versus
+RefinedJSONResponse. Every variant runs in a fresh process so the peak RSS
+of one does not hide the other.
+"""
+import multiprocessing
+import resource
+import statistics
+import time
+
+from benchmarks.bench_input_parsing import make_body
+
+REPEAT = 30
+
+
+def default_response(content):
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def refined_response(content):
+    from responses import RefinedJSONResponse
+    return RefinedJSONResponse(content).body
+
+
+def run(name, results):
+    from fast_json import loads
+    encode = globals()[name]
+    content = loads(make_body())["metadata"]
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        encode(content)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    results[name] = {
+        "p50_ms": statistics.median(timings),
+        "p99_ms": timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+        "peak_rss_delta_kib": resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss - baseline_rss,
+    }
+
+
+def main():
+    context = multiprocessing.get_context('spawn')
+    with context.Manager() as manager:
+        results = manager.dict()
+        for name in ('default_response', 'refined_response'):
+            process = context.Process(target=run, args=(name, results))
+            process.start()
+            process.join()
+        for name, result in results.items():
+            print(f"{name:<17} p50 {result['p50_ms']:7.2f} ms  "
+                  f"p99 {result['p99_ms']:7.2f} ms  "
+                  f"peak RSS +{result['peak_rss_delta_kib']} KiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+""" Generator for synthetic Dataverse JSON documents of a configurable size.
+
+The documents have the shape of a Dataverse dataset export and contain the
+fields every refiner works on, so one document can be refined by all
+providers:
+
+- citation: alternativeTitle, keyword, otherId, distributionDate,
+  topicClassification, datasetContact and `fields` filler fields.
+- CBSMetadata: statlineTabel.
+- datasetVersion: license, datasetPersistentId and dataAccessPlace.
+
+Documents are deterministic for a given seed.
+"""
+import random
+
+# Presets for the benchmarks, from a typical record to a very large one.
+SIZES = {
+    'small': dict(fields=10, keywords=5, alternative_titles=2,
+                  statline_links=5, topic_classifications=5),
+    'medium': dict(fields=200, keywords=50, alternative_titles=20,
+                   statline_links=50, topic_classifications=50),
+    'large': dict(fields=2000, keywords=1000, alternative_titles=200,
+                  statline_links=1000, topic_classifications=500),
+}
+
+TITLE_SUFFIXES = ('JJJJVV', 'VV', 'JJJJ', 'JJJJMMDDTABVV', 'JJJJMMBUSVV',
+                  'JJJJBUS', 'VVTAB', '_JJJJMM', '')
+
+
+def primitive(type_name: str, value, multiple: bool = False) -> dict:
+    return {"typeName": type_name, "multiple": multiple,
+            "typeClass": "primitive", "value": value}
+
+
+def compound(type_name: str, value: list) -> dict:
+    return {"typeName": type_name, "multiple": True,
+            "typeClass": "compound", "value": value}
+
+
+def make_document(fields: int = 10, keywords: int = 5,
+                  alternative_titles: int = 2, statline_links: int = 5,
+                  topic_classifications: int = 5,
+                  dsc_titles: list[str] | None = None,
+                  seed: int = 0) -> dict:
+    """ Builds a synthetic Dataverse JSON document.
+
+    :param fields: Number of filler citation fields no refiner touches.
+    :param keywords: Number of keywords, a third of them contain '/'.
+    :param alternative_titles: Number of alternative titles.
+    :param statline_links: Number of statline links, half of them bare
+        table ids.
+    :param topic_classifications: Number of topic classifications.
+    :param dsc_titles: Titles from the DSC table. When given, half of the
+        alternative titles are taken from it, the others are cleaned.
+    :param seed: Seed of the random generator.
+    :return: The document.
+    """
+    rng = random.Random(seed)
+    doi = f"10.57934/{rng.randrange(10 ** 6):06d}"
+
+    titles = []
+    for index in range(alternative_titles):
+        if dsc_titles and index % 2 == 0:
+            titles.append(rng.choice(dsc_titles))
+        else:
+            titles.append(f"Table{rng.randrange(10 ** 4)}"
+                          f"{rng.choice(TITLE_SUFFIXES)}")
+
+    keyword_values = []
+    for index in range(keywords):
+        value = f"keyword {index}"
+        if index % 3 == 0:
+            value = f"{value}/sub {index}/detail {index}"
+        keyword_values.append({
+            "keywordValue": primitive("keywordValue", value),
+            "keywordVocabulary": primitive("keywordVocabulary", "ELSST"),
+        })
+
+    links = [f"https://opendata.cbs.nl/#/CBS/nl/dataset/{index}NED"
+             if index % 2 else f"{index}NED"
+             for index in range(statline_links)]
+
+    topics = [{"topicClassValue": primitive(
+        "topicClassValue", f"Topic {index} (LISS/ELSST)")}
+        for index in range(topic_classifications)]
+
+    citation = [
+        primitive("title", "Synthetic dataset"),
+        primitive("alternativeTitle", titles, multiple=True),
+        compound("otherId", [{
+            "otherIdAgency": primitive("otherIdAgency", "CBS"),
+            "otherIdValue": primitive("otherIdValue", doi.split('/')[1]),
+        }]),
+        compound("keyword", keyword_values),
+        compound("topicClassification", topics),
+        primitive("distributionDate", "2023-10-29T07:58:43.398551"),
+        compound("datasetContact", [{
+            "datasetContactName": primitive("datasetContactName", "Contact")
+        }]),
+    ]
+    citation.extend(compound(f"variable{index}", [{
+        "label": primitive("label", f"Label {index}"),
+        "codes": primitive("codes", list(range(10)), multiple=True),
+    }]) for index in range(fields))
+
+    return {
+        "id": rng.randrange(10 ** 6),
+        "persistentUrl": f"https://doi.org/{doi}",
+        "protocol": "doi",
+        "authority": doi.split('/')[0],
+        "publisher": "Synthetic",
+        "datasetVersion": {
+            "datasetPersistentId": f"doi:{doi}",
+            "versionState": "RELEASED",
+            "license": {
+                "name": "CC BY 4.0",
+                "uri": "http://creativecommons.org/licenses/by/4.0",
+            },
+            "dataAccessPlace": "https://example.org",
+            "metadataBlocks": {
+                "citation": {"displayName": "Citation Metadata",
+                             "name": "citation", "fields": citation},
+                "CBSMetadata": {"displayName": "CBS Metadata",
+                                "name": "CBSMetadata", "fields": [
+                                    primitive("statlineTabel", links,
+                                              multiple=True)]},
+            },
+        },
+    }
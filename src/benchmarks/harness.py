@@ -0,0 +1,80 @@
+import json
+import platform
+import statistics
+import time
+import timeit
+
+
+def measure(func, number: int | None = 10000, repeat: int = 5) -> dict:
+    """ Times `func` and returns per-call statistics in microseconds.
+
+    :param func: Callable without arguments to time.
+    :param number: Calls per measurement, or None to pick a number of calls
+        that takes at least 0.2 seconds.
+    :param repeat: Number of measurements.
+    """
+    if number is None:
+        number, _ = timeit.Timer(func).autorange()
+    timings = timeit.repeat(func, number=number, repeat=repeat)
+    per_call = [timing / number * 1e6 for timing in timings]
+    return {
+        "number": number,
+        "repeat": repeat,
+        "best_us": min(per_call),
+        "median_us": statistics.median(per_call),
+    }
+
+
+def report(results: dict[str, dict]) -> None:
+    """ Prints a table of `measure` results, with the speedup of every row
+    relative to the first one.
+    """
+    baseline = next(iter(results.values()))["best_us"]
+    width = max(len(name) for name in results)
+    for name, result in results.items():
+        speedup = baseline / result["best_us"] if result["best_us"] else 0
+        print(f"{name:<{width}}  best {result['best_us']:8.3f} us  "
+              f"median {result['median_us']:8.3f} us  x{speedup:.2f}")
+
+
+def save(results: dict[str, dict], filename: str, **meta) -> None:
+    """ Writes `measure` results to a JSON file, with the Python version,
+    the platform and `meta` so runs can be told apart.
+    """
+    document = {
+        "meta": {"python": platform.python_version(),
+                 "platform": platform.platform(),
+                 "time": time.strftime('%Y-%m-%dT%H:%M:%S%z'), **meta},
+        "results": results,
+    }
+    with open(filename, 'w') as file:
+        json.dump(document, file, indent=2)
+
+
+def compare(results: dict[str, dict], filename: str,
+            threshold: float = 0.1) -> list[str]:
+    """ Compares `measure` results with a run saved by `save`.
+
+    Prints the change of the best time of every benchmark in both runs.
+
+    :param results: The results of this run.
+    :param filename: The JSON file of the baseline run.
+    :param threshold: Relative slowdown that counts as a regression.
+    :return: The names of the benchmarks that regressed.
+    """
+    with open(filename) as file:
+        baseline = json.load(file)["results"]
+    regressions = []
+    width = max(len(name) for name in results)
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<{width}}  new")
+            continue
+        before, after = baseline[name]["best_us"], result["best_us"]
+        change = (after - before) / before if before else 0.0
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<{width}}  {before:10.3f} -> {after:10.3f} us  "
+              f"{change:+7.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
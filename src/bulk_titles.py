@@ -0,0 +1,169 @@
+""" Bulk refinement of alternative titles, for reconciling a CBS catalog
+with the DSC table.
+
+    python -m bulk_titles titles.txt -o refined.csv --unmapped unmapped.csv
+
+Titles are deduplicated, looked up in the DSC table and the titles that are
+not in it are cleaned all at once: with pyarrow's string kernels when
+pyarrow is installed, else with clean_alternative_title per title. The
+result is the same as calling refine_alternative_title on every title.
+"""
+import argparse
+import csv
+import itertools
+import os
+import sys
+from collections import Counter
+from collections.abc import Iterable, Mapping
+from typing import NamedTuple
+
+from refiners.cbs_refiner import clean_alternative_title
+from utils import csv_to_dict
+
+try:
+    import pyarrow
+    import pyarrow.compute
+except ImportError:
+    pyarrow = None
+
+DSC_TABLE_CSV = os.environ.get('DSC_TABLE_CSV', 'data/DSC_table.csv')
+DSC_TABLE_HEADER = ['BMO korte naam', 'DSC kortenaam']
+# Characters of a CSV the dialect is sniffed from.
+SNIFF_SIZE = 4096
+
+
+class TitleReport(NamedTuple):
+    """ The refined titles, in the order of the input, and what matched. """
+    refined: list[str]
+    # Number of input titles that were (not) in the DSC table.
+    matched: int
+    missed: int
+    # (title, cleaned title) of every distinct title not in the DSC table.
+    unmapped: list[tuple[str, str]]
+
+
+def clean_titles(titles: list[str]) -> list[str]:
+    """ Cleans titles like clean_alternative_title, vectorized if possible.
+
+    pyarrow's upper-casing only agrees with str.upper for ASCII, so other
+    titles are cleaned one by one.
+    """
+    if pyarrow is None:
+        return [clean_alternative_title(title) for title in titles]
+
+    ascii_titles = [title for title in titles if title.isascii()]
+    cleaned = dict(zip(ascii_titles, _clean_ascii(ascii_titles)))
+    return [cleaned[title] if title in cleaned
+            else clean_alternative_title(title) for title in titles]
+
+
+def _clean_ascii(titles: list[str]) -> list[str]:
+    """ The steps of clean_alternative_title as pyarrow string kernels. """
+    compute = pyarrow.compute
+    array = compute.ascii_upper(pyarrow.array(titles, pyarrow.string()))
+    for suffix in ('VV', 'JJJJ'):
+        array = compute.if_else(
+            compute.ends_with(array, suffix),
+            compute.utf8_slice_codeunits(array, 0, -len(suffix)), array)
+    for code in ('JJJJMMDD', 'JJJJMM'):
+        array = compute.replace_substring(array, code, '',
+                                          max_replacements=1)
+    for code in ('JJJJBUS', 'VVBUS', 'JJJJTAB', 'VVTAB'):
+        array = compute.replace_substring(array, code, code[-3:])
+    return compute.ascii_rtrim(array, characters='_').to_pylist()
+
+
+def refine_titles(titles: Iterable[str],
+                  dsc_dictionary: Mapping[str, str]) -> TitleReport:
+    """ Refines a column of alternative titles.
+
+    :param titles: The titles, duplicates are refined once.
+    :param dsc_dictionary: DSC dictionary containing refined alt titles.
+    :return: The refined titles and the match report.
+    """
+    titles = list(titles)
+    # Counter doubles as the deduplication, in a single pass in C.
+    counts = Counter(titles)
+    refined = {}
+    missing = []
+    for title in counts:
+        try:
+            refined[title] = dsc_dictionary[title]
+        except KeyError:
+            missing.append(title)
+    cleaned = clean_titles(missing)
+    refined.update(zip(missing, cleaned))
+
+    missed = sum(counts[title] for title in missing)
+    return TitleReport(refined=list(map(refined.__getitem__, titles)),
+                       matched=len(titles) - missed, missed=missed,
+                       unmapped=list(zip(missing, cleaned)))
+
+
+def read_titles(filename: str, column: str | None = None) -> list[str]:
+    """ Reads titles from a text file, one per line, or from a column of a
+    CSV file. '-' reads lines from stdin.
+    """
+    file = sys.stdin if filename == '-' else open(filename, newline='')
+    try:
+        if column is None:
+            return [line.rstrip('\r\n') for line in file if line.strip()]
+        # Sniffed from the first lines, which are then read again, so stdin
+        # and pipes work without seeking.
+        sample = []
+        size = 0
+        for line in file:
+            sample.append(line)
+            size += len(line)
+            if size >= SNIFF_SIZE:
+                break
+        dialect = csv.Sniffer().sniff(''.join(sample), delimiters=',;\t')
+        rows = csv.DictReader(itertools.chain(sample, file), dialect=dialect)
+        return [row[column] for row in rows if row.get(column)]
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m bulk_titles',
+        description='Refines alternative titles in bulk and reports the '
+                    'titles missing from the DSC table.')
+    parser.add_argument('titles', help="Titles, one per line, or '-'.")
+    parser.add_argument('--column',
+                        help="Read the titles from this column of a CSV.")
+    parser.add_argument('--dsc-table', default=DSC_TABLE_CSV)
+    parser.add_argument('-o', '--output',
+                        help="Write title;refined;matched rows to this CSV.")
+    parser.add_argument('--unmapped',
+                        help="Write the titles missing from the DSC table to "
+                             "this CSV, in the format of the DSC table.")
+    args = parser.parse_args(argv)
+
+    titles = read_titles(args.titles, args.column)
+    dsc_dictionary = csv_to_dict(args.dsc_table)
+    report = refine_titles(titles, dsc_dictionary)
+
+    if args.output:
+        with open(args.output, 'w', newline='') as file:
+            writer = csv.writer(file, delimiter=';')
+            writer.writerow(['title', 'refined', 'matched'])
+            writer.writerows((title, refined, title in dsc_dictionary)
+                             for title, refined in zip(titles,
+                                                       report.refined))
+    if args.unmapped:
+        with open(args.unmapped, 'w', newline='') as file:
+            writer = csv.writer(file, delimiter=';')
+            writer.writerow(DSC_TABLE_HEADER)
+            writer.writerows((cleaned, title)
+                             for title, cleaned in report.unmapped)
+
+    print(f"{len(titles)} titles, {report.matched} matched, "
+          f"{report.missed} missed, {len(report.unmapped)} unmapped "
+          f"distinct titles", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,372 @@
+""" Streaming refinement of (very) large CBS documents.
+
+    python -m cbs_stream export.json -o refined.json
+
+refine_cbs_metadata needs the whole document in memory, but only changes a
+few fields. StreamingCBSRefiner parses the document as a stream of JSON
+events (with ijson) and writes them back out as they come, except for:
+
+- the fields of the metadata blocks the CBS rules apply to. A field is
+  buffered until its typeName is known; fields the rules target (and
+  otherId, which holds the CBS id) are built as objects, refined with the
+  CBS rules and written out, all other fields are passed through.
+- datasetVersion.dataAccessPlace, which needs the CBS id. It is held back
+  and written as the last key of datasetVersion.
+
+Memory use is bounded by the largest targeted field instead of the size of
+the document. The output is the JSON of refine_cbs_metadata, but for the
+position of dataAccessPlace. Needs ijson.
+"""
+import argparse
+import sys
+from collections.abc import AsyncIterable, AsyncIterator, Mapping
+from typing import Any, BinaryIO
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from fast_json import dumps
+from refiners.cbs_refiner import CBS_ID
+from rules import plan_for
+from utils import add_doi_to_dab_link, csv_to_dict
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+CHUNK_SIZE = 64 * 1024
+
+_MISSING = object()
+
+# Path of the fields array of a metadata block; None matches any key.
+FIELDS_PATH = ('datasetVersion', 'metadataBlocks', None, 'fields', '[]')
+
+
+class JSONWriter:
+    """ Writes JSON text from ijson's basic_parse events.
+
+    A comma goes before every key and value, except at the start of the
+    document or of a container, and after a key.
+    """
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._open = True
+
+    def event(self, event: str, value: Any) -> None:
+        if event == 'end_map' or event == 'end_array':
+            self._chunks.append(b'}' if event == 'end_map' else b']')
+            self._open = False
+            return
+        if not self._open:
+            self._chunks.append(b',')
+        if event == 'map_key':
+            self._chunks.append(dumps(value) + b':')
+            self._open = True
+        elif event == 'start_map' or event == 'start_array':
+            self._chunks.append(b'{' if event == 'start_map' else b'[')
+            self._open = True
+        else:
+            self._chunks.append(dumps(value))
+            self._open = False
+
+    def value(self, value: Any) -> None:
+        """ Writes a complete value. """
+        if not self._open:
+            self._chunks.append(b',')
+        self._chunks.append(dumps(value))
+        self._open = False
+
+    def subtree(self, events: list, index: int, depth: int
+                ) -> tuple[int, int]:
+        """ Writes events from `index` until `depth` open containers are
+        closed, or the events run out.
+
+        This is `event` in a loop, for the bulk of a document that is copied
+        as is.
+
+        :return: The index of the next event and the remaining depth.
+        """
+        chunks = self._chunks
+        is_open = self._open
+        for index in range(index, len(events)):
+            event, value = events[index]
+            if event == 'end_map' or event == 'end_array':
+                chunks.append(b'}' if event == 'end_map' else b']')
+                is_open = False
+                depth -= 1
+                if depth == 0:
+                    break
+                continue
+            if not is_open:
+                chunks.append(b',')
+            if event == 'map_key':
+                chunks.append(dumps(value) + b':')
+                is_open = True
+            elif event == 'start_map' or event == 'start_array':
+                chunks.append(b'{' if event == 'start_map' else b'[')
+                is_open = True
+                depth += 1
+            else:
+                chunks.append(dumps(value))
+                is_open = False
+        self._open = is_open
+        return index + 1, depth
+
+    def take(self) -> bytes:
+        """ Returns and clears the text written so far. """
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class StreamingCBSRefiner:
+    """ Push parser refining a CBS document chunk by chunk.
+
+    Feed the document with `feed`, which returns the output that is ready,
+    and finish with `close`, which returns the rest.
+    """
+
+    def __init__(self, dsc_dictionary: Mapping[str, str]):
+        if ijson is None:
+            raise RuntimeError("Streaming refinement requires ijson.")
+        self.context = {'dsc_dictionary': dsc_dictionary}
+        self.plan = plan_for('cbs')
+        # Blocks whose fields are read: the blocks with rules and citation,
+        # which holds otherId.
+        self.blocks = set(self.plan.blocks) | {'citation'}
+        self.writer = JSONWriter()
+        self._events = ijson.sendable_list()
+        self._parser = ijson.basic_parse_coro(self._events, use_float=True)
+        self._path: list = []
+        self._seen: set[tuple[str, str]] = set()
+        self._has_blocks = False
+        self._cbs_id = None
+        # Open containers of the subtree being copied as is.
+        self._pass_depth = 0
+        # The field being buffered: its block, events and nesting depth.
+        self._field_block = None
+        self._field_events: list = []
+        self._depth = 0
+        # The events of dataAccessPlace while it is read, then its value.
+        self._access_place: list | None = None
+        self._access_place_depth = 0
+        self._access_place_value = _MISSING
+
+    def feed(self, chunk: bytes) -> bytes:
+        if not chunk:
+            # An empty chunk would end the parser, which is close's job.
+            return b''
+        self._parser.send(chunk)
+        self._process()
+        return self.writer.take()
+
+    def close(self) -> bytes:
+        """ Ends the document.
+
+        :raises HTTPException: Raises a 422 if the document has no
+            datasetVersion.metadataBlocks, like refine_cbs_metadata.
+        """
+        self._parser.close()
+        self._process()
+        self._check_blocks()
+        return self.writer.take()
+
+    def _check_blocks(self) -> None:
+        if not self._has_blocks:
+            raise HTTPException(status_code=422, detail="'metadataBlocks'")
+
+    def _process(self) -> None:
+        events = self._events
+        index = 0
+        while index < len(events):
+            if self._pass_depth:
+                index, self._pass_depth = self.writer.subtree(
+                    events, index, self._pass_depth)
+                continue
+            event, value = events[index]
+            index += 1
+            if self._field_block is not None:
+                self._field_event(event, value)
+            elif self._access_place is not None:
+                self._access_place_event(event, value)
+            else:
+                self._document_event(event, value)
+        del events[:]
+
+    def _document_event(self, event: str, value: Any) -> None:
+        path = self._path
+        if event == 'map_key':
+            path[-1] = value
+            if len(path) == 2 and path[0] == 'datasetVersion':
+                if value == 'dataAccessPlace':
+                    self._access_place = []
+                    self._access_place_depth = 0
+                    return
+                if value == 'metadataBlocks':
+                    self._has_blocks = True
+        elif event == 'start_map' or event == 'start_array':
+            if event == 'start_map' and self._at_fields(path):
+                self._field_block = path[2]
+                self._field_events = [(event, value)]
+                self._depth = 1
+                return
+            if not self._leads_to_fields(path):
+                self.writer.event(event, value)
+                self._pass_depth = 1
+                return
+            path.append(None if event == 'start_map' else '[]')
+        elif event == 'end_map' or event == 'end_array':
+            if event == 'end_map' and len(path) == 2 \
+                    and path[0] == 'datasetVersion':
+                self._write_access_place()
+            # Fail before the document is complete, so a streamed response
+            # is cut off instead of looking valid.
+            if len(path) == 1:
+                self._check_blocks()
+            path.pop()
+        self.writer.event(event, value)
+
+    def _at_fields(self, path: list) -> bool:
+        return len(path) == len(FIELDS_PATH) and path[2] in self.blocks \
+            and all(expected is None or key == expected
+                    for key, expected in zip(path, FIELDS_PATH))
+
+    def _leads_to_fields(self, path: list) -> bool:
+        """ Whether a container at `path` can hold fields that are read. """
+        if len(path) >= len(FIELDS_PATH):
+            return False
+        for key, expected in zip(path, FIELDS_PATH):
+            if expected is None:
+                if key not in self.blocks:
+                    return False
+            elif key != expected:
+                return False
+        return True
+
+    def _field_event(self, event: str, value: Any) -> None:
+        if event == 'start_map' or event == 'start_array':
+            self._depth += 1
+        elif event == 'end_map' or event == 'end_array':
+            self._depth -= 1
+        self._field_events.append((event, value))
+
+        if self._depth == 0:
+            self._write_field(_build(self._field_events))
+            self._field_block = None
+            self._field_events = []
+        # Dataverse writes typeName first: fields that are not refined are
+        # copied from there on.
+        elif len(self._field_events) == 3 and self._field_events[1] == (
+                'map_key', 'typeName') and not self._targeted(value):
+            for buffered in self._field_events:
+                self.writer.event(*buffered)
+            self._pass_depth = self._depth
+            self._field_block = None
+            self._field_events = []
+
+    def _targeted(self, type_name: Any) -> bool:
+        if self._field_block == 'citation' and type_name == 'otherId':
+            return True
+        return type_name in self.plan.blocks.get(self._field_block, ())
+
+    def _write_field(self, field: dict) -> None:
+        block = self._field_block
+        type_name = field.get('typeName')
+        if block == 'citation' and type_name == 'otherId' \
+                and not self._cbs_id:
+            self._cbs_id = CBS_ID.search({'datasetVersion': {
+                'metadataBlocks': {'citation': {'fields': [field]}}}})
+
+        rules = self.plan.blocks.get(block, {}).get(type_name, ())
+        first = (block, type_name) not in self._seen
+        self._seen.add((block, type_name))
+        for rule in rules:
+            if (rule.all_fields or first) and 'value' in field:
+                field['value'] = rule.transform(field['value'], self.context)
+        self.writer.value(field)
+
+    def _access_place_event(self, event: str, value: Any) -> None:
+        self._access_place.append((event, value))
+        if event in ('start_map', 'start_array'):
+            self._access_place_depth += 1
+        elif event in ('end_map', 'end_array'):
+            self._access_place_depth -= 1
+        if self._access_place_depth == 0:
+            self._access_place_value = _build(self._access_place)
+            self._access_place = None
+
+    def _write_access_place(self) -> None:
+        if self._access_place_value is _MISSING:
+            return
+        dataset_version = {'dataAccessPlace': self._access_place_value}
+        if self._cbs_id:
+            add_doi_to_dab_link({'datasetVersion': dataset_version},
+                                "doi:10.57934/" + self._cbs_id)
+        self.writer.event('map_key', 'dataAccessPlace')
+        self.writer.value(dataset_version['dataAccessPlace'])
+        self._access_place_value = _MISSING
+
+
+def _build(events: list) -> Any:
+    builder = ijson.ObjectBuilder()
+    for event, value in events:
+        builder.event(event, value)
+    return builder.value
+
+
+def refine_cbs_file(source: BinaryIO, target: BinaryIO,
+                    dsc_dictionary: Mapping[str, str],
+                    chunk_size: int = CHUNK_SIZE) -> None:
+    """ Refines a CBS document from one binary file into another. """
+    refiner = StreamingCBSRefiner(dsc_dictionary)
+    while chunk := source.read(chunk_size):
+        target.write(refiner.feed(chunk))
+    target.write(refiner.close())
+
+
+async def refine_cbs_chunks(chunks: AsyncIterable[bytes],
+                            dsc_dictionary: Mapping[str, str]
+                            ) -> AsyncIterator[bytes]:
+    """ Refines a CBS document arriving as a stream of byte chunks.
+
+    Parsing and refining run on the thread pool, so a large document does
+    not block the event loop.
+    """
+    refiner = StreamingCBSRefiner(dsc_dictionary)
+    async for chunk in chunks:
+        output = await run_in_threadpool(refiner.feed, chunk)
+        if output:
+            yield output
+    yield await run_in_threadpool(refiner.close)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m cbs_stream',
+        description='Refines a large CBS document without loading it.')
+    parser.add_argument('input', help="The document, or '-' for stdin.")
+    parser.add_argument('-o', '--output', default='-',
+                        help="The refined document, or '-' for stdout.")
+    parser.add_argument('--dsc-table', default='data/DSC_table.csv')
+    args = parser.parse_args(argv)
+
+    source = sys.stdin.buffer if args.input == '-' else open(args.input,
+                                                             'rb')
+    target = sys.stdout.buffer if args.output == '-' else open(args.output,
+                                                               'wb')
+    try:
+        refine_cbs_file(source, target, csv_to_dict(args.dsc_table))
+    except HTTPException as error:
+        print(f"{error.status_code}: {error.detail}", file=sys.stderr)
+        return 1
+    finally:
+        for file in (source, target):
+            if file not in (sys.stdin.buffer, sys.stdout.buffer):
+                file.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
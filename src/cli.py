@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator
+
+from fastapi import HTTPException
+
+from providers import PROVIDERS, refine, uses_dsc_table
+from utils import csv_to_dict
+
+DSC_TABLE_CSV = os.environ.get('DSC_TABLE_CSV', 'data/DSC_table.csv')
+
+# Set per (worker) process by init_worker.
+_provider = None
+_dsc_dictionary = None
+
+
+def read_records(source: str) -> Iterator[tuple[str, str]]:
+    """ Yields (name, raw JSON) records from a directory, JSONL file or stdin.
+
+    A directory yields one record per `*.json` file, named after the file.
+    A JSONL file or stdin ('-') yields one record per non-empty line, named
+    after the line number.
+    """
+    if os.path.isdir(source):
+        for filename in sorted(os.listdir(source)):
+            if filename.endswith('.json'):
+                with open(os.path.join(source, filename)) as file:
+                    yield filename, file.read()
+        return
+
+    file = sys.stdin if source == '-' else open(source)
+    try:
+        for number, line in enumerate(file, start=1):
+            if line.strip():
+                yield str(number), line
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+def init_worker(provider: str, dsc_table_csv: str | None) -> None:
+    global _provider, _dsc_dictionary
+    _provider = provider
+    if dsc_table_csv and uses_dsc_table(provider):
+        _dsc_dictionary = csv_to_dict(dsc_table_csv)
+
+
+def refine_record(record: tuple[str, str]) -> tuple[str, str | None, str]:
+    """ Refines a single raw record in the current worker.
+
+    :return: Tuple of the record name, the refined JSON (or None on failure)
+        and an error message (empty on success).
+    """
+    name, raw = record
+    try:
+        refined = refine(_provider, json.loads(raw), _dsc_dictionary)
+    except HTTPException as error:
+        return name, None, f"{error.status_code}: {error.detail}"
+    except Exception as error:
+        return name, None, f"{type(error).__name__}: {error}"
+    return name, json.dumps(refined, ensure_ascii=False), ''
+
+
+def refine_batch(records: list[tuple[str, str]]
+                 ) -> list[tuple[str, str | None, str]]:
+    return [refine_record(record) for record in records]
+
+
+def refine_records(records: Iterable[tuple[str, str]], provider: str,
+                   dsc_table_csv: str | None, workers: int = 1,
+                   chunksize: int = 16, mp_context=None
+                   ) -> Iterator[tuple[str, str | None, str]]:
+    """ Refines records in order, in-process or with a pool of processes.
+
+    With a pool, at most a few chunks per worker are in flight at any time,
+    so the input is read lazily instead of being submitted all at once.
+    `mp_context` is the multiprocessing context of the pool, e.g. spawn
+    when called from a threaded process.
+    """
+    if workers <= 1:
+        init_worker(provider, dsc_table_csv)
+        yield from map(refine_record, records)
+        return
+
+    records = iter(records)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context,
+                             initializer=init_worker,
+                             initargs=(provider, dsc_table_csv)) as pool:
+        pending = deque()
+        while True:
+            while len(pending) < workers * 2:
+                chunk = list(islice(records, chunksize))
+                if not chunk:
+                    break
+                pending.append(pool.submit(refine_batch, chunk))
+            if not pending:
+                return
+            yield from pending.popleft().result()
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='python -m refiner',
+        description='Refines Dataverse JSON metadata without the API.')
+    parser.add_argument('provider', choices=PROVIDERS)
+    parser.add_argument('input',
+                        help="Directory of JSON files, JSONL file or '-' "
+                             "for JSONL on stdin.")
+    parser.add_argument('-o', '--output', default='-',
+                        help="Output directory for directory input, "
+                             "otherwise a JSONL file or '-' for stdout.")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of worker processes.')
+    parser.add_argument('--dsc-table', default=DSC_TABLE_CSV,
+                        help='Path to the DSC table CSV (CBS only).')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    to_directory = os.path.isdir(args.input) and args.output != '-'
+    if to_directory:
+        os.makedirs(args.output, exist_ok=True)
+        out = None
+    else:
+        out = sys.stdout if args.output == '-' else open(args.output, 'w')
+
+    start = time.perf_counter()
+    total = failed = 0
+    try:
+        results = refine_records(read_records(args.input), args.provider,
+                                 args.dsc_table, args.workers)
+        for name, refined, error in results:
+            total += 1
+            if refined is None:
+                failed += 1
+                print(f"{name}: {error}", file=sys.stderr)
+            elif to_directory:
+                with open(os.path.join(args.output, name), 'w') as file:
+                    file.write(refined)
+            else:
+                out.write(refined + '\n')
+    finally:
+        if out is not None and out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed else 0.0
+    print(f"Refined {total - failed}/{total} records in {elapsed:.2f}s "
+          f"({rate:.1f} records/s, {failed} failed)", file=sys.stderr)
+    return 1 if failed else 0
@@ -0,0 +1,136 @@
+""" A compiled, memory-mapped DSC table.
+
+The file is built from the DSC CSV with
+`python -m dsc_mmap data/DSC_table.csv data/DSC_table.map` and holds the
+entries sorted by title, so lookups are a binary search over the mapped
+pages. All processes mapping the same file share it through the page cache
+instead of each holding its own dictionary.
+
+Layout (little-endian):
+    8 bytes      magic b'DSCMAP2\0'
+    8 bytes      number of entries n
+    8*(2n+1)     offsets of the start of every title and refined title, the
+                 last one being the end of the data
+    entries      title (UTF-8) followed by its refined title (UTF-8)
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from collections.abc import Mapping
+from typing import Iterator
+
+from utils import csv_to_dict
+
+MAGIC = b'DSCMAP2\0'
+HEADER = struct.Struct('<8sQ')
+OFFSET = struct.Struct('<Q')
+
+
+def build(entries: dict[str, str], filename: str) -> None:
+    """ Writes entries to a compiled table, atomically replacing filename.
+    """
+    records = sorted((title.encode('utf-8'), refined.encode('utf-8'))
+                     for title, refined in entries.items())
+    position = HEADER.size + OFFSET.size * (2 * len(records) + 1)
+    offsets = []
+    for title, refined in records:
+        offsets.append(position)
+        offsets.append(position + len(title))
+        position += len(title) + len(refined)
+    offsets.append(position)
+
+    temporary = f"{filename}.tmp"
+    with open(temporary, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, len(records)))
+        file.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+        for title, refined in records:
+            file.write(title + refined)
+    os.replace(temporary, filename)
+
+
+class MappedDSCTable(Mapping):
+    """ Read-only mapping of title to refined title over a compiled table.
+    """
+
+    def __init__(self, filename: str):
+        if sys.byteorder != 'little':
+            raise ValueError("Compiled DSC tables need a little-endian host.")
+        with open(filename, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f"{filename} is not a compiled DSC table.")
+        # A view on the mapped offsets, not a copy.
+        self._offsets = memoryview(self._map)[
+            HEADER.size:HEADER.size + OFFSET.size * (2 * self._count + 1)
+        ].cast('Q')
+
+    def _search(self, title: str) -> int:
+        """ The index of title in the table, or -1 if it is not there. """
+        key = title.encode('utf-8')
+        data, offsets = self._map, self._offsets
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) >> 1
+            entry_title = data[offsets[2 * middle]:offsets[2 * middle + 1]]
+            if entry_title < key:
+                low = middle + 1
+            elif entry_title > key:
+                high = middle
+            else:
+                return middle
+        return -1
+
+    def _value(self, index: int) -> str:
+        return self._map[self._offsets[2 * index + 1]:
+                         self._offsets[2 * index + 2]].decode('utf-8')
+
+    def __getitem__(self, title: str) -> str:
+        index = self._search(title)
+        if index < 0:
+            raise KeyError(title)
+        return self._value(index)
+
+    def get(self, title: str, default=None):
+        index = self._search(title)
+        return default if index < 0 else self._value(index)
+
+    def __contains__(self, title) -> bool:
+        return isinstance(title, str) and self._search(title) >= 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[str]:
+        offsets = self._offsets
+        for index in range(self._count):
+            yield self._map[offsets[2 * index]:
+                            offsets[2 * index + 1]].decode('utf-8')
+
+    def digest(self) -> str:
+        """ The SHA-256 of the mapped file. """
+        return hashlib.sha256(self._map).hexdigest()
+
+    def close(self) -> None:
+        self._offsets.release()
+        self._map.close()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(
+        prog='python -m dsc_mmap',
+        description='Compiles the DSC table CSV to a memory-mapped table.')
+    parser.add_argument('csv', help='The DSC table CSV.')
+    parser.add_argument('output', help='The compiled table to write.')
+    args = parser.parse_args(argv)
+    entries = csv_to_dict(args.csv)
+    build(entries, args.output)
+    print(f"Wrote {len(entries)} entries to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
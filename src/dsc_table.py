@@ -0,0 +1,169 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from collections.abc import Mapping
+
+from dsc_mmap import MappedDSCTable
+from utils import csv_lines_to_dict
+
+logger = logging.getLogger(__name__)
+
+# Replaced mmap tables are closed this many seconds after a reload, so
+# refinements still using them can finish.
+RETIRED_TABLE_GRACE = 60.0
+
+
+def _load_csv(filename: str) -> tuple[Mapping[str, str], str]:
+    with open(filename, 'rb') as file:
+        data = file.read()
+    return (csv_lines_to_dict(io.StringIO(data.decode(), newline='')),
+            hashlib.sha256(data).hexdigest())
+
+
+def _load_mmap(filename: str) -> tuple[Mapping[str, str], str]:
+    table = MappedDSCTable(filename)
+    return table, table.digest()
+
+
+# How a table file is loaded, returning the table and the hash of the bytes
+# it was read from: 'dict' parses the CSV into a dictionary, 'mmap' maps a
+# table compiled with dsc_mmap.
+DSC_TABLE_LOADERS = {
+    'dict': _load_csv,
+    'mmap': _load_mmap,
+}
+
+
+class DSCTable:
+    """ Holds the DSC dictionary shared by all requests.
+
+    The table is loaded once (at application startup) and swapped atomically
+    when the file changes on disk, or when a reload is requested. Readers
+    always get a complete dictionary, never a half-loaded one. With the
+    'mmap' backend the file is a table compiled by dsc_mmap and the
+    dictionary is a read-only mapping over it; a replaced mapping is closed
+    RETIRED_TABLE_GRACE seconds after the reload.
+    """
+
+    def __init__(self, filename: str, check_interval: float = 5.0,
+                 backend: str = 'dict'):
+        if backend not in DSC_TABLE_LOADERS:
+            raise ValueError(
+                f"Unknown DSC table backend '{backend}', expected one of "
+                f"{', '.join(DSC_TABLE_LOADERS)}.")
+        self.filename = filename
+        self.check_interval = check_interval
+        self.backend = backend
+        self._dictionary = None
+        self._mtime = None
+        self._hash = None
+        self._last_check = 0.0
+        # Replaced tables to close, with the time they were replaced.
+        self._retired: list[tuple[Mapping[str, str], float]] = []
+        self._lock = threading.Lock()
+        self.load_count = 0
+        self.load_duration = 0.0
+        self.loaded_at = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._dictionary is not None
+
+    @property
+    def version(self) -> str | None:
+        """ The content hash of the currently loaded table file. """
+        return self._hash
+
+    def load(self) -> Mapping[str, str]:
+        """ (Re)loads the table file and swaps in the new dictionary.
+
+        :return: The freshly loaded DSC dictionary.
+        """
+        with self._lock:
+            start = time.perf_counter()
+            # Taken before reading, so a write during the load is seen as a
+            # change by the next check.
+            mtime = os.stat(self.filename).st_mtime
+            dictionary, file_hash = DSC_TABLE_LOADERS[self.backend](
+                self.filename)
+
+            if hasattr(self._dictionary, 'close'):
+                self._retired.append((self._dictionary, time.monotonic()))
+            self._close_retired()
+            self._dictionary = dictionary
+            self._mtime = mtime
+            self._hash = file_hash
+            self._last_check = time.monotonic()
+            self.load_count += 1
+            self.load_duration = time.perf_counter() - start
+            self.loaded_at = time.time()
+            return dictionary
+
+    def reload_if_changed(self) -> bool:
+        """ Reloads the table if the file's mtime and content hash changed.
+
+        :return: True if the table was reloaded.
+        """
+        try:
+            mtime = os.stat(self.filename).st_mtime
+        except OSError:
+            # Keep serving the last good table if the file is being replaced.
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            if _file_hash(self.filename) == self._hash:
+                self._mtime = mtime
+                return False
+            self.load()
+        except Exception:
+            # Keep serving the last good table, and retry on the next check.
+            logger.exception("Could not reload the DSC table %s.",
+                             self.filename)
+            return False
+        return True
+
+    def _close_retired(self) -> None:
+        """ Closes the replaced tables that have had their grace period. """
+        now = time.monotonic()
+        while self._retired and \
+                now - self._retired[0][1] >= RETIRED_TABLE_GRACE:
+            self._retired.pop(0)[0].close()
+
+    def get(self) -> Mapping[str, str]:
+        """ Returns the current DSC dictionary, loading it if needed.
+
+        At most once every `check_interval` seconds the file is checked for
+        changes, so the common case is a plain attribute read.
+        """
+        if self._dictionary is None:
+            return self.load()
+        if self.check_interval >= 0:
+            now = time.monotonic()
+            if now - self._last_check >= self.check_interval:
+                self._last_check = now
+                self.reload_if_changed()
+                if self._retired:
+                    with self._lock:
+                        self._close_retired()
+        return self._dictionary
+
+    def stats(self) -> dict:
+        return {
+            "filename": self.filename,
+            "backend": self.backend,
+            "loaded": self.loaded,
+            "entries": len(self._dictionary) if self.loaded else 0,
+            "version": self._hash,
+            "load_count": self.load_count,
+            "load_duration_seconds": self.load_duration,
+            "loaded_at": self.loaded_at,
+        }
+
+
+def _file_hash(filename: str) -> str:
+    with open(filename, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
@@ -0,0 +1,175 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, \
+    ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from dsc_table import DSCTable
+from profiling import ProfileRequest, profile_call
+from providers import refine, refine_item, uses_dsc_table
+
+EXECUTOR_MODES = ('inline', 'thread', 'process')
+
+# The process pool is started after the server threads, so its workers are
+# spawned instead of forked.
+POOL_CONTEXT = multiprocessing.get_context('spawn')
+
+# The DSC table used by the refinement functions below. In inline and thread
+# mode this is the application's table, in process mode each worker process
+# loads its own copy in init_process_worker.
+_dsc_table: DSCTable | None = None
+
+
+def _dsc_dictionary(provider: str) -> dict | None:
+    if _dsc_table is not None and uses_dsc_table(provider):
+        return _dsc_table.get()
+    return None
+
+
+def init_process_worker(dsc_table_file: str, check_interval: float,
+                        backend: str = 'dict') -> None:
+    global _dsc_table
+    _dsc_table = DSCTable(dsc_table_file, check_interval=check_interval,
+                          backend=backend)
+
+
+def refine_document(provider: str, metadata) -> tuple:
+    """ Refines one document, returning the HTTP error instead of raising.
+
+    HTTPException can not be pickled, so errors are passed back from worker
+    processes as (status_code, detail) and raised again by the caller.
+    """
+    try:
+        return refine(provider, metadata, _dsc_dictionary(provider)), None
+    except HTTPException as error:
+        return None, (error.status_code, error.detail)
+
+
+def refine_indexed_item(provider: str, index: int, metadata) -> dict:
+    return refine_item(provider, index, metadata,
+                       _dsc_dictionary(provider))
+
+
+def refine_documents(provider: str, documents: list) -> list[dict]:
+    dsc_dictionary = _dsc_dictionary(provider)
+    return [refine_item(provider, index, metadata, dsc_dictionary)
+            for index, metadata in enumerate(documents)]
+
+
+class RefinementExecutor:
+    """ Runs refinements inline or on a thread or process pool.
+
+    Payloads smaller than `size_threshold` bytes are refined inline on the
+    event loop, where the overhead of a pool would dominate. Larger payloads
+    are dispatched to the pool so one huge document does not block every
+    other request.
+    """
+
+    def __init__(self, dsc_table: DSCTable, mode: str = 'thread',
+                 max_workers: int | None = None,
+                 size_threshold: int = 256 * 1024):
+        if mode not in EXECUTOR_MODES:
+            raise ValueError(f"Unknown executor mode '{mode}', expected one "
+                             f"of {', '.join(EXECUTOR_MODES)}.")
+        self.dsc_table = dsc_table
+        self.mode = mode
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.size_threshold = size_threshold
+        self._pool: Executor | None = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.inline = 0
+
+    def start(self) -> None:
+        global _dsc_table
+        _dsc_table = self.dsc_table
+        if self.mode == 'thread':
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='refiner')
+        elif self.mode == 'process':
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=POOL_CONTEXT,
+                initializer=init_process_worker,
+                initargs=(self.dsc_table.filename,
+                          self.dsc_table.check_interval,
+                          self.dsc_table.backend))
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def _run(self, size: int, func, *args):
+        if self._pool is None or size < self.size_threshold:
+            self.inline += 1
+            return func(*args)
+
+        with self._lock:
+            self.in_flight += 1
+            self.submitted += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, func, *args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+
+    async def _profiled(self, size: int, profile: ProfileRequest | None,
+                        func, *args):
+        """ _run, under a profiler if a profile is requested. """
+        if profile is None:
+            return await self._run(size, func, *args)
+        result, data, duration = await self._run(
+            size, profile_call, profile.profiler, func, *args)
+        if data is not None:
+            profile.record(data, duration)
+        return result
+
+    async def refine(self, provider: str, metadata, size: int = 0,
+                     profile: ProfileRequest | None = None):
+        """ Refines one document, raising its HTTPException on failure. """
+        refined, error = await self._profiled(size, profile, refine_document,
+                                              provider, metadata)
+        if error is not None:
+            status_code, detail = error
+            raise HTTPException(status_code=status_code, detail=detail)
+        return refined
+
+    async def refine_item(self, provider: str, index: int, metadata,
+                          size: int = 0) -> dict:
+        """ Refines one item of a batch or stream, see refine_item. """
+        return await self._run(size, refine_indexed_item, provider, index,
+                               metadata)
+
+    async def refine_batch(self, provider: str, documents: list,
+                           size: int = 0,
+                           profile: ProfileRequest | None = None
+                           ) -> list[dict]:
+        """ Refines a batch of documents as a single unit of work. """
+        return await self._profiled(size, profile, refine_documents,
+                                    provider, documents)
+
+    def stats(self) -> dict:
+        """ Pool statistics; queue depth and utilization are derived from the
+        number of tasks in flight relative to the number of workers.
+        """
+        busy = min(self.in_flight, self.max_workers)
+        return {
+            "mode": self.mode,
+            "max_workers": self.max_workers,
+            "size_threshold": self.size_threshold,
+            "in_flight": self.in_flight,
+            "queue_depth": self.in_flight - busy,
+            "utilization": busy / self.max_workers,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "inline": self.inline,
+        }
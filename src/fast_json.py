@@ -0,0 +1,34 @@
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data: bytes | str) -> Any:
+    """ Decodes JSON, with orjson when it is installed. """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(content: Any, sort_keys: bool = False) -> bytes:
+    """ Encodes JSON-safe content to compact UTF-8 JSON.
+
+    Uses orjson when it is installed, falling back to the standard library
+    for content orjson rejects, e.g. integers beyond 64 bits.
+
+    :param content: The content to encode.
+    :param sort_keys: Sort object keys, giving a canonical encoding.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                content, option=orjson.OPT_SORT_KEYS if sort_keys else None)
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(content, ensure_ascii=False, allow_nan=False,
+                      sort_keys=sort_keys,
+                      separators=(',', ':')).encode('utf-8')
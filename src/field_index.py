@@ -0,0 +1,58 @@
+class FieldIndex:
+    """ Lookup of Dataverse fields by (metadata block, typeName).
+
+    The fields of a metadata block are walked once, the first time the block
+    is used; every lookup after that is a dict access. The index holds the
+    field dictionaries themselves, so in-place refinements are visible to
+    every refiner sharing the index. Fields added to the document must be
+    added through `append` to stay visible.
+    """
+
+    def __init__(self, metadata: dict):
+        """
+        :param metadata: Dataverse JSON.
+        :raises KeyError: Raises if datasetVersion.metadataBlocks is missing.
+        """
+        self.metadata_blocks = metadata['datasetVersion']['metadataBlocks']
+        self._blocks: dict[str, dict[str, list]] = {}
+
+    def _index(self, block: str) -> dict[str, list] | None:
+        index = self._blocks.get(block)
+        if index is None:
+            if block not in self.metadata_blocks:
+                return None
+            index = {}
+            for field in self.metadata_blocks[block].get('fields', ()):
+                index.setdefault(field.get('typeName'), []).append(field)
+            self._blocks[block] = index
+        return index
+
+    def has_block(self, block: str) -> bool:
+        return block in self.metadata_blocks
+
+    def fields(self, block: str) -> list | None:
+        """ The fields list of a block, or None if the block is missing. """
+        if block not in self.metadata_blocks:
+            return None
+        return self.metadata_blocks[block].get('fields')
+
+    def get(self, block: str, typename: str) -> dict:
+        """ The first field with the given type name in a block, or {}. """
+        index = self._index(block)
+        if index is None:
+            return {}
+        matching = index.get(typename)
+        return matching[0] if matching else {}
+
+    def get_all(self, block: str, typename: str) -> list:
+        """ All fields with the given type name in a block. """
+        index = self._index(block)
+        if index is None:
+            return []
+        return index.get(typename, [])
+
+    def append(self, block: str, field: dict) -> None:
+        """ Appends a field to a block's fields and to the index. """
+        index = self._index(block)
+        self.metadata_blocks[block]['fields'].append(field)
+        index.setdefault(field.get('typeName'), []).append(field)
@@ -0,0 +1,54 @@
+""" Gunicorn configuration for running the refiner in production.
+
+    gunicorn -c gunicorn.conf.py main:app
+
+The app is imported once in the master (preload_app) and the shared state
+(DSC table, compiled query and license patterns) is loaded before the
+workers fork, so they share those pages copy-on-write. Every setting can be
+overridden with the environment variables below.
+"""
+import multiprocessing
+import os
+import tempfile
+
+# Workers share their counters and histograms through files in this
+# directory, so /metrics serves the totals of all workers whichever one is
+# scraped. Set before the app is preloaded, which reads it.
+if not os.environ.get('METRICS_DIR'):
+    os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='refiner-metrics-')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = 'uvicorn.workers.UvicornWorker'
+# Refinement is CPU bound, so one worker per core.
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             str(multiprocessing.cpu_count())))
+preload_app = True
+
+# Recycle workers now and then to bound memory growth, with jitter so they
+# don't all restart at once.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '10000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER',
+                                         '1000'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+
+forwarded_allow_ips = os.environ.get('FORWARDED_ALLOW_IPS', '*')
+accesslog = '-'
+
+
+def when_ready(server):
+    import main
+    main.preload()
+    server.log.info("Preloaded DSC table with %d entries.",
+                    main.dsc_table.stats()['entries'])
+
+
+def post_fork(server, worker):
+    import main
+    main.after_fork()
+
+
+def child_exit(server, worker):
+    import main
+    main.retire_worker(worker.pid)
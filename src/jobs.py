@@ -0,0 +1,499 @@
+""" Refinement jobs: large submissions refined in the background.
+
+A job is a batch of documents, or a JSONL file or directory of JSON files
+under JOB_INPUT_DIR, for a single provider. Jobs are kept in a SQLite store
+together with their inputs and results, so a job survives a restart of the
+service. A JobRunner takes queued jobs from the store one at a time and
+refines them with a pool of worker processes, see cli.refine_records.
+
+Every process of a multi-worker server has a JobRunner, but only the one
+holding the store's lease runs jobs, so a host runs one job at a time. The
+holder renews the lease and the heartbeat of its running job every
+HEARTBEAT_INTERVAL seconds. A job that was interrupted, by a restart or a
+runner that died or hung, is queued again and resumes where it stopped.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator
+
+from cli import read_records, refine_records
+from fast_json import dumps
+from providers import uses_dsc_table
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+# Results are written, and progress is updated, per this many records.
+RESULT_BATCH_SIZE = 100
+
+# The refinement pool of a job is started from a threaded server process,
+# which must not be forked.
+POOL_CONTEXT = multiprocessing.get_context('spawn')
+
+logger = logging.getLogger(__name__)
+
+JOB_COLUMNS = ('id', 'provider', 'status', 'source', 'total', 'processed',
+               'failed', 'error', 'created', 'started', 'finished')
+
+HEARTBEAT_INTERVAL = 5.0
+# A lease or running job without a heartbeat for this long is abandoned.
+LEASE_TIMEOUT = 30.0
+
+
+def read_boot_id() -> str:
+    """ Identifies the current boot of the host, so that the process id of
+    a runner from before a reboot is not mistaken for a live process.
+    """
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as file:
+            return file.read().strip()
+    except OSError:
+        return ''
+
+
+BOOT_ID = read_boot_id()
+
+
+class JobStore:
+    """ SQLite store of jobs, their inputs and their results.
+
+    The store can be shared by the processes of a multi-worker server: a
+    queued job is claimed by exactly one runner, and the runner lease is
+    held by one process at a time.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False,
+                                           isolation_level=None, timeout=30)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, provider TEXT NOT NULL, '
+            'status TEXT NOT NULL, source TEXT, total INTEGER, '
+            'processed INTEGER NOT NULL DEFAULT 0, '
+            'failed INTEGER NOT NULL DEFAULT 0, error TEXT, runner INTEGER, '
+            'created REAL NOT NULL, started REAL, finished REAL, '
+            'runner_boot TEXT, heartbeat REAL);'
+            'CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created);'
+            'CREATE TABLE IF NOT EXISTS job_inputs ('
+            'job_id TEXT NOT NULL, position INTEGER NOT NULL, '
+            'raw TEXT NOT NULL, PRIMARY KEY (job_id, position)) '
+            'WITHOUT ROWID;'
+            'CREATE TABLE IF NOT EXISTS job_results ('
+            'job_id TEXT NOT NULL, position INTEGER NOT NULL, '
+            'name TEXT NOT NULL, result TEXT, error TEXT, '
+            'PRIMARY KEY (job_id, position)) WITHOUT ROWID;'
+            'CREATE TABLE IF NOT EXISTS runner_lease ('
+            'id INTEGER PRIMARY KEY CHECK (id = 0), runner INTEGER NOT NULL, '
+            'runner_boot TEXT NOT NULL, expires REAL NOT NULL);')
+        columns = [row[1] for row in self._connection.execute(
+            'PRAGMA table_info(jobs)')]
+        for column in ('runner_boot TEXT', 'heartbeat REAL'):
+            if column.split()[0] not in columns:
+                self._connection.execute(
+                    f'ALTER TABLE jobs ADD COLUMN {column}')
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+
+    def create(self, provider: str, documents: list | None = None,
+               source: str | None = None) -> dict:
+        """ Queues a job for a batch of documents or a source path.
+
+        :return: The new job.
+        """
+        job_id = uuid.uuid4().hex
+        total = len(documents) if documents is not None else None
+        with self._transaction() as connection:
+            connection.execute(
+                'INSERT INTO jobs (id, provider, status, source, total, '
+                'created) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, provider, 'queued', source, total, time.time()))
+            if documents is not None:
+                connection.executemany(
+                    'INSERT INTO job_inputs VALUES (?, ?, ?)',
+                    ((job_id, position, dumps(document).decode())
+                     for position, document in enumerate(documents)))
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            row = self._connection.execute(
+                f'SELECT {", ".join(JOB_COLUMNS)} FROM jobs WHERE id = ?',
+                (job_id,)).fetchone()
+        return dict(zip(JOB_COLUMNS, row)) if row is not None else None
+
+    def recent(self, limit: int = 100) -> list[dict]:
+        """ The most recently created jobs, newest first. """
+        with self._lock:
+            rows = self._connection.execute(
+                f'SELECT {", ".join(JOB_COLUMNS)} FROM jobs '
+                f'ORDER BY created DESC LIMIT ?', (limit,)).fetchall()
+        return [dict(zip(JOB_COLUMNS, row)) for row in rows]
+
+    def counts(self) -> dict[str, int]:
+        """ Number of jobs by status. """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT status, COUNT(*) FROM jobs GROUP BY status'
+            ).fetchall()
+        return {status: 0 for status in JOB_STATUSES} | dict(rows)
+
+    def acquire_lease(self, runner: int,
+                      timeout: float = LEASE_TIMEOUT) -> bool:
+        """ Takes or renews the runner lease for `timeout` seconds.
+
+        The lease is taken over when it expired or its holder's process no
+        longer exists.
+
+        :return: Whether `runner` holds the lease.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute(
+                'SELECT runner, runner_boot, expires FROM runner_lease'
+            ).fetchone()
+            if row is not None and (row[0], row[1]) != (runner, BOOT_ID) \
+                    and row[2] > now and _runner_alive(row[0], row[1]):
+                return False
+            connection.execute(
+                'INSERT OR REPLACE INTO runner_lease VALUES (0, ?, ?, ?)',
+                (runner, BOOT_ID, now + timeout))
+        return True
+
+    def release_lease(self, runner: int) -> None:
+        with self._transaction() as connection:
+            connection.execute(
+                'DELETE FROM runner_lease WHERE runner = ? AND '
+                'runner_boot = ?', (runner, BOOT_ID))
+
+    def claim(self, runner: int) -> dict | None:
+        """ Marks the oldest queued job as running by `runner`.
+
+        :return: The claimed job, or None if no job is queued.
+        """
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' "
+                "ORDER BY created LIMIT 1").fetchone()
+            if row is not None:
+                now = time.time()
+                connection.execute(
+                    "UPDATE jobs SET status = 'running', runner = ?, "
+                    "runner_boot = ?, heartbeat = ?, "
+                    "started = COALESCE(started, ?) WHERE id = ?",
+                    (runner, BOOT_ID, now, now, row[0]))
+        return self.get(row[0]) if row is not None else None
+
+    def heartbeat(self, job_id: str) -> None:
+        """ Records that the runner of a job is still working on it. """
+        with self._transaction() as connection:
+            connection.execute('UPDATE jobs SET heartbeat = ? WHERE id = ?',
+                               (time.time(), job_id))
+
+    def inputs(self, job_id: str, start: int = 0, page_size: int = 1000
+               ) -> Iterator[tuple[str, str]]:
+        """ Yields the (name, raw JSON) records of a batch job, in order,
+        from position `start` on.
+        """
+        position = start - 1
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    'SELECT position, raw FROM job_inputs WHERE job_id = ? '
+                    'AND position > ? ORDER BY position LIMIT ?',
+                    (job_id, position, page_size)).fetchall()
+            if not rows:
+                return
+            for row_position, raw in rows:
+                yield str(row_position), raw
+            position = rows[-1][0]
+
+    def add_results(self, job_id: str, position: int,
+                    results: list[tuple[str, str | None, str]]) -> None:
+        """ Stores the results of refine_records and updates the progress.
+
+        :param position: Position of the first result in the job.
+        """
+        failed = sum(1 for _, refined, _ in results if refined is None)
+        with self._transaction() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO job_results VALUES (?, ?, ?, ?, ?)',
+                ((job_id, position + offset, name, refined, error or None)
+                 for offset, (name, refined, error) in enumerate(results)))
+            connection.execute(
+                'UPDATE jobs SET processed = processed + ?, '
+                'failed = failed + ? WHERE id = ?',
+                (len(results), failed, job_id))
+
+    def finish(self, job_id: str, error: str | None = None) -> None:
+        """ Marks a job as done, or as failed with an error. """
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished = ?, "
+                "total = COALESCE(total, processed) WHERE id = ?",
+                ('failed' if error else 'done', error, time.time(), job_id))
+
+    def requeue(self, job_id: str) -> None:
+        """ Puts a running job back in the queue. Its stored results and
+        progress are kept, so it resumes after the last stored result.
+        """
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = 'queued', runner = NULL, "
+                "runner_boot = NULL, heartbeat = NULL WHERE id = ?",
+                (job_id,))
+
+    def recover(self, timeout: float = LEASE_TIMEOUT) -> list[str]:
+        """ Requeues running jobs that were abandoned: their runner process
+        is gone, was started before the host rebooted, or has not sent a
+        heartbeat for `timeout` seconds.
+
+        :return: The ids of the requeued jobs.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, runner, runner_boot, heartbeat FROM jobs "
+                "WHERE status = 'running'").fetchall()
+        stale = time.time() - timeout
+        orphaned = [job_id for job_id, runner, runner_boot, heartbeat in rows
+                    if not _runner_alive(runner, runner_boot)
+                    or (heartbeat or 0) < stale]
+        for job_id in orphaned:
+            self.requeue(job_id)
+        return orphaned
+
+    def results(self, job_id: str, page_size: int = 1000
+                ) -> Iterator[tuple[int, str, str | None, str | None]]:
+        """ Yields the (position, name, refined JSON, error) results of a
+        job, in order.
+        """
+        position = -1
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    'SELECT position, name, result, error FROM job_results '
+                    'WHERE job_id = ? AND position > ? ORDER BY position '
+                    'LIMIT ?', (job_id, position, page_size)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            position = rows[-1][0]
+
+    def delete(self, job_id: str) -> None:
+        with self._transaction() as connection:
+            for table, column in (('job_inputs', 'job_id'),
+                                  ('job_results', 'job_id'), ('jobs', 'id')):
+                connection.execute(
+                    f'DELETE FROM {table} WHERE {column} = ?', (job_id,))
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class JobRunner:
+    """ Runs queued jobs in a background thread, one job at a time, while
+    holding the runner lease of the store.
+
+    Every job is refined by up to `workers` processes, so the runner keeps
+    the machine busy without running more refinements than there are
+    workers. Jobs queued by other processes sharing the store are picked up
+    within `poll_interval` seconds. A second thread takes or renews the
+    lease and sends the heartbeat of the running job every
+    `heartbeat_interval` seconds.
+    """
+
+    def __init__(self, filename: str, dsc_table_csv: str,
+                 workers: int | None = None, poll_interval: float = 1.0,
+                 heartbeat_interval: float = HEARTBEAT_INTERVAL):
+        self.filename = filename
+        self.dsc_table_csv = dsc_table_csv
+        self.workers = workers or os.cpu_count() or 1
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.store: JobStore | None = None
+        # Whether this runner holds the lease and may run jobs.
+        self.leader = False
+        self._job_id: str | None = None
+        self._threads: list[threading.Thread] = []
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def start(self) -> None:
+        """ Opens the store and starts the runner and heartbeat threads. """
+        self.store = JobStore(self.filename)
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(target=self._heartbeat, name='job-heartbeat',
+                             daemon=True),
+            threading.Thread(target=self._run, name='job-runner',
+                             daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """ Stops the runner; a job that is running is queued again. """
+        if not self._threads:
+            return
+        self._stopping.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self.leader:
+            self.store.release_lease(os.getpid())
+            self.leader = False
+        self.store.close()
+        self.store = None
+
+    def submit(self, provider: str, documents: list | None = None,
+               source: str | None = None) -> dict:
+        job = self.store.create(provider, documents, source)
+        self._wake.set()
+        return job
+
+    def _heartbeat(self) -> None:
+        while True:
+            try:
+                self._beat()
+            except Exception:
+                logger.exception("Job runner heartbeat failed, retrying.")
+            if self._stopping.wait(self.heartbeat_interval):
+                return
+
+    def _beat(self) -> None:
+        leader = self.store.acquire_lease(os.getpid())
+        job_id = self._job_id
+        if job_id is not None:
+            self.store.heartbeat(job_id)
+        if leader:
+            # Jobs of an earlier holder of the lease, or jobs this runner
+            # failed to finish, are abandoned.
+            if self.store.recover():
+                self._wake.set()
+        self.leader = leader
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                job = self.store.claim(os.getpid()) if self.leader else None
+                if job is None:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+                    continue
+                self._job_id = job['id']
+                try:
+                    self.run_job(job)
+                finally:
+                    self._job_id = None
+            except Exception:
+                logger.exception("Job runner failed, retrying.")
+                self._stopping.wait(self.poll_interval)
+
+    def run_job(self, job: dict) -> None:
+        """ Refines the records of a claimed job and stores the results,
+        starting after the results stored by earlier runs of the job.
+        """
+        job_id = job['id']
+        position = job['processed']
+        dsc_table_csv = self.dsc_table_csv \
+            if uses_dsc_table(job['provider']) else None
+        results = None
+        pending = []
+        try:
+            if job['source'] is None:
+                records = self.store.inputs(job_id, start=position)
+            else:
+                records = itertools.islice(read_records(job['source']),
+                                           position, None)
+            results = refine_records(records, job['provider'],
+                                     dsc_table_csv, self.workers,
+                                     mp_context=POOL_CONTEXT)
+            for result in results:
+                pending.append(result)
+                if len(pending) >= RESULT_BATCH_SIZE:
+                    self.store.add_results(job_id, position, pending)
+                    position += len(pending)
+                    pending = []
+                if self._stopping.is_set():
+                    results.close()
+                    self.store.add_results(job_id, position, pending)
+                    self.store.requeue(job_id)
+                    return
+                if not self.leader:
+                    # The lease expired and the new holder requeued the job.
+                    results.close()
+                    return
+            self.store.add_results(job_id, position, pending)
+        except Exception as error:
+            if results is not None:
+                results.close()
+            self.store.finish(job_id, f"{type(error).__name__}: {error}")
+            return
+        self.store.finish(job_id)
+
+
+def result_lines(store: JobStore, job_id: str) -> Iterator[bytes]:
+    """ Yields the results of a job as NDJSON, in the result format of the
+    batch endpoint plus the name of the record.
+
+    Refined documents are stored as JSON and copied into the output as is.
+    """
+    for position, name, refined, error in store.results(job_id):
+        if refined is None:
+            yield dumps({"index": position, "name": name, "status": "error",
+                         "detail": error}) + b'\n'
+        else:
+            yield (b'{"index":%d,"name":%s,"status":"ok","metadata":%s}\n'
+                   % (position, dumps(name), refined.encode()))
+
+
+def resolve_job_source(path: str, input_dir: str) -> str:
+    """ Resolves the path of a job's input file relative to `input_dir`.
+
+    :raises PermissionError: Raises if file jobs are disabled (no
+        `input_dir`) or the path is outside `input_dir`.
+    :raises FileNotFoundError: Raises if the path does not exist.
+    """
+    if not input_dir:
+        raise PermissionError("Jobs from local files are disabled.")
+    root = os.path.realpath(input_dir)
+    source = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, source]) != root:
+        raise PermissionError(f"'{path}' is outside the job input directory.")
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"'{path}' does not exist.")
+    return source
+
+
+def _runner_alive(pid: int | None, boot_id: str | None) -> bool:
+    return boot_id == BOOT_ID and _process_exists(pid)
+
+
+def _process_exists(pid: int | None) -> bool:
+    if pid is None or pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
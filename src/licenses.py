@@ -0,0 +1,79 @@
+import csv
+import hashlib
+import os
+import re
+
+from cache import LRUCache
+
+LICENSE_TABLE_CSV = os.environ.get(
+    'LICENSE_TABLE_CSV',
+    os.path.join(os.path.dirname(__file__), 'data', 'licenses.csv'))
+LICENSE_CACHE_SIZE = int(os.environ.get('LICENSE_CACHE_SIZE', '256'))
+
+
+class LicenseResolver:
+    """ Resolves license URIs to license names with a table of patterns.
+
+    The patterns are combined into a single precompiled regex. Each pattern
+    is matched from the start of the URI (use `.*` to search) and the first
+    pattern in the table that matches wins. Resolved URIs are kept in an
+    LRU cache, so a known URI costs a dict lookup.
+    """
+
+    def __init__(self, table: list[tuple[str, str]],
+                 cache_size: int = LICENSE_CACHE_SIZE):
+        self.table = table
+        self.names = {f"license{index}": name
+                      for index, (_, name) in enumerate(table)}
+        self.pattern = re.compile('|'.join(
+            f"(?P<license{index}>{pattern})"
+            for index, (pattern, _) in enumerate(table)), re.DOTALL)
+        self.cache = LRUCache(cache_size)
+        # Identifies the table, e.g. in result cache keys.
+        self.digest = hashlib.sha256('\n'.join(
+            f"{pattern};{name}" for pattern, name in table).encode()
+        ).hexdigest()[:16]
+
+    @classmethod
+    def from_csv(cls, filename: str, **kwargs) -> 'LicenseResolver':
+        """ Loads a `pattern;license` table, the first row being a header. """
+        with open(filename, newline='') as csvfile:
+            reader = csv.reader(csvfile, delimiter=';')
+            next(reader)
+            table = [(row[0], row[1]) for row in reader if len(row) >= 2]
+        return cls(table, **kwargs)
+
+    def _resolve(self, uri: str) -> str:
+        match = self.pattern.match(uri) if self.table else None
+        if match is None:
+            return ''
+        for group, value in match.groupdict().items():
+            if value is not None:
+                return self.names[group]
+        return ''
+
+    def resolve(self, uri: str) -> str:
+        """ Returns the license name for a URI, or '' if it is unknown. """
+        return self.cache.get_or_compute(uri, lambda: self._resolve(uri))
+
+
+_resolver = LicenseResolver.from_csv(LICENSE_TABLE_CSV)
+
+
+def resolve_license(uri: str) -> str:
+    return _resolver.resolve(uri)
+
+
+def reload_licenses(filename: str = LICENSE_TABLE_CSV) -> None:
+    """ Replaces the license table, which also starts a fresh cache. """
+    global _resolver
+    _resolver = LicenseResolver.from_csv(filename)
+
+
+def license_table_version() -> str:
+    """ A digest of the license table in use. """
+    return _resolver.digest
+
+
+def license_cache_stats() -> dict:
+    return _resolver.cache.stats()
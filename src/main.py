@@ -1,25 +1,322 @@
+import gc
 import os
+import time
+from collections.abc import Mapping
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response, \
+    StreamingResponse
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from refiners.cbs_refiner import refine_cbs_metadata
-from refiners.cid_refiner import refine_cid_metadata
-from refiners.datastation_refiner import refine_datastation_metadata
-from refiners.liss_refiner import refine_liss_metadata
-from refiners.sicada_refiner import refine_sicada_metadata
-from schema.input import RefinerInput
-from utils import csv_to_dict
+import cbs_stream
+from dsc_table import DSCTable
+from executor import RefinementExecutor
+from jobs import JobRunner, resolve_job_source, result_lines
+from licenses import license_cache_stats, license_table_version
+from metrics import Gauge, RequestTimer, phase_duration, registry, \
+    request_duration, request_size, requests_total
+from profiling import PROFILE_FORMATS, PROFILE_HEADER, ProfileRequest, \
+    Profiler, render
+from refiners.cbs_refiner import alt_title_cache
+from responses import DuplexStreamingResponse, RefinedJSONResponse
+from result_cache import create_result_cache
+from ndjson import NDJSONResponse, NDJSON_MEDIA_TYPE, refine_ndjson
+from providers import check_provider, uses_dsc_table, uses_license_table
+from schema.input import BatchRefinerInput, JobInput, RefinerInput
+from schema.parsing import job_input, refiner_batch_metadata, \
+    refiner_metadata, request_body_schema
 from version import get_version
 
-app = FastAPI()
+# Relative data paths are resolved against this directory, not the working
+# directory.
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 DSC_TABLE_CSV = os.environ.get('DSC_TABLE_CSV', 'data/DSC_table.csv')
+DSC_TABLE_BACKEND = os.environ.get('DSC_TABLE_BACKEND', 'dict')
+DSC_TABLE_MMAP = os.environ.get('DSC_TABLE_MMAP', 'data/DSC_table.map')
+DSC_TABLE_CHECK_INTERVAL = float(
+    os.environ.get('DSC_TABLE_CHECK_INTERVAL', '5'))
+REFINER_EXECUTOR = os.environ.get('REFINER_EXECUTOR', 'thread')
+REFINER_WORKERS = int(os.environ.get('REFINER_WORKERS', '0')) or None
+REFINER_OFFLOAD_THRESHOLD = int(
+    os.environ.get('REFINER_OFFLOAD_THRESHOLD', str(256 * 1024)))
+RESULT_CACHE = os.environ.get('RESULT_CACHE', 'off')
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES',
+                                            str(64 * 1024 * 1024)))
+RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH',
+                                   'result_cache.sqlite3')
+RESULT_CACHE_HEADER = 'X-Refiner-Cache'
+JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH', 'jobs.sqlite3')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '0')) or None
+JOB_INPUT_DIR = os.environ.get('JOB_INPUT_DIR', '')
+PROFILING = os.environ.get('PROFILING', 'off')
+PROFILER = os.environ.get('PROFILER', 'cprofile')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_STORE_SIZE = int(os.environ.get('PROFILE_STORE_SIZE', '50'))
+PROFILE_STORE_PATH = os.environ.get('PROFILE_STORE_PATH', 'profiles.sqlite3')
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
 
+DSC_TABLE_FILE = DSC_TABLE_MMAP if DSC_TABLE_BACKEND == 'mmap' \
+    else DSC_TABLE_CSV
 
-def load_data() -> dict:
-    filename = os.path.join(os.getcwd(), DSC_TABLE_CSV)
-    dsc_dictionary = csv_to_dict(filename)
-    return dsc_dictionary
+dsc_table = DSCTable(os.path.join(SOURCE_DIR, DSC_TABLE_FILE),
+                     check_interval=DSC_TABLE_CHECK_INTERVAL,
+                     backend=DSC_TABLE_BACKEND)
+executor = RefinementExecutor(dsc_table, mode=REFINER_EXECUTOR,
+                              max_workers=REFINER_WORKERS,
+                              size_threshold=REFINER_OFFLOAD_THRESHOLD)
+result_cache = create_result_cache(RESULT_CACHE, RESULT_CACHE_MAX_BYTES,
+                                   RESULT_CACHE_PATH)
+job_runner = JobRunner(JOB_STORE_PATH,
+                       os.path.join(SOURCE_DIR, DSC_TABLE_CSV),
+                       workers=JOB_WORKERS)
+profiler = Profiler(enabled=PROFILING == 'on',
+                    sample_rate=PROFILE_SAMPLE_RATE, profiler=PROFILER,
+                    store_size=PROFILE_STORE_SIZE,
+                    store_path=PROFILE_STORE_PATH)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    get_version()
+    if not dsc_table.loaded:
+        dsc_table.load()
+    executor.start()
+    job_runner.start()
+    yield
+    job_runner.stop()
+    executor.shutdown()
+    registry.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def preload() -> None:
+    """ Loads the shared, read-only state before worker processes fork.
+
+    Called by the gunicorn master (see gunicorn.conf.py) with the app
+    preloaded. The DSC table, the version and the compiled JMESPath and
+    license patterns are then inherited by every worker instead of being
+    built once per worker. Freezing the garbage collector moves all of it
+    to the permanent generation, so collections in the workers don't touch
+    (and copy) the shared pages.
+    """
+    get_version()
+    if not dsc_table.loaded:
+        dsc_table.load()
+    if METRICS_DIR:
+        registry.clear(METRICS_DIR)
+    gc.freeze()
+
+
+def after_fork() -> None:
+    """ Re-creates per-process state in a freshly forked worker.
+
+    A SQLite connection must not be shared across a fork, so the result
+    cache and the profile store are opened again in every worker. With
+    METRICS_DIR set, the worker shares its metrics with the other workers
+    through that directory.
+    """
+    global result_cache
+    result_cache = create_result_cache(RESULT_CACHE, RESULT_CACHE_MAX_BYTES,
+                                       RESULT_CACHE_PATH)
+    profiler.reopen()
+    if METRICS_DIR:
+        registry.share(METRICS_DIR)
+
+
+def retire_worker(pid: int) -> None:
+    """ Folds the metrics of an exited worker into the totals of exited
+    workers. Called by the gunicorn master.
+    """
+    if METRICS_DIR:
+        registry.retire(METRICS_DIR, str(pid))
+
+
+def load_data() -> Mapping[str, str]:
+    return dsc_table.get()
+
+
+async def payload_size(request: Request) -> int:
+    """ The size of the request body, which the refinement endpoints have
+    already read. Chunked uploads have no Content-Length.
+    """
+    return len(await request.body())
+
+
+def content_length(scope: Scope) -> int:
+    try:
+        return int(Headers(scope=scope).get('content-length', 0))
+    except ValueError:
+        return 0
+
+
+def result_cache_key(provider: str, metadata) -> str:
+    dsc_version = None
+    if uses_dsc_table(provider):
+        dsc_table.get()  # picks up a changed table before reading its version
+        dsc_version = dsc_table.version
+    license_version = None
+    if uses_license_table(provider):
+        license_version = license_table_version()
+    return result_cache.key(provider, metadata, dsc_version, license_version)
+
+
+def profile_request(provider: str,
+                    request: Request) -> ProfileRequest | None:
+    """ Asks for a profile of the refinement of a request, if it is to be
+    profiled. The id of the stored profile is kept in request.state.
+    """
+    if not profiler.wants(request.headers):
+        return None
+
+    def record(data: bytes, duration: float) -> None:
+        request.state.profile_id = profiler.record(
+            provider, request.url.path, data, duration).id
+    return ProfileRequest(profiler.profiler, record)
+
+
+def add_profile_header(response: Response, request: Request) -> None:
+    profile_id = getattr(request.state, 'profile_id', None)
+    if profile_id is not None:
+        response.headers[PROFILE_HEADER] = profile_id
+
+
+async def run_refinement(provider: str, metadata,
+                         request: Request) -> Response:
+    cache_key = None
+    if result_cache is not None:
+        # The key is computed before refining, the refiners change metadata.
+        cache_key = result_cache_key(provider, metadata)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return Response(cached, media_type='application/json',
+                            headers={RESULT_CACHE_HEADER: 'hit'})
+
+    timer = getattr(request.state, 'timer', None) or RequestTimer()
+    started = timer.refining()
+    try:
+        refined = await executor.refine(provider, metadata,
+                                        await payload_size(request),
+                                        profile_request(provider, request))
+    finally:
+        timer.refined(started)
+    response = RefinedJSONResponse(refined)
+    add_profile_header(response, request)
+    if cache_key is not None:
+        result_cache.put(cache_key, response.body)
+        response.headers[RESULT_CACHE_HEADER] = 'miss'
+    return response
+
+
+class MetricsMiddleware:
+    """ Records the metrics of a request once the last chunk of its
+    response body is sent, so streamed responses are timed to their end.
+
+    The request size is the number of body bytes received, or the
+    Content-Length if the handler did not read the body.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        timer = scope.setdefault('state', {})['timer'] = RequestTimer()
+        status = 500
+        received = 0
+        recorded = False
+
+        async def receive_counted() -> Message:
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+            return message
+
+        async def send_timed(message: Message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+            if message['type'] == 'http.response.body' and \
+                    not message.get('more_body', False):
+                record()
+
+        def record() -> None:
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            total = time.perf_counter() - timer.start
+            route = scope.get('route')
+            endpoint = route.path if route is not None else 'unmatched'
+            requests_total.inc(endpoint, scope['method'], status)
+            request_duration.observe(total, endpoint)
+            request_size.observe(received or content_length(scope), endpoint)
+            phases = timer.phases(total)
+            if phases is not None:
+                for phase, duration in phases.items():
+                    phase_duration.observe(duration, endpoint, phase)
+
+        try:
+            await self.app(scope, receive_counted, send_timed)
+        finally:
+            record()
+
+
+app.add_middleware(MetricsMiddleware)
+
+
+def cache_stats() -> dict:
+    stats = {"licenses": license_cache_stats(),
+             "alternative_titles": alt_title_cache.stats()}
+    if result_cache is not None:
+        stats["results"] = result_cache.stats()
+    return stats
+
+
+def _cache_stat(stat: str):
+    def read() -> dict:
+        return {(name,): cache[stat] for name, cache in cache_stats().items()}
+    return read
+
+
+registry.register(Gauge('refiner_dsc_table_entries',
+                        'Entries in the loaded DSC table.',
+                        lambda: dsc_table.stats()["entries"]))
+registry.register(Gauge('refiner_dsc_table_load_duration_seconds',
+                        'Duration of the last DSC table load.',
+                        lambda: dsc_table.load_duration))
+registry.register(Gauge('refiner_dsc_table_loads',
+                        'Number of times the DSC table was loaded.',
+                        lambda: dsc_table.load_count))
+registry.register(Gauge('refiner_executor_in_flight',
+                        'Refinements running or queued on the pool.',
+                        lambda: executor.in_flight))
+registry.register(Gauge('refiner_executor_queue_depth',
+                        'Refinements waiting for a pool worker.',
+                        lambda: executor.stats()["queue_depth"]))
+registry.register(Gauge(
+    'refiner_jobs', 'Jobs in the job store by status.',
+    lambda: {(status,): count
+             for status, count in job_runner.store.counts().items()}
+    if job_runner.store is not None else {}, ('status',)))
+for _stat in ('hits', 'misses', 'evictions', 'size'):
+    registry.register(Gauge(f'refiner_cache_{_stat}', f'Cache {_stat}.',
+                            _cache_stat(_stat), ('cache',)))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(registry.render(),
+                             media_type='text/plain; version=0.0.4')
 
 
 @app.get("/version")
@@ -28,28 +325,235 @@ async def info():
     return {"version": result}
 
 
-@app.post('/metadata-refinement/cbs')
-async def cbs_metadata_refinement(refiner_input: RefinerInput) -> dict:
-    dsc_dictionary = load_data()
-    return refine_cbs_metadata(refiner_input.metadata,
-                               dsc_dictionary)
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    if not dsc_table.loaded:
+        raise HTTPException(status_code=503,
+                            detail="DSC table is not loaded yet.")
+    return {"status": "ready"}
+
+
+@app.get("/admin/dsc-table")
+async def dsc_table_info():
+    return dsc_table.stats()
+
+
+@app.post("/admin/dsc-table/reload")
+async def dsc_table_reload():
+    dsc_table.load()
+    return dsc_table.stats()
+
+
+@app.get("/admin/caches")
+async def caches_info():
+    return cache_stats()
+
+
+@app.get("/admin/executor")
+async def executor_info():
+    return executor.stats()
+
+
+@app.get("/admin/profiles")
+async def list_profiles():
+    """ The stored profiles, newest first, without their data. """
+    return {"enabled": profiler.enabled, "profiler": profiler.profiler,
+            "sample_rate": profiler.sample_rate,
+            "profiles": [profile.summary()
+                         for profile in profiler.store.recent()]}
+
+
+@app.get("/admin/profiles/{profile_id}")
+async def download_profile(profile_id: str, format: str | None = None):
+    """ Downloads a profile, see PROFILE_FORMATS for the formats. """
+    profile = profiler.store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404,
+                            detail=f"Unknown profile '{profile_id}'.")
+    try:
+        content, media_type, filename = render(
+            profile, format or PROFILE_FORMATS[profile.profiler][0])
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    return Response(content, media_type=media_type, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@app.post('/metadata-refinement/cbs',
+          response_class=RefinedJSONResponse,
+          openapi_extra=request_body_schema(RefinerInput))
+async def cbs_metadata_refinement(
+        request: Request, metadata=Depends(refiner_metadata)) -> Response:
+    return await run_refinement('cbs', metadata, request)
+
+
+@app.post('/metadata-refinement/cid',
+          response_class=RefinedJSONResponse,
+          openapi_extra=request_body_schema(RefinerInput))
+async def cid_metadata_refinement(
+        request: Request, metadata=Depends(refiner_metadata)) -> Response:
+    return await run_refinement('cid', metadata, request)
+
+
+@app.post('/metadata-refinement/sicada',
+          response_class=RefinedJSONResponse,
+          openapi_extra=request_body_schema(RefinerInput))
+async def sicada_metadata_refinement(
+        request: Request, metadata=Depends(refiner_metadata)) -> Response:
+    return await run_refinement('sicada', metadata, request)
+
+
+@app.post('/metadata-refinement/datastation',
+          response_class=RefinedJSONResponse,
+          openapi_extra=request_body_schema(RefinerInput))
+async def datastation_metadata_refinement(
+        request: Request, metadata=Depends(refiner_metadata)) -> Response:
+    return await run_refinement('datastation', metadata, request)
+
+
+@app.post('/metadata-refinement/liss',
+          response_class=RefinedJSONResponse,
+          openapi_extra=request_body_schema(RefinerInput))
+async def liss_metadata_refinement(
+        request: Request, metadata=Depends(refiner_metadata)) -> Response:
+    return await run_refinement('liss', metadata, request)
+
+
+@app.post('/metadata-refinement/{provider}/batch',
+          response_class=RefinedJSONResponse,
+          openapi_extra=request_body_schema(BatchRefinerInput))
+async def batch_metadata_refinement(
+        provider: str, request: Request,
+        documents: list = Depends(refiner_batch_metadata)
+) -> RefinedJSONResponse:
+    """ Refines a list of metadata documents for a single provider.
+
+    Every item is refined independently; an item that fails is reported in
+    its own result instead of failing the whole batch.
+    """
+    check_provider(provider)
+    timer = request.state.timer
+    started = timer.refining()
+    try:
+        results = await executor.refine_batch(
+            provider, documents, await payload_size(request),
+            profile_request(provider, request))
+    finally:
+        timer.refined(started)
+    failed = sum(1 for result in results if result["status"] == "error")
+    response = RefinedJSONResponse({"succeeded": len(results) - failed,
+                                    "failed": failed, "results": results})
+    add_profile_header(response, request)
+    return response
+
+
+@app.post('/metadata-refinement/{provider}/stream')
+async def stream_metadata_refinement(provider: str,
+                                     request: Request) -> NDJSONResponse:
+    """ Refines an NDJSON stream of metadata documents for a single provider.
+
+    Records are parsed, refined and written back one line at a time, so the
+    body is never buffered as a whole.
+    """
+    check_provider(provider)
+    content_type = request.headers.get('content-type', '')
+    if content_type.split(';')[0].strip() != NDJSON_MEDIA_TYPE:
+        raise HTTPException(status_code=415,
+                            detail=f"Expected {NDJSON_MEDIA_TYPE} body.")
+    return NDJSONResponse(
+        refine_ndjson(provider, request.stream(), executor=executor))
+
+
+@app.post('/metadata-refinement/cbs/document-stream')
+async def cbs_document_stream_refinement(
+        request: Request) -> DuplexStreamingResponse:
+    """ Refines a single, possibly very large, CBS document as a stream.
+
+    The body is the Dataverse JSON document itself, refined with
+    cbs_stream while it is read, so the document is never held in memory.
+    Errors after the response has started, like invalid JSON, abort the
+    response.
+    """
+    if cbs_stream.ijson is None:
+        raise HTTPException(status_code=501,
+                            detail="Streaming refinement requires ijson.")
+    return DuplexStreamingResponse(
+        cbs_stream.refine_cbs_chunks(request.stream(), load_data()),
+        media_type='application/json')
+
+
+def get_job(job_id: str) -> dict:
+    if job_runner.store is None:
+        raise HTTPException(status_code=503,
+                            detail="The job runner is not started.")
+    job = job_runner.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404,
+                            detail=f"Unknown job '{job_id}'.")
+    return job
+
+
+@app.post('/jobs/{provider}', status_code=202,
+          openapi_extra=request_body_schema(JobInput))
+async def submit_job(provider: str, submission=Depends(job_input)) -> dict:
+    """ Queues a job refining a batch of documents, or a JSONL file or
+    directory of JSON files under JOB_INPUT_DIR.
+
+    Poll the job with GET /jobs/{job_id} and fetch its results when it is
+    done.
+    """
+    check_provider(provider)
+    if job_runner.store is None:
+        raise HTTPException(status_code=503,
+                            detail="The job runner is not started.")
+    documents, path = submission
+    source = None
+    if path is not None:
+        try:
+            source = resolve_job_source(path, JOB_INPUT_DIR)
+        except PermissionError as error:
+            raise HTTPException(status_code=403, detail=str(error))
+        except FileNotFoundError as error:
+            raise HTTPException(status_code=404, detail=str(error))
+    return job_runner.submit(provider, documents, source)
 
 
-@app.post('/metadata-refinement/cid')
-async def cid_metadata_refinement(refiner_input: RefinerInput) -> dict:
-    return refine_cid_metadata(refiner_input.metadata)
+@app.get('/jobs')
+async def list_jobs(limit: int = 100) -> list[dict]:
+    if job_runner.store is None:
+        return []
+    return job_runner.store.recent(limit)
 
 
-@app.post('/metadata-refinement/sicada')
-async def sicada_metadata_refinement(refiner_input: RefinerInput) -> dict:
-    return refine_sicada_metadata(refiner_input.metadata)
+@app.get('/jobs/{job_id}')
+async def job_status(job_id: str) -> dict:
+    return get_job(job_id)
 
 
-@app.post('/metadata-refinement/datastation')
-async def datastation_metadata_refinement(refiner_input: RefinerInput) -> dict:
-    return refine_datastation_metadata(refiner_input.metadata)
+@app.get('/jobs/{job_id}/results')
+async def job_results(job_id: str) -> StreamingResponse:
+    """ Streams the results of a finished job as NDJSON, one line per
+    record in the result format of the batch endpoint.
+    """
+    job = get_job(job_id)
+    if job['status'] not in ('done', 'failed'):
+        raise HTTPException(status_code=409,
+                            detail=f"Job '{job_id}' is {job['status']}.")
+    return StreamingResponse(result_lines(job_runner.store, job_id),
+                             media_type=NDJSON_MEDIA_TYPE)
 
 
-@app.post('/metadata-refinement/liss')
-async def liss_metadata_refinement(refiner_input: RefinerInput) -> dict:
-    return refine_liss_metadata(refiner_input.metadata)
+@app.delete('/jobs/{job_id}')
+async def delete_job(job_id: str) -> dict:
+    """ Deletes a job that is not running, with its inputs and results. """
+    job = get_job(job_id)
+    if job['status'] == 'running':
+        raise HTTPException(status_code=409,
+                            detail=f"Job '{job_id}' is running.")
+    job_runner.store.delete(job_id)
+    return job
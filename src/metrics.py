@@ -0,0 +1,339 @@
+import glob
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+from fast_json import dumps, loads
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = tuple(1024 * 4 ** exponent for exponent in range(10))
+
+
+def _format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"'
+                     for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+class Counter:
+    """ A monotonically increasing value per label combination. """
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str,
+                 labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(
+                label_values, 0) + amount
+
+    def snapshot(self, values: dict | None = None) -> list:
+        """ The values, or the given merged values, as plain data. """
+        with self._lock:
+            values = self._values if values is None else values
+            return [[list(labels), value] for labels, value in values.items()]
+
+    @staticmethod
+    def merge(values: dict, snapshot: list) -> None:
+        for labels, value in snapshot:
+            labels = tuple(labels)
+            values[labels] = values.get(labels, 0) + value
+
+    def samples(self, values: dict | None = None) -> Iterable[str]:
+        values = self._values if values is None else values
+        for label_values, value in sorted(values.items()):
+            yield (f"{self.name}_total"
+                   f"{_format_labels(self.labels, label_values)} {value}")
+
+
+class Histogram:
+    """ Cumulative bucket counts, sum and count per label combination. """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str,
+                 labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                # Per bucket counts (the last one is +Inf), sum.
+                series = self._values[label_values] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def snapshot(self, values: dict | None = None) -> list:
+        """ The values, or the given merged values, as plain data. """
+        with self._lock:
+            values = self._values if values is None else values
+            return [[list(labels), list(counts), total]
+                    for labels, (counts, total) in values.items()]
+
+    @staticmethod
+    def merge(values: dict, snapshot: list) -> None:
+        for labels, counts, total in snapshot:
+            series = values.setdefault(tuple(labels), [[0] * len(counts), 0.0])
+            series[0] = [a + b for a, b in zip(series[0], counts)]
+            series[1] += total
+
+    def samples(self, values: dict | None = None) -> Iterable[str]:
+        values = self._values if values is None else values
+        label_names = self.labels + ('le',)
+        for label_values, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            bounds = [repr(float(bucket)) for bucket in self.buckets]
+            for bound, count in zip(bounds + ['+Inf'], counts):
+                cumulative += count
+                labels = _format_labels(label_names, label_values + (bound,))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Gauge:
+    """ A value read from a callback at scrape time.
+
+    The callback returns a number, or a dict of label value tuples to
+    numbers for a gauge with labels.
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str,
+                 callback: Callable[[], float | dict],
+                 labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.callback = callback
+
+    def samples(self) -> Iterable[str]:
+        value = self.callback()
+        if not isinstance(value, dict):
+            value = {(): value}
+        for label_values, sample in sorted(value.items()):
+            yield (f"{self.name}"
+                   f"{_format_labels(self.labels, label_values)} {sample}")
+
+
+# The values of exited workers, in the directory of a shared Registry.
+AGGREGATE_FILE = 'exited.json'
+
+
+def _read_values(filename: str) -> dict | None:
+    try:
+        with open(filename, 'rb') as file:
+            return loads(file.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_values(filename: str, values: dict) -> None:
+    """ Replaces a file atomically, so readers never see a partial write.
+    """
+    with open(f'{filename}.tmp', 'wb') as file:
+        file.write(dumps(values))
+    os.replace(f'{filename}.tmp', filename)
+
+
+class Registry:
+    """ The metrics of a process, or of all worker processes sharing a
+    directory.
+
+    With a directory (see `share`), every worker writes the values of its
+    counters and histograms to a file of its own there, every
+    `flush_interval` seconds and before rendering, and rendering sums the
+    files of all workers, so any worker serves the totals. The values of
+    exited workers are folded into one aggregate file (see `retire`), so
+    totals never go down while the directory stays small. Gauges are not
+    written to files and are read from the rendering worker only.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.directory: str | None = None
+        self.worker = str(os.getpid())
+        self._stopped = threading.Event()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def share(self, directory: str, worker: str | None = None,
+              flush_interval: float = 1.0) -> None:
+        """ Shares the metrics of this process with the other workers
+        using `directory`. Call it in every worker, after forking.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.worker = worker or str(os.getpid())
+        self._stopped.clear()
+        thread = threading.Thread(target=self._flush_periodically,
+                                  args=(flush_interval,),
+                                  name='metrics-flush', daemon=True)
+        thread.start()
+
+    @staticmethod
+    def clear(directory: str) -> None:
+        """ Removes the files of earlier workers, before any worker starts.
+        """
+        for filename in glob.glob(os.path.join(directory, '*.json')):
+            os.remove(filename)
+
+    def stop(self) -> None:
+        """ Stops the periodic flushes, flushing one last time. """
+        self._stopped.set()
+        if self.directory is not None:
+            self.flush()
+
+    def _flush_periodically(self, interval: float) -> None:
+        while not self._stopped.wait(interval):
+            self.flush()
+
+    def flush(self) -> None:
+        """ Writes the values of this worker to its file. """
+        values = {metric.name: metric.snapshot() for metric in self.metrics
+                  if hasattr(metric, 'snapshot')}
+        _write_values(os.path.join(self.directory, f'{self.worker}.json'),
+                      values)
+
+    def retire(self, directory: str, worker: str) -> None:
+        """ Folds the values of an exited worker into the aggregate file and
+        removes the worker's file. Called by the gunicorn master, the only
+        writer of the aggregate file, when a worker exits.
+
+        The aggregate lists the workers folded into it, so a worker file
+        read before it is removed is not counted twice.
+        """
+        filename = os.path.join(directory, f'{worker}.json')
+        values = _read_values(filename)
+        if values is None:
+            return
+        aggregate_file = os.path.join(directory, AGGREGATE_FILE)
+        aggregate = _read_values(aggregate_file) or {}
+        merged = self._merge_values([aggregate.get('values', {}), values])
+        workers = [folded for folded in aggregate.get('workers', [])
+                   if os.path.exists(os.path.join(directory,
+                                                  f'{folded}.json'))]
+        _write_values(aggregate_file, {
+            "workers": workers + [worker],
+            "values": {metric.name: metric.snapshot(merged[metric.name])
+                       for metric in self.metrics
+                       if metric.name in merged}})
+        os.remove(filename)
+
+    def _merge_values(self, files: list[dict]) -> dict[str, dict]:
+        """ Sums the values of several files per metric. """
+        merged: dict[str, dict] = {}
+        merge = {metric.name: metric.merge for metric in self.metrics
+                 if hasattr(metric, 'merge')}
+        for values in files:
+            for name, snapshot in values.items():
+                if name in merge:
+                    merge[name](merged.setdefault(name, {}), snapshot)
+        return merged
+
+    def _merged(self) -> dict[str, dict]:
+        """ The values of all workers, summed per metric. """
+        self.flush()
+        workers = {}
+        for filename in glob.glob(os.path.join(self.directory, '*.json')):
+            if os.path.basename(filename) == AGGREGATE_FILE:
+                continue
+            values = _read_values(filename)
+            if values is not None:
+                workers[os.path.basename(filename)[:-len('.json')]] = values
+        # Read last: a worker file read above that has since been folded
+        # into the aggregate is listed in it.
+        aggregate = _read_values(
+            os.path.join(self.directory, AGGREGATE_FILE)) or {}
+        for folded in aggregate.get('workers', ()):
+            workers.pop(folded, None)
+        return self._merge_values(
+            list(workers.values()) + [aggregate.get('values', {})])
+
+    def render(self) -> str:
+        """ Renders all metrics in the Prometheus text exposition format. """
+        merged = self._merged() if self.directory is not None else None
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            if merged is not None and hasattr(metric, 'merge'):
+                lines.extend(metric.samples(merged.get(metric.name, {})))
+            else:
+                lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+class RequestTimer:
+    """ Splits the time spent on a refinement request into phases.
+
+    `validation` runs from the start of the request until the handler starts
+    refining (reading and validating the body), `refinement` is the refiner
+    itself and `serialization` is whatever remains until the response is
+    ready.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.validation = None
+        self.refinement = None
+
+    def refining(self) -> float:
+        now = time.perf_counter()
+        self.validation = now - self.start
+        return now
+
+    def refined(self, started: float) -> None:
+        self.refinement = time.perf_counter() - started
+
+    def phases(self, total: float) -> dict[str, float] | None:
+        if self.refinement is None:
+            return None
+        return {
+            "validation": self.validation,
+            "refinement": self.refinement,
+            "serialization": max(
+                0.0, total - self.validation - self.refinement),
+        }
+
+
+registry = Registry()
+
+requests_total = registry.register(Counter(
+    'refiner_requests', 'Requests by endpoint, method and status code.',
+    ('endpoint', 'method', 'status')))
+request_duration = registry.register(Histogram(
+    'refiner_request_duration_seconds', 'Request latency by endpoint.',
+    ('endpoint',)))
+request_size = registry.register(Histogram(
+    'refiner_request_size_bytes', 'Request body size by endpoint.',
+    ('endpoint',), buckets=SIZE_BUCKETS))
+phase_duration = registry.register(Histogram(
+    'refiner_phase_duration_seconds',
+    'Time spent in validation, refinement and serialization by endpoint.',
+    ('endpoint', 'phase')))
@@ -0,0 +1,75 @@
+from typing import AsyncIterable, AsyncIterator
+
+from executor import RefinementExecutor
+from fast_json import dumps, loads
+from providers import refine_item
+from responses import DuplexStreamingResponse
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+
+class NDJSONResponse(DuplexStreamingResponse):
+    """ Streams NDJSON while the request body is still being read, see
+    DuplexStreamingResponse.
+    """
+    media_type = NDJSON_MEDIA_TYPE
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """ Splits a stream of byte chunks into lines, without the line endings.
+
+    Only the current, incomplete line is kept in memory, as the parts it
+    arrived in, and only new chunks are searched for line endings, so a long
+    line is not copied and scanned again for every chunk.
+    """
+    parts: list[bytes] = []
+    async for chunk in chunks:
+        start = 0
+        while (end := chunk.find(b'\n', start)) != -1:
+            parts.append(chunk[start:end])
+            line = b''.join(parts)
+            parts = []
+            start = end + 1
+            yield line.rstrip(b'\r')
+        if start < len(chunk):
+            parts.append(chunk[start:])
+    if parts:
+        yield b''.join(parts).rstrip(b'\r')
+
+
+async def refine_ndjson(provider: str, chunks: AsyncIterable[bytes],
+                        dsc_dictionary: dict | None = None,
+                        executor: RefinementExecutor | None = None
+                        ) -> AsyncIterator[bytes]:
+    """ Refines a stream of NDJSON records one record at a time.
+
+    Every non-empty input line yields one output line with the same result
+    format as the batch endpoint, so an invalid record does not end the
+    stream.
+
+    :param provider: Name of the data provider, e.g. 'cbs'.
+    :param chunks: The request body as a stream of byte chunks.
+    :param dsc_dictionary: DSC dictionary, only used by the CBS refiner when
+        records are refined inline.
+    :param executor: Refines every record, offloading the records larger
+        than its size threshold; without one records are refined inline.
+    :return: An async iterator over NDJSON encoded results.
+    """
+    index = 0
+    async for line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        try:
+            metadata = loads(line)
+        except ValueError as error:
+            result = {"index": index, "status": "error", "status_code": 400,
+                      "detail": f"Invalid JSON: {error}"}
+        else:
+            if executor is None:
+                result = refine_item(provider, index, metadata,
+                                     dsc_dictionary)
+            else:
+                result = await executor.refine_item(provider, index,
+                                                    metadata, len(line))
+        index += 1
+        yield dumps(result) + b'\n'
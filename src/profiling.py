@@ -0,0 +1,320 @@
+""" Opt-in profiling of refinements.
+
+With profiling on, a request is profiled when it carries the
+X-Refiner-Profile header or is picked by the sample rate. Its refinement
+runs under cProfile, or pyinstrument when that is installed and chosen, on
+the same inline, thread or process path it would take otherwise. Profiles
+are kept in a bounded ProfileStore, a SQLite file shared by the server
+workers, and rendered on download.
+"""
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import Mapping
+from typing import Any, Callable, NamedTuple
+
+from fast_json import dumps, loads
+
+try:
+    import pyinstrument
+    import pyinstrument.renderers
+    import pyinstrument.session
+except ImportError:
+    pyinstrument = None
+
+PROFILE_HEADER = 'X-Refiner-Profile'
+PROFILERS = ('cprofile', 'pyinstrument')
+
+# Download formats per profiler, the first is the default.
+PROFILE_FORMATS = {
+    'cprofile': ('text', 'pstats', 'collapsed'),
+    'pyinstrument': ('text', 'html', 'speedscope'),
+}
+
+# Refinements take milliseconds, so pyinstrument samples more often than its
+# default of once per millisecond.
+PYINSTRUMENT_INTERVAL = 0.0001
+
+# Functions listed in the text format of a cProfile profile.
+TEXT_LIMIT = 60
+
+# Held while a call is profiled. Since Python 3.12 only one cProfile
+# profiler can be active per process, so concurrent refinements are not
+# profiled.
+_profile_lock = threading.Lock()
+
+
+class Profile(NamedTuple):
+    """ The profile of one refinement. """
+    id: str
+    provider: str
+    endpoint: str
+    created: float
+    # Wall time of the profiled call, in seconds.
+    duration: float
+    profiler: str
+    # Marshalled pstats for cProfile, session JSON for pyinstrument.
+    data: bytes
+
+    def summary(self) -> dict:
+        return {"id": self.id, "provider": self.provider,
+                "endpoint": self.endpoint, "created": self.created,
+                "duration": self.duration, "profiler": self.profiler,
+                "formats": list(PROFILE_FORMATS[self.profiler])}
+
+
+def profile_call(profiler: str, func: Callable, *args) -> tuple:
+    """ Calls func(*args) under a profiler, or without one if another call
+    is being profiled in this process.
+
+    Module level and returning plain data, so it can run in a worker
+    process.
+
+    :return: The result of func, the profile data (None if the call was not
+        profiled) and the wall time.
+    """
+    started = time.perf_counter()
+    if not _profile_lock.acquire(blocking=False):
+        return func(*args), None, time.perf_counter() - started
+    try:
+        result, data = _profile(profiler, func, *args)
+    finally:
+        _profile_lock.release()
+    return result, data, time.perf_counter() - started
+
+
+def _profile(profiler: str, func: Callable, *args) -> tuple:
+    if profiler == 'pyinstrument':
+        sampler = pyinstrument.Profiler(interval=PYINSTRUMENT_INTERVAL,
+                                        async_mode='disabled')
+        sampler.start()
+        try:
+            result = func(*args)
+        finally:
+            session = sampler.stop()
+        data = dumps(session.to_json())
+    else:
+        profile = cProfile.Profile()
+        result = profile.runcall(func, *args)
+        profile.create_stats()
+        data = marshal.dumps(profile.stats)
+    return result, data
+
+
+class ProfileRequest(NamedTuple):
+    """ Asks the executor to profile a refinement. """
+    profiler: str
+    # Called with the profile data and the wall time of the refinement, if
+    # it was profiled.
+    record: Callable[[bytes, float], None]
+
+
+class ProfileStore:
+    """ The most recent profiles, at most `maxsize` of them, in a SQLite
+    file, so a profile recorded by one server worker can be downloaded from
+    any other. ':memory:' keeps them in this process only.
+    """
+
+    def __init__(self, filename: str = ':memory:', maxsize: int = 50):
+        self.filename = filename
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False,
+                                           isolation_level=None, timeout=30)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS profiles ('
+            'id TEXT PRIMARY KEY, provider TEXT NOT NULL, '
+            'endpoint TEXT NOT NULL, created REAL NOT NULL, '
+            'duration REAL NOT NULL, profiler TEXT NOT NULL, '
+            'data BLOB NOT NULL)')
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                'SELECT COUNT(*) FROM profiles').fetchone()[0]
+
+    def add(self, profile: Profile) -> None:
+        with self._lock:
+            self._connection.execute(
+                'INSERT INTO profiles VALUES (?, ?, ?, ?, ?, ?, ?)', profile)
+            self._connection.execute(
+                'DELETE FROM profiles WHERE rowid NOT IN (SELECT rowid FROM '
+                'profiles ORDER BY rowid DESC LIMIT ?)', (self.maxsize,))
+
+    def get(self, profile_id: str) -> Profile | None:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT * FROM profiles WHERE id = ?',
+                (profile_id,)).fetchone()
+        return Profile(*row) if row is not None else None
+
+    def recent(self) -> list[Profile]:
+        """ The stored profiles, newest first. """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT * FROM profiles ORDER BY rowid DESC').fetchall()
+        return [Profile(*row) for row in rows]
+
+
+class Profiler:
+    """ Decides which requests are profiled and stores their profiles.
+
+    :param enabled: Profile nothing when False, whatever the headers.
+    :param sample_rate: Fraction of requests profiled without the header.
+    :param profiler: One of PROFILERS.
+    :param store_size: Number of profiles kept.
+    :param store_path: The SQLite file of the ProfileStore, only created
+        when profiling is enabled.
+    :raises ValueError: Raises for an unknown or uninstalled profiler.
+    """
+
+    def __init__(self, enabled: bool = False, sample_rate: float = 0.0,
+                 profiler: str = 'cprofile', store_size: int = 50,
+                 store_path: str = ':memory:'):
+        if profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler '{profiler}', expected one "
+                             f"of {', '.join(PROFILERS)}.")
+        if profiler == 'pyinstrument' and enabled and pyinstrument is None:
+            raise ValueError("The pyinstrument profiler is not installed.")
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.profiler = profiler
+        self.store_path = store_path if enabled else ':memory:'
+        self.store_size = store_size
+        self.store = ProfileStore(self.store_path, store_size)
+
+    def reopen(self) -> None:
+        """ Opens the store again, e.g. in a freshly forked worker. """
+        self.store = ProfileStore(self.store_path, self.store_size)
+
+    def wants(self, headers: Mapping[str, str]) -> bool:
+        """ Whether to profile a request with the given headers. """
+        if not self.enabled:
+            return False
+        if headers.get(PROFILE_HEADER, '').lower() in ('1', 'true', 'yes'):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def record(self, provider: str, endpoint: str, data: bytes,
+               duration: float) -> Profile:
+        profile = Profile(id=uuid.uuid4().hex, provider=provider,
+                          endpoint=endpoint, created=time.time(),
+                          duration=duration, profiler=self.profiler,
+                          data=data)
+        self.store.add(profile)
+        return profile
+
+
+def render(profile: Profile, profile_format: str) -> tuple[bytes, str, str]:
+    """ Renders a profile for download.
+
+    :return: The content, its media type and a file name.
+    :raises ValueError: Raises if the format is not one of the profile's.
+    """
+    if profile_format not in PROFILE_FORMATS[profile.profiler]:
+        raise ValueError(
+            f"Unknown format '{profile_format}' for a {profile.profiler} "
+            f"profile, expected one of "
+            f"{', '.join(PROFILE_FORMATS[profile.profiler])}.")
+    if profile.profiler == 'pyinstrument':
+        return _render_pyinstrument(profile, profile_format)
+
+    if profile_format == 'pstats':
+        # The format of pstats.Stats.dump_stats, for snakeviz and friends.
+        return profile.data, 'application/octet-stream', \
+            f'{profile.id}.prof'
+    stats = marshal.loads(profile.data)
+    if profile_format == 'collapsed':
+        return collapsed_stacks(stats).encode(), 'text/plain', \
+            f'{profile.id}.folded'
+    output = io.StringIO()
+    printer = pstats.Stats(_StatsData(stats), stream=output)
+    printer.sort_stats('cumulative').print_stats(TEXT_LIMIT)
+    return output.getvalue().encode(), 'text/plain', f'{profile.id}.txt'
+
+
+def _render_pyinstrument(profile: Profile,
+                         profile_format: str) -> tuple[bytes, str, str]:
+    if pyinstrument is None:
+        raise ValueError("Rendering pyinstrument profiles needs "
+                         "pyinstrument.")
+    session = pyinstrument.session.Session.from_json(loads(profile.data))
+    renderers = pyinstrument.renderers
+    if profile_format == 'html':
+        return renderers.HTMLRenderer().render(session).encode(), \
+            'text/html', f'{profile.id}.html'
+    if profile_format == 'speedscope':
+        return renderers.SpeedscopeRenderer().render(session).encode(), \
+            'application/json', f'{profile.id}.speedscope.json'
+    text = renderers.ConsoleRenderer(unicode=True, color=False,
+                                     show_all=False).render(session)
+    return text.encode(), 'text/plain', f'{profile.id}.txt'
+
+
+class _StatsData:
+    """ Raw cProfile stats in the shape pstats.Stats loads from. """
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+def collapsed_stacks(stats: dict, max_depth: int = 64) -> str:
+    """ Folds cProfile stats into collapsed stacks, the input of
+    flamegraph.pl and speedscope.
+
+    cProfile keeps the callers of every function, not whole stacks. Stacks
+    are rebuilt from the roots down, sharing the time of a function among
+    its callers by the time spent in it per caller; recursive calls are cut
+    off. Times are in microseconds.
+    """
+    callees: dict[Any, list] = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees.setdefault(caller, []).append((func, cumulative))
+
+    lines: dict[str, float] = {}
+    # The functions on the stack being walked.
+    visiting = set()
+
+    def walk(func, stack: tuple, share: float) -> None:
+        own = stats[func][2]
+        stack = stack + (_label(func),)
+        path = ';'.join(stack)
+        lines[path] = lines.get(path, 0) + own * share
+        if len(stack) >= max_depth:
+            return
+        for callee, callee_time in callees.get(func, ()):
+            callee_cumulative = stats[callee][3]
+            if callee in visiting or not callee_cumulative:
+                continue
+            visiting.add(callee)
+            walk(callee, stack,
+                 share * min(callee_time / callee_cumulative, 1.0))
+            visiting.discard(callee)
+
+    for func, (_, _, _, _, callers) in stats.items():
+        if not any(caller in stats for caller in callers):
+            visiting = {func}
+            walk(func, (), 1.0)
+
+    return ''.join(f'{path} {round(seconds * 1e6)}\n'
+                   for path, seconds in lines.items()
+                   if round(seconds * 1e6) > 0)
+
+
+def _label(func: tuple) -> str:
+    filename, line, name = func
+    if filename == '~':
+        return name.replace(';', ',')
+    return f'{name} ({os.path.basename(filename)}:{line})'.replace(';', ',')
@@ -0,0 +1,78 @@
+from typing import Callable
+
+from fastapi import HTTPException
+
+import tracing
+
+from refiners.cbs_refiner import refine_cbs_metadata
+from refiners.cid_refiner import refine_cid_metadata
+from refiners.datastation_refiner import refine_datastation_metadata
+from refiners.liss_refiner import refine_liss_metadata
+from refiners.sicada_refiner import refine_sicada_metadata
+
+# Refiners that only need the metadata.
+REFINERS: dict[str, Callable[[dict], dict]] = {
+    'cid': refine_cid_metadata,
+    'sicada': refine_sicada_metadata,
+    'datastation': refine_datastation_metadata,
+    'liss': refine_liss_metadata,
+}
+
+# Refiners that also need the DSC dictionary.
+DSC_REFINERS: dict[str, Callable[[dict, dict], dict]] = {
+    'cbs': refine_cbs_metadata,
+}
+
+PROVIDERS = tuple(DSC_REFINERS) + tuple(REFINERS)
+
+# Refiners that resolve license names with the license table.
+LICENSE_REFINERS = ('datastation',)
+
+
+def uses_dsc_table(provider: str) -> bool:
+    return provider in DSC_REFINERS
+
+
+def uses_license_table(provider: str) -> bool:
+    return provider in LICENSE_REFINERS
+
+
+def check_provider(provider: str) -> None:
+    """ Raises a 404 if there is no refiner for the given provider. """
+    if provider not in DSC_REFINERS and provider not in REFINERS:
+        raise HTTPException(status_code=404,
+                            detail=f"Unknown provider '{provider}'.")
+
+
+def refine(provider: str, metadata, dsc_dictionary: dict | None = None):
+    """ Refines metadata with the refiner of the given provider.
+
+    :param provider: Name of the data provider, e.g. 'cbs'.
+    :param metadata: Dataverse JSON to refine.
+    :param dsc_dictionary: DSC dictionary, only used by the CBS refiner.
+    :return: Refined metadata.
+    :raises HTTPException: Raises if the provider is unknown or the refiner
+        rejects the metadata.
+    """
+    check_provider(provider)
+    with tracing.span(f'{provider}.refine'):
+        if provider in DSC_REFINERS:
+            return DSC_REFINERS[provider](metadata, dsc_dictionary)
+        return REFINERS[provider](metadata)
+
+
+def refine_item(provider: str, index: int, metadata,
+                dsc_dictionary: dict | None = None) -> dict:
+    """ Refines a single item of a batch, capturing failures in the result.
+
+    :return: A result dict with either the refined metadata or the error.
+    """
+    try:
+        refined = refine(provider, metadata, dsc_dictionary)
+    except HTTPException as error:
+        return {"index": index, "status": "error",
+                "status_code": error.status_code, "detail": error.detail}
+    except Exception as error:  # a malformed item must not fail the batch
+        return {"index": index, "status": "error", "status_code": 500,
+                "detail": f"{type(error).__name__}: {error}"}
+    return {"index": index, "status": "ok", "metadata": refined}
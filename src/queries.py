@@ -1 +1,47 @@
+import jmespath
+from jmespath.parser import ParsedResult
+
 CBS_ID_QUERY = "datasetVersion.metadataBlocks.citation.fields[?typeName == 'otherId'].value[*].otherIdValue.value[] | [0]"
+
+# All JMESPath expressions used by the refiners, by name. They are compiled
+# once at import time, so a search does not re-parse the expression.
+QUERIES = {
+    'cbs_id': CBS_ID_QUERY,
+}
+
+_compiled: dict[str, ParsedResult] = {}
+
+
+def register_query(name: str, expression: str) -> ParsedResult:
+    """ Compiles an expression and registers it under the given name.
+
+    :raises jmespath.exceptions.ParseError: Raises if the expression is
+        invalid, which surfaces at import time of the registering module.
+    """
+    compiled = jmespath.compile(expression)
+    QUERIES[name] = expression
+    _compiled[name] = compiled
+    return compiled
+
+
+def require_queries(*names: str) -> tuple[ParsedResult, ...]:
+    """ Declares the queries a refiner needs and returns them compiled.
+
+    Call this at module level so a missing query fails on import rather than
+    on the first request.
+
+    :raises KeyError: Raises if a query is not registered.
+    """
+    missing = [name for name in names if name not in _compiled]
+    if missing:
+        raise KeyError(f"Unknown queries: {', '.join(missing)}")
+    return tuple(_compiled[name] for name in names)
+
+
+def search(name: str, data):
+    """ Runs the compiled query registered under `name` on `data`. """
+    return _compiled[name].search(data)
+
+
+for _name, _expression in QUERIES.items():
+    _compiled[_name] = jmespath.compile(_expression)
@@ -0,0 +1 @@
+""" Offline refinement: `python -m refiner <provider> <input>`. """
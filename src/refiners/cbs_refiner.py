@@ -1,13 +1,26 @@
+import os
 import re
-import jmespath
 
 from fastapi import HTTPException
 
-from queries import CBS_ID_QUERY
-from utils import get_field, add_doi_to_dab_link
+import tracing
+from cache import LRUCache
+from field_index import FieldIndex
+from queries import require_queries
+from rules import Rule, apply_rules, register_rules
+from utils import add_doi_to_dab_link
 
+CBS_ID, = require_queries('cbs_id')
 
-def refine_cbs_metadata(metadata: dict, dsc_dictionary) -> dict:
+ALT_TITLE_CACHE_SIZE = int(os.environ.get('ALT_TITLE_CACHE_SIZE', '8192'))
+
+# Cleaned alternative titles by raw title. Cleaning is a pure function of
+# the title, so entries never go stale, also not when the DSC table reloads.
+alt_title_cache = LRUCache(ALT_TITLE_CACHE_SIZE)
+
+
+def refine_cbs_metadata(metadata: dict, dsc_dictionary,
+                        field_index: FieldIndex | None = None) -> dict:
     """ Refines CBS metadata, specificly alt title, keyword and statline field.
 
     The alternative title is either matched on a table or cleaned up.
@@ -16,61 +29,76 @@ def refine_cbs_metadata(metadata: dict, dsc_dictionary) -> dict:
 
     :param metadata: CBS metadata to be refined.
     :param dsc_dictionary: DSC dictionary containing refined alt titles.
+    :param field_index: Field index of the metadata, if one already exists.
     :return: Refined metadata.
     :raises HTTPException: Raises if required keys are missing from metadata.
     """
     try:
-        metadataBlocks = metadata['datasetVersion']['metadataBlocks']
+        field_index = field_index or FieldIndex(metadata)
     except KeyError as error:
         raise HTTPException(status_code=422, detail=str(error))
 
-    # refinements for fields in the citation metadata block.
-    if 'citation' in metadataBlocks:
-        citation_fields = metadataBlocks['citation']['fields']
-
-        alt_title_dict = get_field('alternativeTitle', citation_fields)
-        if 'value' in alt_title_dict:
-            alt_titles = []
-            for alternative_title in alt_title_dict['value']:
-                alt_titles.append(refine_alternative_title(
-                    alternative_title, dsc_dictionary))
-            alt_title_dict['value'] = alt_titles
-        keyword_dict = get_field('keyword', citation_fields)
-        if 'value' in keyword_dict:
-            keyword_dict['value'] = refine_keywords(
-                keyword_dict['value'])
-
-    # refinements for fields in the CBSMetadata block.
-    if 'CBSMetadata' in metadataBlocks:
-        CBS_fields = metadataBlocks['CBSMetadata']['fields']
-
-        statline_dict = get_field('statlineTabel', CBS_fields)
-        if 'value' in statline_dict:
-            statline_dict['value'] = refine_statline_table(
-                statline_dict['value'])
-
-    cbs_id = jmespath.search(CBS_ID_QUERY, metadata)
-    if cbs_id:
-        doi = "doi:10.57934/" + cbs_id
-        add_doi_to_dab_link(metadata, doi)
+    apply_rules('cbs', field_index, {'dsc_dictionary': dsc_dictionary})
+
+    with tracing.span('cbs.doi'):
+        cbs_id = CBS_ID.search(metadata)
+        if cbs_id:
+            doi = "doi:10.57934/" + cbs_id
+            add_doi_to_dab_link(metadata, doi)
 
     return metadata
 
 
+def refine_alternative_titles(alt_titles: list, context: dict) -> list:
+    """ Refines every alternative title, see refine_alternative_title. """
+    dsc_dictionary = context['dsc_dictionary']
+    return [refine_alternative_title(alt_title, dsc_dictionary)
+            for alt_title in alt_titles]
+
+
 def refine_keywords(keyword_values):
     """ Refine a list of keyword values by splitting specific keywords.
 
+    Entries that are already a single keyword in the refined format are kept
+    as they are, and the list itself is returned when no entry changes.
+
     :param keyword_values: The list of keyword values to refine.
     :return: A list of refined keywords.
     """
 
-    refined_keywords = []
-    for keyword_value in keyword_values:
+    # Only built from the first entry that changes.
+    refined_keywords = None
+    for index, keyword_value in enumerate(keyword_values):
+        if 'keywordValue' in keyword_value \
+                and is_refined_keyword(keyword_value):
+            if refined_keywords is not None:
+                refined_keywords.append(keyword_value)
+            continue
+        if refined_keywords is None:
+            refined_keywords = keyword_values[:index]
         if 'keywordValue' in keyword_value:
             refined_keywords.extend(
                 Add_split_keywords(keyword_value['keywordValue']['value'])
             )
-    return refined_keywords
+    return keyword_values if refined_keywords is None else refined_keywords
+
+
+KEYWORD_KEYS = ('typeName', 'multiple', 'typeClass', 'value')
+
+
+def is_refined_keyword(keyword_value: dict) -> bool:
+    """ Whether a keyword value is exactly what Add_split_keywords makes of
+    it, down to the order of the keys, so it can be reused as is.
+    """
+    if len(keyword_value) != 1:
+        return False
+    keyword = keyword_value['keywordValue']
+    return isinstance(keyword, dict) and tuple(keyword) == KEYWORD_KEYS \
+        and keyword['typeName'] == 'keywordValue' \
+        and keyword['multiple'] is False \
+        and keyword['typeClass'] == 'primitive' \
+        and isinstance(keyword['value'], str) \
+        and '/' not in keyword['value']
 
 
 def Add_split_keywords(keyword):
@@ -99,6 +127,10 @@ def refine_alternative_title(alt_title, dsc_dictionary):
     Refine an alternative title by looking it up in a dictionary or
     cleaning it if not found.
 
+    Both lookups are constant time: the DSC dictionary is checked first and
+    titles that are not in it are cleaned once and then served from
+    `alt_title_cache`.
+
     :param alt_title: The alternative title to refine.
     :param dsc_dictionary: Dictionary containing refined alternative titles.
     :return: The refined alternative title.
@@ -106,7 +138,16 @@ def refine_alternative_title(alt_title, dsc_dictionary):
     try:
         return dsc_dictionary[alt_title]
     except KeyError:
-        return clean_alternative_title(alt_title)
+        return cached_clean_alternative_title(alt_title)
+
+
+def cached_clean_alternative_title(alternative_title: str) -> str:
+    """ clean_alternative_title, memoized in `alt_title_cache`. """
+    cleaned = alt_title_cache.get(alternative_title)
+    if cleaned is None:
+        cleaned = clean_alternative_title(alternative_title)
+        alt_title_cache.put(alternative_title, cleaned)
+    return cleaned
 
 
 def clean_alternative_title(alternative_title: str):
@@ -126,11 +167,16 @@ def clean_alternative_title(alternative_title: str):
     6. Remove trailing underscores from the alternative title.
 
     After, the function returns the cleaned alternative title as a string.
+    Every step but the last needs a 'JJJJ' or 'VV' in the title, and every
+    replacement is only done when the code it removes can be there, so most
+    titles get away with a few substring checks.
 
     :param alternative_title: The alternative title to be cleaned.
     :return: The cleaned alternative title.
     """
     alternative_title = alternative_title.upper()
+    if 'JJJJ' not in alternative_title and 'VV' not in alternative_title:
+        return alternative_title.rstrip('_')
 
     # remove JJJJ and VV suffixes from end of string if they match the pattern.
     if alternative_title.endswith('VV'):
@@ -138,23 +184,20 @@ def clean_alternative_title(alternative_title: str):
     if alternative_title.endswith('JJJJ'):
         alternative_title = alternative_title[:-4]
 
-    # Remove JJJJMMDD or JJMM from the title.
-    if "JJJJMMDD" in alternative_title:
-        dd_index = alternative_title.find("JJJJMMDD")
-        alternative_title = alternative_title[:dd_index] + alternative_title[
-                                                           dd_index + 8:]
-    if "JJJJMM" in alternative_title:
-        mm_index = alternative_title.find("JJJJMM")
-        alternative_title = alternative_title[:mm_index] + alternative_title[
-                                                           mm_index + 6:]
+    # Remove JJJJMMDD or JJJJMM from the title.
+    if 'JJJJMM' in alternative_title:
+        alternative_title = alternative_title.replace(
+            'JJJJMMDD', '', 1).replace('JJJJMM', '', 1)
 
     # remove JJJJ and VV suffixes surrounding "bus/BUS" or "tab/TAB".
-    alternative_title = alternative_title.replace('JJJJBUS', 'BUS').replace(
-        'VVBUS', 'BUS').replace('JJJJTAB', 'TAB').replace('VVTAB', 'TAB')
-
-    alternative_title = alternative_title.rstrip('_')
+    if 'BUS' in alternative_title:
+        alternative_title = alternative_title.replace(
+            'JJJJBUS', 'BUS').replace('VVBUS', 'BUS')
+    if 'TAB' in alternative_title:
+        alternative_title = alternative_title.replace(
+            'JJJJTAB', 'TAB').replace('VVTAB', 'TAB')
 
-    return alternative_title
+    return alternative_title.rstrip('_')
 
 
 def refine_statline_table(statlineLinks: list) -> list:
@@ -162,17 +205,27 @@ def refine_statline_table(statlineLinks: list) -> list:
 
     Some links to the statline tables only include the id of the table.
     This function splits the links not yet in URL format from the correctly
-    formatted links. It then formats them to also be clickable URLs.
+    formatted links. It then formats them to also be clickable URLs, after
+    the links that were URLs already. Lists of URLs are returned as is.
 
     :param statlineLinks: A list of URLs and table id's. (Linking to statline).
     :return: List with URLs linking to statline tables.
     """
-    valid_urls = [url for url in statlineLinks if is_url(url)]
-    statline_codes = [url for url in statlineLinks if not is_url(url)]
-    formatted_statline_urls = [format_statline_url(code) for code in
-                               statline_codes]
-
-    return valid_urls + formatted_statline_urls
+    # Only built from the first link that is a code.
+    valid_urls = None
+    formatted_statline_urls = []
+    for index, link in enumerate(statlineLinks):
+        if not is_url(link):
+            if valid_urls is None:
+                valid_urls = statlineLinks[:index]
+            formatted_statline_urls.append(format_statline_url(link))
+        elif valid_urls is not None:
+            valid_urls.append(link)
+    if valid_urls is None:
+        return statlineLinks
+
+    valid_urls.extend(formatted_statline_urls)
+    return valid_urls
 
 
 def format_statline_url(statline_code):
@@ -184,7 +237,18 @@ def format_statline_url(statline_code):
     return f'https://opendata.cbs.nl/#/CBS/nl/dataset/{statline_code}'
 
 
+URL_PATTERN = re.compile(r'^https?://\S+$')
+
+
 def is_url(s):
     """ Checks if a string is a URL """
-    url_pattern = r'^https?://\S+$'
-    return bool(re.match(url_pattern, s))
+    return URL_PATTERN.match(s) is not None
+
+
+register_rules([
+    Rule('cbs', 'citation', 'alternativeTitle', refine_alternative_titles),
+    Rule('cbs', 'citation', 'keyword',
+         lambda value, context: refine_keywords(value)),
+    Rule('cbs', 'CBSMetadata', 'statlineTabel',
+         lambda value, context: refine_statline_table(value)),
+])
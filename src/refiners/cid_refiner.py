@@ -1,23 +1,16 @@
 from datetime import datetime
 from fastapi import HTTPException
-from utils import get_field
+from field_index import FieldIndex
+from rules import Rule, apply_rules, register_rules
 
 
-def refine_cid_metadata(metadata):
+def refine_cid_metadata(metadata, field_index: FieldIndex | None = None):
     try:
-        metadataBlocks = metadata['datasetVersion']['metadataBlocks']
+        field_index = field_index or FieldIndex(metadata)
     except KeyError as error:
         raise HTTPException(status_code=422, detail=str(error))
 
-    # refinements for fields in the citation metadata block.
-    if 'citation' in metadataBlocks:
-        citation_fields = metadataBlocks['citation']['fields']
-
-        # dist date looks like "2023-10-29T07:58:43.398551" and should be just "2023-10-29"
-        dist_date_dict = get_field('distributionDate', citation_fields)
-        if 'value' in dist_date_dict:
-            dist_date_dict['value'] = refine_distribution_date(
-                dist_date_dict['value'])
+    apply_rules('cid', field_index)
 
     return metadata
 
@@ -25,4 +18,11 @@ def refine_cid_metadata(metadata):
 def refine_distribution_date(dist_date):
     date_obj = datetime.strptime(dist_date, "%Y-%m-%dT%H:%M:%S.%f")
     formatted_date = date_obj.strftime("%Y-%m-%d")
-    return formatted_date
\ No newline at end of file
+    return formatted_date
+
+
+# dist date looks like "2023-10-29T07:58:43.398551" and should be just "2023-10-29"
+register_rules([
+    Rule('cid', 'citation', 'distributionDate',
+         lambda value, context: refine_distribution_date(value)),
+])
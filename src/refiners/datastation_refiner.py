@@ -1,20 +1,24 @@
 from fastapi import HTTPException
 
+import tracing
 from utils import add_doi_to_dab_link, format_license
 
 
 def refine_datastation_metadata(metadata: dict) -> dict:
-    if 'license' in metadata['datasetVersion'] and metadata['datasetVersion'][
-         'license'] != 'NONE' and metadata['datasetVersion']['license']:
-        metadata['datasetVersion']['license'] = format_license(
-            metadata['datasetVersion']['license']
-        )
-    elif 'license' in metadata['datasetVersion']:
-        del metadata['datasetVersion']['license']
+    with tracing.span('datastation.license'):
+        dataset_version = metadata['datasetVersion']
+        if 'license' in dataset_version and dataset_version[
+             'license'] != 'NONE' and dataset_version['license']:
+            dataset_version['license'] = format_license(
+                dataset_version['license']
+            )
+        elif 'license' in dataset_version:
+            del dataset_version['license']
 
     try:
-        doi = metadata["datasetVersion"]["datasetPersistentId"]
-        add_doi_to_dab_link(metadata, doi)
+        with tracing.span('datastation.doi'):
+            doi = metadata["datasetVersion"]["datasetPersistentId"]
+            add_doi_to_dab_link(metadata, doi)
     except KeyError:
         raise HTTPException(status_code=400,
                             detail="DOI is missing from the metadata")
@@ -1,42 +1,57 @@
 import re
 
 from fastapi import HTTPException
+
+import tracing
+from field_index import FieldIndex
+from rules import Rule, apply_rules, register_rules
 from utils import add_doi_to_dab_link, extract_doi_from_url
 
 
-def refine_liss_metadata(metadata: dict) -> dict:
+def refine_liss_metadata(metadata: dict,
+                         field_index: FieldIndex | None = None) -> dict:
     try:
-        doi = extract_doi_from_url(metadata["persistentUrl"])
-        add_doi_to_dab_link(metadata, doi)
+        with tracing.span('liss.doi'):
+            doi = extract_doi_from_url(metadata["persistentUrl"])
+            add_doi_to_dab_link(metadata, doi)
     except KeyError:
         raise HTTPException(status_code=400,
                             detail="DOI is missing from the metadata.")
 
-    update_topic_classification(metadata)
+    update_topic_classification(metadata, field_index)
 
     return metadata
 
 
-def update_topic_classification(metadata: dict) -> None:
+def update_topic_classification(metadata: dict,
+                                field_index: FieldIndex | None = None
+                                ) -> None:
     """ Navigate to the path where the topicClassValue fields are located and
      replaces them.
 
     :param metadata:
+    :param field_index: Field index of the metadata, if one already exists.
     """
 
     try:
-        citation_fields = metadata["datasetVersion"]["metadataBlocks"][
-            "citation"]["fields"]
+        field_index = field_index or FieldIndex(metadata)
     except KeyError:
+        field_index = None
+    if field_index is None or field_index.fields('citation') is None:
         raise HTTPException(status_code=400,
                             detail="Metadata should be dataverse JSON.")
 
-    for field in citation_fields:
-        if field.get('typeName') == 'topicClassification':
-            topic_classifications = field['value']
-            for topic in topic_classifications:
-                topic['topicClassValue']['value'] = update_topic(
-                    topic['topicClassValue']['value'])
+    apply_rules('liss', field_index)
+
+
+def update_topic_classifications(topic_classifications: list,
+                                 context: dict) -> list:
+    """ Cleans the topicClassValue of every topic classification in place.
+    """
+    for topic in topic_classifications:
+        topic['topicClassValue']['value'] = update_topic(
+            topic['topicClassValue']['value'])
+    return topic_classifications
 
 
 def update_topic(topic: str) -> str:
@@ -45,6 +60,8 @@ def update_topic(topic: str) -> str:
     :param topic: String representing a topic. Ends in (LISS) or (LISS/ELLST).
     :return: Cleaned topic.
     """
+    if '(' not in topic:
+        return topic
     return re.sub(r'\s*\(.*?\)', '', topic)
 
 
@@ -57,3 +74,9 @@ def update_distributor_name(distributor_name: str) -> str:
     if distributor_name == 'CentERdata':
         return "Centerdata"
     return distributor_name
+
+
+register_rules([
+    Rule('liss', 'citation', 'topicClassification',
+         update_topic_classifications, all_fields=True),
+])
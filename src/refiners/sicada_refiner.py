@@ -1,11 +1,14 @@
+import tracing
 from utils import add_contact_email
 
 
 def refine_sicada_metadata(metadata: dict) -> dict:
-    metadata = add_contact_email(metadata, "info@sicada.nl")
+    with tracing.span('sicada.contact_email'):
+        metadata = add_contact_email(metadata, "info@sicada.nl")
 
-    metadata_blocks = metadata["datasetVersion"]['metadataBlocks']
-    dataset_version = {'metadataBlocks': metadata_blocks}
-    metadata['datasetVersion'] = dataset_version
+    # Keep only the metadata blocks, deleting the other keys in place.
+    dataset_version = metadata["datasetVersion"]
+    for key in [key for key in dataset_version if key != 'metadataBlocks']:
+        del dataset_version[key]
 
     return metadata
@@ -0,0 +1,35 @@
+from typing import Any
+
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from fast_json import dumps
+
+
+class RefinedJSONResponse(JSONResponse):
+    """ JSON response for refiner output.
+
+    Refined metadata is decoded JSON, so it is already JSON-safe. Returning
+    this response from a handler skips FastAPI's jsonable_encoder pass and
+    encodes the document once, with orjson when it is installed.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """ Streams a response while the request body is still being read.
+
+    StreamingResponse normally listens for a client disconnect on `receive`
+    while it streams, which would swallow the request body messages that
+    the content iterator reads. Here the content iterator is the only reader
+    of `receive`; a disconnect surfaces as a ClientDisconnect from the
+    request stream instead.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive,
+                       send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,248 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from fast_json import dumps
+from version import get_version
+
+RESULT_CACHE_BACKENDS = ('off', 'memory', 'sqlite')
+
+# Hits of the SQLite backend whose access times are written at once.
+ACCESS_BATCH_SIZE = 64
+ACCESS_FLUSH_INTERVAL = 1.0
+
+# Keep results_usage up to date with the results table.
+USAGE_TRIGGERS = (
+    'CREATE TRIGGER IF NOT EXISTS results_inserted AFTER INSERT ON results '
+    'BEGIN UPDATE results_usage SET entries = entries + 1, '
+    'bytes = bytes + NEW.size; END',
+    'CREATE TRIGGER IF NOT EXISTS results_deleted AFTER DELETE ON results '
+    'BEGIN UPDATE results_usage SET entries = entries - 1, '
+    'bytes = bytes - OLD.size; END',
+    'CREATE TRIGGER IF NOT EXISTS results_resized AFTER UPDATE OF size ON '
+    'results BEGIN UPDATE results_usage SET '
+    'bytes = bytes - OLD.size + NEW.size; END',
+)
+
+
+class MemoryBackend:
+    """ Keeps encoded results in process memory, evicting the least recently
+    used when they take more than `maxbytes`.
+    """
+
+    def __init__(self, maxbytes: int):
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        self._data: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: bytes) -> None:
+        if len(value) > self.maxbytes:
+            return
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self.bytes -= len(previous)
+            self._data[key] = value
+            self.bytes += len(value)
+            while self.bytes > self.maxbytes:
+                _, evicted = self._data.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        return _stats(len(self._data), self.bytes, self.maxbytes, self.hits,
+                      self.misses, self.evictions)
+
+
+class SQLiteBackend:
+    """ Keeps encoded results in a SQLite file, shared by worker processes
+    and kept across restarts.
+
+    When the results take more than `maxbytes`, the least recently used
+    entries are deleted. Triggers keep the number and size of the entries
+    in a one-row table, so neither a put nor the stats scan the results.
+    Access times of hits are kept in memory and written in batches, every
+    ACCESS_BATCH_SIZE hits or ACCESS_FLUSH_INTERVAL seconds and before a
+    put, so hits do not each take the write lock.
+    """
+
+    def __init__(self, filename: str, maxbytes: int):
+        self.filename = filename
+        self.maxbytes = maxbytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False,
+                                           isolation_level=None, timeout=30)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        with self._transaction() as connection:
+            columns = [row[1] for row in connection.execute(
+                'PRAGMA table_info(results)')]
+            if columns and 'size' not in columns:
+                # A cache file of an older version, bounded by entry count.
+                connection.execute('DROP TABLE results')
+                connection.execute('DROP TABLE IF EXISTS results_usage')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                'size INTEGER NOT NULL, accessed REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS results_accessed '
+                               'ON results(accessed)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS results_usage ('
+                'id INTEGER PRIMARY KEY CHECK (id = 0), '
+                'entries INTEGER NOT NULL, bytes INTEGER NOT NULL)')
+            connection.execute(
+                'INSERT OR IGNORE INTO results_usage SELECT 0, COUNT(*), '
+                'COALESCE(SUM(size), 0) FROM results')
+            for trigger in USAGE_TRIGGERS:
+                connection.execute(trigger)
+        # Access times of hits not written yet, by key.
+        self._accessed: dict[str, float] = {}
+        self._flushed = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield self._connection
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        self._connection.execute('COMMIT')
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._accessed[key] = time.time()
+            if len(self._accessed) >= ACCESS_BATCH_SIZE or \
+                    time.monotonic() - self._flushed > ACCESS_FLUSH_INTERVAL:
+                with self._transaction() as connection:
+                    self._write_access_times(connection)
+            return row[0]
+
+    def _write_access_times(self, connection: sqlite3.Connection) -> None:
+        connection.executemany(
+            'UPDATE results SET accessed = ? WHERE key = ?',
+            ((accessed, key) for key, accessed in self._accessed.items()))
+        self._accessed.clear()
+        self._flushed = time.monotonic()
+
+    def put(self, key: str, value: bytes) -> None:
+        if len(value) > self.maxbytes:
+            return
+        with self._lock, self._transaction() as connection:
+            # Evictions must see the recent hits.
+            self._write_access_times(connection)
+            connection.execute(
+                'INSERT INTO results VALUES (?, ?, ?, ?) ON CONFLICT (key) '
+                'DO UPDATE SET value = excluded.value, size = excluded.size, '
+                'accessed = excluded.accessed',
+                (key, value, len(value), time.time()))
+            excess = self._usage()[1] - self.maxbytes
+            if excess <= 0:
+                return
+            # The oldest entries, up to and including the one that frees
+            # enough bytes, read from the access time index.
+            evicted = []
+            for evicted_key, size in connection.execute(
+                    'SELECT key, size FROM results ORDER BY accessed'):
+                evicted.append((evicted_key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            connection.executemany('DELETE FROM results WHERE key = ?',
+                                   evicted)
+            self.evictions += len(evicted)
+
+    def _usage(self) -> tuple[int, int]:
+        """ The number of entries and their size in bytes. """
+        return self._connection.execute(
+            'SELECT entries, bytes FROM results_usage').fetchone()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size, used = self._usage()
+        return _stats(size, used, self.maxbytes, self.hits, self.misses,
+                      self.evictions)
+
+
+def _stats(size: int, used: int, maxbytes: int, hits: int, misses: int,
+           evictions: int) -> dict:
+    lookups = hits + misses
+    return {
+        "size": size,
+        "bytes": used,
+        "maxbytes": maxbytes,
+        "hits": hits,
+        "misses": misses,
+        "evictions": evictions,
+        "hit_rate": hits / lookups if lookups else 0.0,
+    }
+
+
+class ResultCache:
+    """ Caches encoded refinement results by provider and input.
+
+    Refiners are pure functions of the service version, the provider, the
+    input document and the tables they read: the DSC table for CBS, the
+    license table for datastation. Those make up the key, so a deploy or a
+    changed table does not serve stale results. The input is hashed in its
+    canonical (sorted keys) encoding, so key order does not matter.
+    """
+
+    def __init__(self, backend: MemoryBackend | SQLiteBackend):
+        self.backend = backend
+
+    @staticmethod
+    def key(provider: str, metadata, dsc_version: str | None = None,
+            license_version: str | None = None) -> str:
+        digest = hashlib.sha256(dumps(metadata, sort_keys=True)).hexdigest()
+        return (f"{provider}:{get_version()}:{dsc_version or '-'}:"
+                f"{license_version or '-'}:{digest}")
+
+    def get(self, key: str) -> bytes | None:
+        return self.backend.get(key)
+
+    def put(self, key: str, value: bytes) -> None:
+        self.backend.put(key, value)
+
+    def stats(self) -> dict:
+        return self.backend.stats()
+
+
+def create_result_cache(backend: str, maxbytes: int,
+                        filename: str) -> ResultCache | None:
+    """ Creates the configured result cache, or None if it is 'off'. """
+    if backend not in RESULT_CACHE_BACKENDS:
+        raise ValueError(f"Unknown result cache '{backend}', expected one of "
+                         f"{', '.join(RESULT_CACHE_BACKENDS)}.")
+    if backend == 'memory':
+        return ResultCache(MemoryBackend(maxbytes))
+    if backend == 'sqlite':
+        return ResultCache(SQLiteBackend(filename, maxbytes))
+    return None
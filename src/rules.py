@@ -0,0 +1,97 @@
+from typing import Any, Callable, NamedTuple
+
+import tracing
+from field_index import FieldIndex
+
+# A transform receives the field's current value and the refinement context
+# (e.g. the DSC dictionary) and returns the refined value. Refinement is in
+# place: a transform changes the value it is given where it can, reuses the
+# parts that do not change and returns the value itself when nothing does,
+# so the memory a refinement takes follows what it changes.
+Transform = Callable[[Any, dict], Any]
+
+
+class Rule(NamedTuple):
+    """ A refinement of the value of a field, as data.
+
+    :param provider: The provider the rule applies to, e.g. 'cbs'.
+    :param block: The metadata block of the field, e.g. 'citation'.
+    :param type_name: The typeName of the field.
+    :param transform: Function of (value, context) returning the new value.
+    :param all_fields: Refine every field with this typeName instead of
+        only the first one.
+    """
+    provider: str
+    block: str
+    type_name: str
+    transform: Transform
+    all_fields: bool = False
+
+
+class RefinementPlan:
+    """ The rules of one provider, grouped by metadata block and typeName.
+
+    Applying a plan walks each metadata block that has rules once (through
+    a FieldIndex) and refines every targeted field in place, running the
+    transforms of a field in the order the rules were registered. The rules
+    of a field are traced as one step, named provider.typeName.
+    """
+
+    def __init__(self, rules: list[Rule]):
+        self.rules = list(rules)
+        self.blocks: dict[str, dict[str, list[Rule]]] = {}
+        self.steps: dict[tuple[str, str], str] = {}
+        for rule in self.rules:
+            self.blocks.setdefault(rule.block, {}).setdefault(
+                rule.type_name, []).append(rule)
+            self.steps[rule.block, rule.type_name] = \
+                f'{rule.provider}.{rule.type_name}'
+
+    def apply(self, field_index: FieldIndex, context: dict) -> None:
+        for block, field_rules in self.blocks.items():
+            if not field_index.has_block(block):
+                continue
+            for type_name, rules in field_rules.items():
+                with tracing.span(self.steps[block, type_name], block=block):
+                    self._apply_field(field_index, block, type_name, rules,
+                                      context)
+
+    @staticmethod
+    def _apply_field(field_index: FieldIndex, block: str, type_name: str,
+                     rules: list[Rule], context: dict) -> None:
+        for rule in rules:
+            if rule.all_fields:
+                fields = field_index.get_all(block, type_name)
+            else:
+                fields = [field_index.get(block, type_name)]
+            for field in fields:
+                if 'value' in field:
+                    field['value'] = rule.transform(field['value'], context)
+
+
+_rules: dict[str, list[Rule]] = {}
+_plans: dict[str, RefinementPlan] = {}
+
+
+def register_rules(rules: list[Rule]) -> None:
+    """ Adds rules to the rule sets of their providers. """
+    for rule in rules:
+        _rules.setdefault(rule.provider, []).append(rule)
+        _plans.pop(rule.provider, None)
+
+
+def rules_for(provider: str) -> list[Rule]:
+    return list(_rules.get(provider, ()))
+
+
+def plan_for(provider: str) -> RefinementPlan:
+    """ The compiled plan of a provider's rules, built once per rule set. """
+    plan = _plans.get(provider)
+    if plan is None:
+        plan = _plans[provider] = RefinementPlan(_rules.get(provider, ()))
+    return plan
+
+
+def apply_rules(provider: str, field_index: FieldIndex,
+                context: dict | None = None) -> None:
+    plan_for(provider).apply(field_index, context or {})
@@ -5,3 +5,15 @@ from pydantic import BaseModel
 
 class RefinerInput(BaseModel):
     metadata: list | dict | Any
+
+
+class BatchRefinerInput(BaseModel):
+    metadata: list[Any]
+
+
+class JobInput(BaseModel):
+    """ A job: either a batch of documents or the path of a JSONL file or
+    directory of JSON files, relative to the job input directory.
+    """
+    metadata: list[Any] | None = None
+    path: str | None = None
@@ -0,0 +1,120 @@
+import os
+from typing import Any
+
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+
+from fast_json import loads
+from schema.input import BatchRefinerInput, RefinerInput
+from schema.strict import SkeletonRefinerInput
+
+INPUT_MODES = ('model', 'fast', 'strict')
+
+# model:  validate the body with the RefinerInput pydantic model.
+# fast:   decode the body and hand the document to the refiner as is.
+# strict: like fast, but first check the metadataBlocks skeleton.
+REFINER_INPUT_MODE = os.environ.get('REFINER_INPUT_MODE', 'fast')
+
+
+def validation_error_detail(error: ValidationError) -> list[dict]:
+    return [{key: detail[key] for key in ('type', 'loc', 'msg')}
+            for detail in error.errors()]
+
+
+def parse_refiner_input(body: bytes, batch: bool = False,
+                        mode: str = REFINER_INPUT_MODE) -> Any:
+    """ Parses a refinement request body and returns its metadata.
+
+    :param body: The raw request body.
+    :param batch: Whether the metadata should be a list of documents.
+    :param mode: One of INPUT_MODES.
+    :return: The metadata document, or list of documents for a batch.
+    :raises HTTPException: Raises a 422 if the body is not valid.
+    """
+    if mode not in INPUT_MODES:
+        raise ValueError(f"Unknown input mode '{mode}', expected one of "
+                         f"{', '.join(INPUT_MODES)}.")
+    return refiner_input_metadata(decode_body(body), batch, mode)
+
+
+def decode_body(body: bytes) -> Any:
+    try:
+        return loads(body)
+    except ValueError as error:
+        raise HTTPException(status_code=422,
+                            detail=f"JSON decode error: {error}")
+
+
+def refiner_input_metadata(data: Any, batch: bool = False,
+                           mode: str = REFINER_INPUT_MODE) -> Any:
+    """ Returns the metadata of a decoded refinement request body, see
+    parse_refiner_input.
+    """
+    if mode == 'model':
+        model = BatchRefinerInput if batch else RefinerInput
+        try:
+            return model.model_validate(data).metadata
+        except ValidationError as error:
+            raise HTTPException(status_code=422,
+                                detail=validation_error_detail(error))
+
+    if not isinstance(data, dict) or 'metadata' not in data:
+        raise HTTPException(status_code=422,
+                            detail="Body should contain 'metadata'.")
+    metadata = data['metadata']
+    if batch and not isinstance(metadata, list):
+        raise HTTPException(status_code=422,
+                            detail="'metadata' should be a list.")
+    if mode == 'strict' and not batch:
+        try:
+            SkeletonRefinerInput.model_validate(data)
+        except ValidationError as error:
+            raise HTTPException(status_code=422,
+                                detail=validation_error_detail(error))
+    return metadata
+
+
+async def refiner_metadata(request: Request) -> Any:
+    """ Dependency returning the metadata of a refinement request. """
+    return parse_refiner_input(await request.body())
+
+
+async def refiner_batch_metadata(request: Request) -> list:
+    """ Dependency returning the documents of a batch refinement request.
+
+    In strict mode items are not checked up front: an item that does not
+    match the skeleton fails on its own in the batch results.
+    """
+    return parse_refiner_input(await request.body(), batch=True)
+
+
+def parse_job_input(body: bytes) -> tuple[list | None, str | None]:
+    """ Parses a job submission, see JobInput.
+
+    :return: Tuple of the documents and the path, one of them None.
+    :raises HTTPException: Raises a 422 if the body is not valid.
+    """
+    data = decode_body(body)
+    if isinstance(data, dict) and 'path' in data:
+        if 'metadata' in data:
+            raise HTTPException(
+                status_code=422,
+                detail="Body should contain 'metadata' or 'path', not both.")
+        if not isinstance(data['path'], str):
+            raise HTTPException(status_code=422,
+                                detail="'path' should be a string.")
+        return None, data['path']
+    return refiner_input_metadata(data, batch=True), None
+
+
+async def job_input(request: Request) -> tuple[list | None, str | None]:
+    """ Dependency returning the documents or path of a job submission. """
+    return parse_job_input(await request.body())
+
+
+def request_body_schema(model) -> dict:
+    """ OpenAPI `openapi_extra` documenting the body of a route that parses
+    the request itself.
+    """
+    return {"requestBody": {"required": True, "content": {
+        "application/json": {"schema": model.model_json_schema()}}}}
@@ -0,0 +1,34 @@
+from pydantic import BaseModel, ConfigDict
+
+
+class Field(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+
+    typeName: str
+
+
+class MetadataBlock(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+
+    fields: list[Field]
+
+
+class DatasetVersion(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+
+    metadataBlocks: dict[str, MetadataBlock]
+
+
+class MetadataSkeleton(BaseModel):
+    """ The part of Dataverse JSON the refiners navigate.
+
+    Only used to validate a document; the refiners keep working on the
+    original dict, so field values are never copied.
+    """
+    model_config = ConfigDict(extra='ignore')
+
+    datasetVersion: DatasetVersion
+
+
+class SkeletonRefinerInput(BaseModel):
+    metadata: MetadataSkeleton
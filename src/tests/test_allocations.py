@@ -0,0 +1,100 @@
+import copy
+import tracemalloc
+
+import pytest
+
+from providers import PROVIDERS, refine
+
+# Bytes a refiner may allocate on an already refined document with 5000
+# keywords, topics, statline links and files: refinement is in place, so it
+# should not grow with the parts of the document that do not change.
+ALLOCATION_BUDGETS = {
+    'cbs': 16 * 1024,
+    'cid': 16 * 1024,
+    'sicada': 4 * 1024,
+    'datastation': 4 * 1024,
+    'liss': 4 * 1024,
+}
+SIZE = 5000
+
+
+def field(type_name, value, multiple=False, type_class='primitive'):
+    return {'typeName': type_name, 'multiple': multiple,
+            'typeClass': type_class, 'value': value}
+
+
+def refined_document(size: int) -> dict:
+    keywords = [{'keywordValue': field('keywordValue', f'keyword {index}')}
+                for index in range(size)]
+    topics = [{'topicClassValue': field('topicClassValue', f'topic {index}')}
+              for index in range(size)]
+    statline_links = [f'https://opendata.cbs.nl/#/CBS/nl/dataset/{index}'
+                      for index in range(size)]
+    return {
+        'persistentUrl': 'https://doi.org/10.17026/dans-zm4-yfdv',
+        'datasetVersion': {
+            'datasetPersistentId': 'doi:10.17026/dans-zm4-yfdv',
+            'dataAccessPlace': 'https://dab.surf.nl/dataset',
+            'license': 'CC0',
+            'files': [{'label': f'{index}.csv', 'id': index}
+                      for index in range(size)],
+            'metadataBlocks': {
+                'citation': {'fields': [
+                    field('title', 'Title'),
+                    field('alternativeTitle', ['ARBO'], True),
+                    field('otherId', [{'otherIdValue': field(
+                        'otherIdValue', '0b01e4108004a8a5')}], True,
+                        'compound'),
+                    field('datasetContact', [{
+                        'datasetContactEmail': field(
+                            'datasetContactEmail', 'info@sicada.nl')}],
+                        True, 'compound'),
+                    field('keyword', keywords, True, 'compound'),
+                    field('topicClassification', topics, True, 'compound'),
+                    field('distributionDate', '2023-10-29T07:58:43.398551'),
+                ]},
+                'CBSMetadata': {'fields': [
+                    field('statlineTabel', statline_links, True)]},
+            },
+        },
+    }
+
+
+def peak_allocation(func, *args) -> int:
+    """ The peak of the memory allocated while calling func, in bytes. """
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.fixture(scope='module')
+def document():
+    return refined_document(SIZE)
+
+
+@pytest.mark.parametrize('provider', PROVIDERS)
+def test_refiner_allocation_budget(provider, document):
+    dsc_dictionary = {'ARBO': 'ARBO'}
+    # Warm up caches and compiled patterns first.
+    refine(provider, copy.deepcopy(document), dsc_dictionary)
+    metadata = copy.deepcopy(document)
+
+    allocated = peak_allocation(refine, provider, metadata, dsc_dictionary)
+
+    assert allocated <= ALLOCATION_BUDGETS[provider]
+
+
+def test_cbs_refiner_keeps_unchanged_values(document):
+    metadata = copy.deepcopy(document)
+    citation = metadata['datasetVersion']['metadataBlocks']['citation']
+    keywords = citation['fields'][4]['value']
+    statline = metadata['datasetVersion']['metadataBlocks']['CBSMetadata'][
+        'fields'][0]['value']
+
+    refined = refine('cbs', metadata, {})['datasetVersion']['metadataBlocks']
+
+    assert refined['citation']['fields'][4]['value'] is keywords
+    assert refined['CBSMetadata']['fields'][0]['value'] is statline
@@ -0,0 +1,193 @@
+import json
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from dsc_table import DSCTable
+from jobs import JobRunner
+from profiling import PROFILE_HEADER, Profiler
+from result_cache import create_result_cache
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            "../.."))
+DSC_TABLE_CSV = os.path.join(PROJECT_ROOT, "src/data", "DSC_table.csv")
+
+DOCUMENT = {"datasetVersion": {"license": "CC0", "metadataBlocks": {},
+                               "datasetPersistentId": "doi:10.1/2"}}
+CBS_DOCUMENT = {
+    "persistentUrl": "https://doi.org/10.57934/0b01e4108004a8a5",
+    "datasetVersion": {
+        "dataAccessPlace": "https://dab.surf.nl/dataset",
+        "metadataBlocks": {"citation": {"fields": [
+            {"typeName": "alternativeTitle", "multiple": True,
+             "typeClass": "primitive", "value": ["PS ArbodienstenVV"]},
+            {"typeName": "otherId", "multiple": True,
+             "typeClass": "compound", "value": [{"otherIdValue": {
+                 "typeName": "otherIdValue", "multiple": False,
+                 "typeClass": "primitive", "value": "0b01e4108004a8a5"}}]},
+        ]}},
+    },
+}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    dsc_table = DSCTable(DSC_TABLE_CSV)
+    monkeypatch.setattr(main, 'dsc_table', dsc_table)
+    monkeypatch.setattr(main.executor, 'dsc_table', dsc_table)
+    monkeypatch.setattr(main, 'job_runner', JobRunner(
+        str(tmp_path / 'jobs.sqlite3'), DSC_TABLE_CSV, workers=1,
+        poll_interval=0.01))
+    monkeypatch.setattr(main, 'result_cache',
+                        create_result_cache('memory', 1024 * 1024, ''))
+    monkeypatch.setattr(main, 'profiler', Profiler(enabled=True))
+    with TestClient(main.app) as client:
+        yield client
+
+
+def test_refine_caches_results(client):
+    first = client.post('/metadata-refinement/datastation',
+                        json={"metadata": DOCUMENT})
+    second = client.post('/metadata-refinement/datastation',
+                         json={"metadata": DOCUMENT})
+
+    assert first.status_code == second.status_code == 200
+    assert first.headers[main.RESULT_CACHE_HEADER] == 'miss'
+    assert second.headers[main.RESULT_CACHE_HEADER] == 'hit'
+    assert first.json() == second.json()
+    assert first.json()["datasetVersion"]["license"] == 'CC0 1.0'
+
+
+def test_chunked_upload_is_sized_by_its_body(client, monkeypatch):
+    monkeypatch.setattr(main.executor, 'size_threshold', 1)
+    submitted = main.executor.stats()["submitted"]
+
+    # Sent without a Content-Length, in chunks.
+    response = client.post('/metadata-refinement/datastation',
+                           content=iter([json.dumps({"metadata": DOCUMENT})
+                                         .encode()]))
+
+    assert response.status_code == 200
+    assert 'content-length' not in response.request.headers
+    assert main.executor.stats()["submitted"] == submitted + 1
+
+
+def test_batch(client):
+    response = client.post('/metadata-refinement/datastation/batch',
+                           json={"metadata": [DOCUMENT, 5]})
+
+    body = response.json()
+    assert response.status_code == 200
+    assert (body["succeeded"], body["failed"]) == (1, 1)
+    assert body["results"][0]["metadata"]["datasetVersion"][
+        "license"] == 'CC0 1.0'
+    assert body["results"][1]["status"] == 'error'
+    assert client.post('/metadata-refinement/unknown/batch',
+                       json={"metadata": []}).status_code == 404
+
+
+def test_ndjson_stream(client):
+    body = json.dumps(DOCUMENT).encode() + b'\nnot json\n'
+
+    response = client.post(
+        '/metadata-refinement/datastation/stream', content=body,
+        headers={'Content-Type': 'application/x-ndjson'})
+
+    results = [json.loads(line) for line in response.iter_lines()]
+    assert response.status_code == 200
+    assert [result["index"] for result in results] == [0, 1]
+    assert results[0]["status"] == 'ok'
+    assert results[1]["status_code"] == 400
+    assert client.post('/metadata-refinement/datastation/stream',
+                       json=DOCUMENT).status_code == 415
+
+
+def test_cbs_document_stream(client):
+    pytest.importorskip('ijson')
+
+    response = client.post('/metadata-refinement/cbs/document-stream',
+                           content=json.dumps(CBS_DOCUMENT).encode())
+
+    refined = response.json()
+    assert response.status_code == 200
+    assert refined["datasetVersion"]["metadataBlocks"]["citation"][
+        "fields"][0]["value"] == ["PS ARBODIENSTEN"]
+    assert refined["datasetVersion"]["dataAccessPlace"].startswith('<a')
+
+
+def test_job_lifecycle(client):
+    job = client.post('/jobs/datastation',
+                      json={"metadata": [DOCUMENT, 5]}).json()
+
+    deadline = time.monotonic() + 10
+    while job["status"] not in ('done', 'failed'):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+        job = client.get(f'/jobs/{job["id"]}').json()
+    results = [json.loads(line) for line in
+               client.get(f'/jobs/{job["id"]}/results').iter_lines()]
+
+    assert (job["status"], job["processed"], job["failed"]) == ('done', 2, 1)
+    assert [result["status"] for result in results] == ['ok', 'error']
+    assert [listed["id"] for listed in client.get('/jobs').json()] == \
+        [job["id"]]
+    assert client.delete(f'/jobs/{job["id"]}').status_code == 200
+    assert client.get(f'/jobs/{job["id"]}').status_code == 404
+    assert client.post('/jobs/datastation',
+                       json={"path": "dump.jsonl"}).status_code == 403
+
+
+def test_admin(client):
+    profiled = client.post('/metadata-refinement/datastation',
+                           json={"metadata": DOCUMENT},
+                           headers={PROFILE_HEADER: '1'})
+    profile_id = profiled.headers[PROFILE_HEADER]
+
+    profiles = client.get('/admin/profiles').json()
+    assert [profile["id"] for profile in profiles["profiles"]] == \
+        [profile_id]
+    download = client.get(f'/admin/profiles/{profile_id}',
+                          params={"format": "collapsed"})
+    assert download.status_code == 200
+    assert download.headers['content-type'].startswith('text/plain')
+    assert client.get('/admin/profiles/unknown').status_code == 404
+
+    assert client.get('/admin/dsc-table').json()["entries"] > 0
+    assert client.post('/admin/dsc-table/reload').status_code == 200
+    assert client.get('/admin/caches').json()["results"]["misses"] == 1
+    assert client.get('/admin/executor').status_code == 200
+
+
+def test_metrics(client):
+    client.post('/metadata-refinement/datastation',
+                json={"metadata": DOCUMENT})
+
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert ('refiner_requests_total{endpoint="/metadata-refinement/'
+            'datastation",method="POST",status="200"}') in response.text
+    assert 'refiner_jobs{status="queued"} 0' in response.text
+
+
+def test_metrics_time_streams_to_their_end(monkeypatch):
+    durations = []
+    monkeypatch.setattr(main.request_duration, 'observe',
+                        lambda value, *labels: durations.append(value))
+
+    async def streaming_app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': []})
+        await send({'type': 'http.response.body', 'body': b'1',
+                    'more_body': True})
+        time.sleep(0.05)
+        await send({'type': 'http.response.body', 'body': b'2'})
+
+    response = TestClient(main.MetricsMiddleware(streaming_app)).get('/')
+
+    assert response.content == b'12'
+    assert durations[0] >= 0.05
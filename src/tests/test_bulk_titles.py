@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pytest
+
+import bulk_titles
+from bulk_titles import clean_titles, main, read_titles, refine_titles
+from refiners.cbs_refiner import clean_alternative_title
+
+DSC_DICTIONARY = {'PS ArbodienstenVV': 'ARBO'}
+TITLES = ['PS ArbodienstenVV', 'ABCJJJJVV', 'CWIJJJJMMDDTABVV',
+          'PS ArbodienstenVV', 'ABCJJJJVV', 'Straße_vv', 'b_handel_JJJJMM']
+
+
+@pytest.fixture(params=['pyarrow', 'python'])
+def engine(request, monkeypatch):
+    if request.param == 'pyarrow':
+        pytest.importorskip('pyarrow')
+    else:
+        monkeypatch.setattr(bulk_titles, 'pyarrow', None)
+    return request.param
+
+
+def test_clean_titles_matches_clean_alternative_title(engine):
+    titles = TITLES + ['JJJJVVBUS', 'JJJJTAJJJJBUS', 'VVJJJJBUS', '', '__']
+    assert clean_titles(titles) == [clean_alternative_title(title)
+                                    for title in titles]
+
+
+def test_refine_titles_report(engine):
+    report = refine_titles(TITLES, DSC_DICTIONARY)
+
+    assert report.refined == ['ARBO', 'ABC', 'CWITAB', 'ARBO', 'ABC',
+                              'STRASSE', 'B_HANDEL']
+    assert report.matched == 2
+    assert report.missed == 5
+    assert report.unmapped == [('ABCJJJJVV', 'ABC'),
+                               ('CWIJJJJMMDDTABVV', 'CWITAB'),
+                               ('Straße_vv', 'STRASSE'),
+                               ('b_handel_JJJJMM', 'B_HANDEL')]
+
+
+def test_main_writes_unmapped_in_dsc_table_format(tmp_path, capsys):
+    titles = tmp_path / 'titles.txt'
+    titles.write_text('\n'.join(TITLES) + '\n')
+    dsc_table = tmp_path / 'dsc.csv'
+    dsc_table.write_text('BMO korte naam;DSC kortenaam;\n'
+                         'ARBO;PS ArbodienstenVV;\n')
+    unmapped = tmp_path / 'unmapped.csv'
+
+    assert main([str(titles), '--dsc-table', str(dsc_table),
+                 '--unmapped', str(unmapped)]) == 0
+
+    assert unmapped.read_text().splitlines()[:2] == [
+        'BMO korte naam;DSC kortenaam', 'ABC;ABCJJJJVV']
+    assert '7 titles, 2 matched, 5 missed' in capsys.readouterr().err
+
+
+def test_read_titles_column_from_pipe(monkeypatch):
+    rows = ''.join(f'{index};title {index}\n' for index in range(1000))
+    read_end, write_end = os.pipe()
+    # Larger than the sniffed sample, but within the pipe buffer.
+    os.write(write_end, f'id;title\n{rows}'.encode())
+    os.close(write_end)
+
+    with open(read_end, newline='') as stdin:
+        monkeypatch.setattr(sys, 'stdin', stdin)
+        titles = read_titles('-', column='title')
+
+    assert titles == [f'title {index}' for index in range(1000)]
@@ -1,8 +1,8 @@
 import os
 import pytest
 
-from refiners.cbs_refiner import clean_alternative_title, refine_cbs_metadata, \
-    refine_keywords
+from refiners.cbs_refiner import alt_title_cache, clean_alternative_title, \
+    refine_alternative_title, refine_cbs_metadata, refine_keywords
 from utils import csv_to_dict
 
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__),
@@ -33,6 +33,28 @@ def test_remove_jjjj_vv():
     assert clean_alternative_title('b_handel_JJJJMM') == "B_HANDEL"
 
 
+def test_clean_alternative_title_order_of_steps():
+    assert clean_alternative_title('Plain_title__') == 'PLAIN_TITLE'
+    assert clean_alternative_title('abc_jjjjmmdd_vv') == 'ABC'
+    assert clean_alternative_title('VVJJJJBUS') == 'BUS'
+    assert clean_alternative_title('JJJJVVBUS') == 'JJJJBUS'
+    assert clean_alternative_title('JJJJJJJJMMBUS') == 'BUS'
+    assert clean_alternative_title('JJJJTAJJJJBUS') == 'TABUS'
+
+
+def test_refine_alternative_title_memoizes_cleaning():
+    alt_title_cache.clear()
+    hits, misses = alt_title_cache.hits, alt_title_cache.misses
+
+    for _ in range(3):
+        assert refine_alternative_title('MemoJJJJVV', {}) == 'MEMO'
+    assert refine_alternative_title('MemoJJJJVV',
+                                    {'MemoJJJJVV': 'DSC'}) == 'DSC'
+
+    assert alt_title_cache.misses - misses == 1
+    assert alt_title_cache.hits - hits == 2
+
+
 def test_cbs_metadata_refiner_dsc_dictionary(dsc_dict):
     input_data = {
         "datasetVersion": {
@@ -0,0 +1,85 @@
+import asyncio
+import copy
+import io
+import json
+
+import pytest
+from fastapi import HTTPException
+
+import cbs_stream
+from refiners.cbs_refiner import refine_cbs_metadata
+
+pytest.importorskip('ijson')
+
+DSC_DICTIONARY = {'PS ArbodienstenVV': 'ARBO'}
+DOCUMENT = {
+    "persistentUrl": "https://doi.org/10.57934/0b01e4108004a8a5",
+    "datasetVersion": {
+        "dataAccessPlace": "https://dab.surf.nl/dataset",
+        "license": {"name": "CC0 1.0", "uri": None},
+        "metadataBlocks": {
+            "citation": {"fields": [
+                {"typeName": "title", "multiple": False,
+                 "typeClass": "primitive", "value": "Arbodiensten"},
+                {"typeName": "alternativeTitle", "multiple": False,
+                 "typeClass": "primitive", "value": "PS ArbodienstenVV"},
+                {"typeName": "otherId", "multiple": True,
+                 "typeClass": "compound", "value": [{"otherIdValue": {
+                     "typeName": "otherIdValue", "multiple": False,
+                     "typeClass": "primitive",
+                     "value": "0b01e4108004a8a5"}}]},
+                {"typeName": "keyword", "multiple": True,
+                 "typeClass": "compound", "value": [{"keywordValue": {
+                     "typeName": "keywordValue", "multiple": False,
+                     "typeClass": "primitive",
+                     "value": "Arbeid / Werkgelegenheid"}}]},
+            ]},
+            "variables": {"fields": [
+                {"typeName": "variable", "value": [1.5, None, True, "ü\"\n"]},
+            ]},
+        },
+    },
+}
+
+
+def refine_stream(document: dict, chunk_size: int) -> dict:
+    source, target = io.BytesIO(json.dumps(document).encode()), io.BytesIO()
+    cbs_stream.refine_cbs_file(source, target, DSC_DICTIONARY, chunk_size)
+    return json.loads(target.getvalue())
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64 * 1024])
+def test_stream_matches_refine_cbs_metadata(chunk_size):
+    document = copy.deepcopy(DOCUMENT)
+    # Key order must not matter, nor typeName coming last.
+    fields = document["datasetVersion"]["metadataBlocks"]["citation"]
+    fields["fields"][1] = dict(reversed(fields["fields"][1].items()))
+    document["datasetVersion"] = dict(
+        reversed(document["datasetVersion"].items()))
+
+    refined = refine_stream(document, chunk_size)
+
+    expected = refine_cbs_metadata(copy.deepcopy(document), DSC_DICTIONARY)
+    assert refined == expected
+    assert refined["datasetVersion"]["dataAccessPlace"].startswith('<a href')
+
+
+def test_stream_requires_metadata_blocks():
+    with pytest.raises(HTTPException) as error:
+        refine_stream({"datasetVersion": {"dataAccessPlace": "x"}}, 4)
+    assert error.value.status_code == 422
+
+
+def test_refine_cbs_chunks():
+    async def chunks():
+        data = json.dumps(DOCUMENT).encode()
+        for start in range(0, len(data), 100):
+            yield data[start:start + 100]
+
+    async def collect():
+        return b''.join([chunk async for chunk in
+                         cbs_stream.refine_cbs_chunks(chunks(),
+                                                      DSC_DICTIONARY)])
+
+    assert json.loads(asyncio.run(collect())) == refine_cbs_metadata(
+        copy.deepcopy(DOCUMENT), DSC_DICTIONARY)
@@ -0,0 +1,40 @@
+import json
+
+from cli import main, read_records, refine_records
+
+
+def test_read_records(tmp_path):
+    (tmp_path / 'b.json').write_text('{"b": 1}')
+    (tmp_path / 'a.json').write_text('{"a": 1}')
+    (tmp_path / 'notes.txt').write_text('ignored')
+    jsonl = tmp_path / 'records.jsonl'
+    jsonl.write_text('{"a": 1}\n\n{"b": 1}\n')
+
+    assert list(read_records(str(tmp_path))) == [('a.json', '{"a": 1}'),
+                                                 ('b.json', '{"b": 1}')]
+    assert list(read_records(str(jsonl))) == [('1', '{"a": 1}\n'),
+                                              ('3', '{"b": 1}\n')]
+
+
+def test_refine_records():
+    records = [('1', '{"datasetVersion": {"metadataBlocks": {}}}'),
+               ('2', '{}')]
+
+    results = list(refine_records(records, 'cid', None))
+
+    assert results == [
+        ('1', '{"datasetVersion": {"metadataBlocks": {}}}', ''),
+        ('2', None, "422: 'datasetVersion'")
+    ]
+
+
+def test_main_writes_jsonl(tmp_path):
+    source = tmp_path / 'in.jsonl'
+    source.write_text(json.dumps({"datasetVersion": {
+        "metadataBlocks": {}, "license": "CC0",
+        "datasetPersistentId": "doi:10.1234/x"}}) + '\n')
+    target = tmp_path / 'out.jsonl'
+
+    assert main(['datastation', str(source), '-o', str(target)]) == 0
+    assert json.loads(target.read_text())["datasetVersion"][
+               "license"] == "CC0 1.0"
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+import dsc_table
+from dsc_mmap import MappedDSCTable, build, main
+from dsc_table import DSCTable
+from refiners.cbs_refiner import refine_alternative_title
+from utils import csv_to_dict
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            "../.."))
+
+
+def test_mapped_table_matches_csv(tmp_path):
+    csv_file = os.path.join(PROJECT_ROOT, "src/data", "DSC_table.csv")
+    table_file = str(tmp_path / 'DSC_table.map')
+    main([csv_file, table_file])
+    dsc_dictionary = csv_to_dict(csv_file)
+
+    table = MappedDSCTable(table_file)
+
+    assert len(table) == len(dsc_dictionary)
+    assert dict(table) == dsc_dictionary
+    assert refine_alternative_title('PS ArbodienstenVV',
+                                    table) == 'PS ARBODIENSTEN'
+    assert refine_alternative_title('ABCJJJJVV', table) == 'ABC'
+
+
+def test_mapped_table_lookup(tmp_path):
+    table_file = str(tmp_path / 'table.map')
+    build({'b': '2', 'a': '1', 'ü': 'u', 'c': ''}, table_file)
+
+    table = MappedDSCTable(table_file)
+
+    assert list(table) == ['a', 'b', 'c', 'ü']
+    assert table['ü'] == 'u'
+    assert table['c'] == ''
+    assert table.get('d') is None
+    assert 'a' in table and 'aa' not in table
+    with pytest.raises(KeyError):
+        table['']
+
+
+def test_mapped_table_empty_and_invalid(tmp_path):
+    table_file = str(tmp_path / 'empty.map')
+    build({}, table_file)
+    assert len(MappedDSCTable(table_file)) == 0
+    assert MappedDSCTable(table_file).get('a') is None
+
+    invalid = tmp_path / 'invalid.map'
+    invalid.write_bytes(b'x' * 32)
+    with pytest.raises(ValueError):
+        MappedDSCTable(str(invalid))
+
+
+def test_dsc_table_mmap_backend(tmp_path):
+    table_file = str(tmp_path / 'table.map')
+    build({'ABCJJJJVV': 'ABC'}, table_file)
+
+    table = DSCTable(table_file, backend='mmap')
+
+    assert table.get()['ABCJJJJVV'] == 'ABC'
+    assert table.stats()["entries"] == 1
+
+
+def test_dsc_table_mmap_closes_replaced_tables(tmp_path, monkeypatch):
+    monkeypatch.setattr(dsc_table, 'RETIRED_TABLE_GRACE', 0)
+    table_file = str(tmp_path / 'table.map')
+    build({'ABCJJJJVV': 'ABC'}, table_file)
+    table = DSCTable(table_file, backend='mmap')
+    first = table.get()
+
+    build({'ABCJJJJVV': 'ABC', 'DEFVV': 'DEF'}, table_file)
+    table.load()
+
+    assert table.get()['DEFVV'] == 'DEF'
+    assert table.version == table.get().digest()
+    with pytest.raises(ValueError):
+        first['ABCJJJJVV']
@@ -0,0 +1,68 @@
+import os
+
+from dsc_table import DSCTable
+
+
+def write_table(path, rows):
+    with open(path, 'w', newline='') as csvfile:
+        csvfile.write('BMO korte naam;DSC kortenaam;\n')
+        for refined, title in rows:
+            csvfile.write(f'{refined};{title};\n')
+
+
+def test_dsc_table_loads_once(tmp_path):
+    filename = tmp_path / 'DSC_table.csv'
+    write_table(filename, [('ABC', 'ABCJJJJVV')])
+    table = DSCTable(str(filename), check_interval=60)
+
+    assert table.get() == {'ABCJJJJVV': 'ABC'}
+    assert table.get() is table.get()
+    assert table.load_count == 1
+    assert table.stats()['entries'] == 1
+
+
+def test_dsc_table_reloads_on_change(tmp_path):
+    filename = tmp_path / 'DSC_table.csv'
+    write_table(filename, [('ABC', 'ABCJJJJVV')])
+    table = DSCTable(str(filename), check_interval=0)
+    first = table.get()
+    first_version = table.version
+
+    write_table(filename, [('ABC', 'ABCJJJJVV'), ('DEF', 'DEFVV')])
+    stat = os.stat(filename)
+    os.utime(filename, (stat.st_atime, stat.st_mtime + 10))
+
+    second = table.get()
+    assert second == {'ABCJJJJVV': 'ABC', 'DEFVV': 'DEF'}
+    assert first == {'ABCJJJJVV': 'ABC'}
+    assert table.version != first_version
+    assert table.load_count == 2
+
+
+def test_dsc_table_ignores_touch_without_change(tmp_path):
+    filename = tmp_path / 'DSC_table.csv'
+    write_table(filename, [('ABC', 'ABCJJJJVV')])
+    table = DSCTable(str(filename), check_interval=0)
+    table.get()
+
+    stat = os.stat(filename)
+    os.utime(filename, (stat.st_atime, stat.st_mtime + 10))
+
+    assert table.reload_if_changed() is False
+    assert table.load_count == 1
+
+
+def test_dsc_table_keeps_last_good_table(tmp_path):
+    filename = tmp_path / 'DSC_table.csv'
+    write_table(filename, [('ABC', 'ABCJJJJVV')])
+    table = DSCTable(str(filename), check_interval=0)
+    table.get()
+    version = table.version
+
+    filename.write_bytes(b'\xff\xfe not utf-8')
+    stat = os.stat(filename)
+    os.utime(filename, (stat.st_atime, stat.st_mtime + 10))
+
+    assert table.reload_if_changed() is False
+    assert table.get() == {'ABCJJJJVV': 'ABC'}
+    assert table.version == version
@@ -0,0 +1,94 @@
+import asyncio
+import marshal
+import os
+
+import pytest
+from fastapi import HTTPException
+
+from dsc_table import DSCTable
+from executor import RefinementExecutor
+from profiling import ProfileRequest
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            "../.."))
+
+METADATA = {
+    "datasetVersion": {
+        "metadataBlocks": {
+            "citation": {
+                "fields": [
+                    {
+                        "typeName": "alternativeTitle",
+                        "value": ["PS ArbodienstenVV"]
+                    }
+                ]
+            }
+        }
+    }
+}
+
+
+@pytest.fixture
+def dsc_table():
+    return DSCTable(os.path.join(PROJECT_ROOT, "src/data", "DSC_table.csv"))
+
+
+@pytest.mark.parametrize('mode', ['inline', 'thread'])
+def test_executor_refines(dsc_table, mode):
+    executor = RefinementExecutor(dsc_table, mode=mode, max_workers=2,
+                                  size_threshold=0)
+    executor.start()
+    try:
+        refined = asyncio.run(executor.refine('cbs', METADATA, size=10))
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(executor.refine('cbs', {}, size=10))
+    finally:
+        executor.shutdown()
+
+    assert refined["datasetVersion"]["metadataBlocks"]["citation"][
+               "fields"][0]["value"] == ["PS ARBODIENSTEN"]
+    assert error.value.status_code == 422
+    stats = executor.stats()
+    assert stats["in_flight"] == 0
+    if mode == 'thread':
+        assert stats["submitted"] == stats["completed"] == 2
+
+
+def test_executor_small_payloads_inline(dsc_table):
+    executor = RefinementExecutor(dsc_table, mode='thread',
+                                  size_threshold=1024)
+    executor.start()
+    try:
+        results = asyncio.run(executor.refine_batch('cid', [{}], size=10))
+    finally:
+        executor.shutdown()
+
+    assert results[0]["status_code"] == 422
+    assert executor.stats()["inline"] == 1
+    assert executor.stats()["submitted"] == 0
+
+
+def test_executor_unknown_mode(dsc_table):
+    with pytest.raises(ValueError):
+        RefinementExecutor(dsc_table, mode='fork')
+
+
+@pytest.mark.parametrize('mode', ['thread', 'process'])
+def test_executor_profiles_on_request(dsc_table, mode):
+    executor = RefinementExecutor(dsc_table, mode=mode, max_workers=1,
+                                  size_threshold=0)
+    profiles = []
+    executor.start()
+    try:
+        refined = asyncio.run(executor.refine(
+            'cbs', METADATA, size=10, profile=ProfileRequest(
+                'cprofile', lambda *profile: profiles.append(profile))))
+    finally:
+        executor.shutdown()
+
+    assert refined["datasetVersion"]["metadataBlocks"]["citation"][
+               "fields"][0]["value"] == ["PS ARBODIENSTEN"]
+    data, duration = profiles[0]
+    assert any(name == 'refine_cbs_metadata'
+               for _, _, name in marshal.loads(data))
+    assert duration > 0
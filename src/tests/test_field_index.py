@@ -0,0 +1,57 @@
+from field_index import FieldIndex
+from utils import add_contact_email
+
+
+def make_metadata():
+    return {
+        "datasetVersion": {
+            "metadataBlocks": {
+                "citation": {
+                    "fields": [
+                        {"typeName": "title", "value": "first"},
+                        {"typeName": "keyword", "value": []},
+                        {"typeName": "title", "value": "second"}
+                    ]
+                },
+                "empty": {}
+            }
+        }
+    }
+
+
+def test_field_index_lookup():
+    field_index = FieldIndex(make_metadata())
+
+    assert field_index.get('citation', 'title')["value"] == "first"
+    assert [field["value"] for field in
+            field_index.get_all('citation', 'title')] == ["first", "second"]
+    assert field_index.get('citation', 'missing') == {}
+    assert field_index.get('missing', 'title') == {}
+    assert field_index.get_all('empty', 'title') == []
+    assert field_index.fields('missing') is None
+
+
+def test_field_index_shares_fields():
+    metadata = make_metadata()
+    field_index = FieldIndex(metadata)
+
+    field_index.get('citation', 'keyword')["value"] = ["refined"]
+    field_index.append('citation', {"typeName": "subject", "value": []})
+
+    fields = metadata["datasetVersion"]["metadataBlocks"]["citation"]["fields"]
+    assert fields[1]["value"] == ["refined"]
+    assert fields[-1] == {"typeName": "subject", "value": []}
+    assert field_index.get_all('citation', 'subject') == [fields[-1]]
+
+
+def test_add_contact_email_with_field_index():
+    metadata = make_metadata()
+    field_index = FieldIndex(metadata)
+
+    add_contact_email(metadata, "info@example.org", field_index)
+
+    contact = field_index.get('citation', 'datasetContact')
+    assert contact["value"][0]["datasetContactEmail"][
+               "value"] == "info@example.org"
+    assert len(metadata["datasetVersion"]["metadataBlocks"]["citation"][
+                   "fields"]) == 4
@@ -0,0 +1,183 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+from jobs import JobRunner, JobStore, resolve_job_source, result_lines
+
+DOCUMENT = {"datasetVersion": {"license": "CC0", "metadataBlocks": {},
+                               "datasetPersistentId": "doi:10.1/2"}}
+
+
+def wait_for(store: JobStore, job_id: str, timeout: float = 10) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = store.get(job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise TimeoutError(job_id)
+
+
+def test_store_claims_jobs_once_in_order(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    first = store.create('cid', documents=[DOCUMENT])
+    second = store.create('liss', source='/data/liss.jsonl')
+
+    assert store.claim(runner=1)['id'] == first['id']
+    assert store.claim(runner=2)['id'] == second['id']
+    assert store.claim(runner=3) is None
+    assert list(store.inputs(first['id'])) == [('0', json.dumps(
+        DOCUMENT, separators=(',', ':')))]
+    assert store.counts() == {'queued': 0, 'running': 2, 'done': 0,
+                              'failed': 0}
+
+
+def test_store_recovers_jobs_of_dead_runners(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    job = store.create('cid', documents=[DOCUMENT])
+    store.claim(runner=os.getpid())
+    assert store.recover() == []
+
+    store.add_results(job['id'], 0, [('0', '{}', '')])
+    exited = subprocess.run([sys.executable, '-c', 'import os; '
+                             'print(os.getpid())'], capture_output=True)
+    with store._transaction() as connection:
+        connection.execute('UPDATE jobs SET runner = ?',
+                           (int(exited.stdout),))
+    assert store.recover() == [job['id']]
+    job = store.get(job['id'])
+    assert (job['status'], job['processed']) == ('queued', 1)
+    assert list(store.results(job['id'])) == [(0, '0', '{}', None)]
+
+
+def test_store_recovers_jobs_of_other_boots_and_stale_runners(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    rebooted = store.create('cid', documents=[DOCUMENT])
+    hung = store.create('cid', documents=[DOCUMENT])
+    store.claim(runner=os.getpid())
+    store.claim(runner=os.getpid())
+    with store._transaction() as connection:
+        connection.execute("UPDATE jobs SET runner_boot = 'other' "
+                           "WHERE id = ?", (rebooted['id'],))
+        connection.execute('UPDATE jobs SET heartbeat = ? WHERE id = ?',
+                           (time.time() - 60, hung['id']))
+
+    assert sorted(store.recover(timeout=30)) == sorted(
+        [rebooted['id'], hung['id']])
+
+
+def test_store_lease_has_one_holder(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    exited = subprocess.run([sys.executable, '-c', 'import os; '
+                             'print(os.getpid())'], capture_output=True)
+
+    assert store.acquire_lease(os.getpid())
+    assert store.acquire_lease(os.getpid())
+    assert not store.acquire_lease(os.getppid())
+    store.release_lease(os.getpid())
+    assert store.acquire_lease(os.getppid())
+    assert not store.acquire_lease(os.getpid())
+    # The holder's process is gone.
+    with store._transaction() as connection:
+        connection.execute('UPDATE runner_lease SET runner = ?',
+                           (int(exited.stdout),))
+    assert store.acquire_lease(os.getpid(), timeout=-1)
+    # The lease expired.
+    assert store.acquire_lease(os.getppid())
+
+
+def test_runner_resumes_requeued_job(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    job = store.create('datastation', documents=[DOCUMENT, DOCUMENT])
+    store.claim(runner=os.getpid())
+    store.add_results(job['id'], 0, [('0', '"stored"', '')])
+    store.requeue(job['id'])
+    store.close()
+
+    runner = JobRunner(str(tmp_path / 'jobs.sqlite3'), dsc_table_csv='',
+                       workers=1, poll_interval=0.01)
+    runner.start()
+    try:
+        job = wait_for(runner.store, job['id'])
+        lines = [json.loads(line)
+                 for line in result_lines(runner.store, job['id'])]
+    finally:
+        runner.stop()
+
+    assert (job['status'], job['processed']) == ('done', 2)
+    assert lines[0]['metadata'] == 'stored'
+    assert lines[1]['metadata']['datasetVersion']['license'] == 'CC0 1.0'
+
+
+def test_runner_refines_batch_job(tmp_path):
+    runner = JobRunner(str(tmp_path / 'jobs.sqlite3'), dsc_table_csv='',
+                       workers=1, poll_interval=0.01)
+    runner.start()
+    try:
+        job = runner.submit('datastation', documents=[DOCUMENT, 5])
+        job = wait_for(runner.store, job['id'])
+        lines = [json.loads(line)
+                 for line in result_lines(runner.store, job['id'])]
+    finally:
+        runner.stop()
+
+    assert (job['status'], job['total'], job['processed'],
+            job['failed']) == ('done', 2, 2, 1)
+    assert lines[0]['metadata']['datasetVersion']['license'] == 'CC0 1.0'
+    assert lines[1]['status'] == 'error'
+
+
+def test_runner_fails_job_with_missing_source(tmp_path):
+    runner = JobRunner(str(tmp_path / 'jobs.sqlite3'), dsc_table_csv='',
+                       workers=1, poll_interval=0.01)
+    runner.start()
+    try:
+        job = runner.submit('cid', source=str(tmp_path / 'missing.jsonl'))
+        job = wait_for(runner.store, job['id'])
+    finally:
+        runner.stop()
+
+    assert job['status'] == 'failed'
+    assert job['error'].startswith('FileNotFoundError')
+
+
+def test_resolve_job_source(tmp_path):
+    (tmp_path / 'records.jsonl').write_text('{}\n')
+
+    assert resolve_job_source('records.jsonl', str(tmp_path)) == \
+        os.path.realpath(tmp_path / 'records.jsonl')
+    with pytest.raises(PermissionError):
+        resolve_job_source('../records.jsonl', str(tmp_path))
+    with pytest.raises(PermissionError):
+        resolve_job_source('records.jsonl', '')
+    with pytest.raises(FileNotFoundError):
+        resolve_job_source('other.jsonl', str(tmp_path))
+
+
+def test_runner_survives_store_errors(tmp_path):
+    runner = JobRunner(str(tmp_path / 'jobs.sqlite3'), dsc_table_csv='',
+                       workers=2, poll_interval=0.01)
+    runner.start()
+    claim = runner.store.claim
+    failures = []
+
+    def failing_claim(pid):
+        if not failures:
+            failures.append(pid)
+            raise sqlite3.OperationalError('database is locked')
+        return claim(pid)
+
+    runner.store.claim = failing_claim
+    try:
+        job = runner.submit('datastation', documents=[DOCUMENT] * 3)
+        job = wait_for(runner.store, job['id'], timeout=60)
+    finally:
+        runner.stop()
+
+    assert failures
+    assert (job['status'], job['processed']) == ('done', 3)
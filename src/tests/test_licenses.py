@@ -0,0 +1,30 @@
+from licenses import LicenseResolver
+
+
+def test_license_resolver_first_match_wins():
+    resolver = LicenseResolver([(r'.*/by-nc/', 'CC BY-NC'),
+                                (r'.*/by', 'CC BY')])
+
+    assert resolver.resolve('https://x.org/by-nc/4.0') == 'CC BY-NC'
+    assert resolver.resolve('https://x.org/by/4.0') == 'CC BY'
+    assert resolver.resolve('https://x.org/other') == ''
+
+
+def test_license_resolver_cache():
+    resolver = LicenseResolver([(r'.*zero', 'CC0 1.0')], cache_size=1)
+
+    for uri in ['zero', 'zero', 'other', 'zero']:
+        resolver.resolve(uri)
+
+    stats = resolver.cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 3, 2)
+
+
+def test_license_resolver_from_csv(tmp_path):
+    table = tmp_path / 'licenses.csv'
+    table.write_text('pattern;license\n.*example\\.org/l1;Example 1\n')
+
+    resolver = LicenseResolver.from_csv(str(table))
+
+    assert resolver.resolve('https://example.org/l1') == 'Example 1'
+    assert LicenseResolver([]).resolve('https://example.org/l1') == ''
@@ -0,0 +1,118 @@
+from metrics import Counter, Gauge, Histogram, Registry, RequestTimer
+
+
+def test_render_metrics():
+    registry = Registry()
+    counter = registry.register(Counter('requests', 'Requests.', ('status',)))
+    histogram = registry.register(Histogram('latency', 'Latency.',
+                                            buckets=(0.1, 1.0)))
+    registry.register(Gauge('entries', 'Entries.', lambda: 3))
+
+    counter.inc(200)
+    counter.inc(200)
+    counter.inc(404)
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    assert registry.render().splitlines() == [
+        '# HELP requests Requests.',
+        '# TYPE requests counter',
+        'requests_total{status="200"} 2',
+        'requests_total{status="404"} 1',
+        '# HELP latency Latency.',
+        '# TYPE latency histogram',
+        'latency_bucket{le="0.1"} 2',
+        'latency_bucket{le="1.0"} 3',
+        'latency_bucket{le="+Inf"} 4',
+        'latency_sum 2.65',
+        'latency_count 4',
+        '# HELP entries Entries.',
+        '# TYPE entries gauge',
+        'entries 3',
+    ]
+
+
+def test_request_timer_phases():
+    timer = RequestTimer()
+    assert timer.phases(1.0) is None
+
+    timer.start -= 0.5
+    started = timer.refining()
+    timer.refined(started - 0.2)
+    phases = timer.phases(1.0)
+
+    assert round(phases["validation"], 1) == 0.5
+    assert round(phases["refinement"], 1) == 0.2
+    assert round(phases["serialization"], 1) == 0.3
+
+
+def worker_registry(directory, worker: str) -> tuple:
+    registry = Registry()
+    counter = registry.register(Counter('requests', 'Requests.', ('status',)))
+    histogram = registry.register(Histogram('latency', 'Latency.',
+                                            buckets=(0.1, 1.0)))
+    registry.register(Gauge('entries', 'Entries.', lambda: len(worker)))
+    registry.share(str(directory), worker, flush_interval=60)
+    return registry, counter, histogram
+
+
+def test_shared_metrics_sum_workers(tmp_path):
+    first, first_counter, first_histogram = worker_registry(tmp_path, 'a')
+    second, second_counter, second_histogram = worker_registry(tmp_path,
+                                                               'bb')
+    try:
+        first_counter.inc(200)
+        second_counter.inc(200)
+        second_counter.inc(404)
+        first_histogram.observe(0.05)
+        second_histogram.observe(2.0)
+        second.flush()
+
+        lines = first.render().splitlines()
+    finally:
+        first.stop()
+        second.stop()
+
+    assert 'requests_total{status="200"} 2' in lines
+    assert 'requests_total{status="404"} 1' in lines
+    assert 'latency_bucket{le="0.1"} 1' in lines
+    assert 'latency_count 2' in lines
+    assert 'latency_sum 2.05' in lines
+    # Gauges are the rendering worker's.
+    assert 'entries 1' in lines
+
+    Registry.clear(str(tmp_path))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_retired_workers_are_folded(tmp_path):
+    first, first_counter, _ = worker_registry(tmp_path, 'a')
+    second, second_counter, _ = worker_registry(tmp_path, 'bb')
+    third, third_counter, third_histogram = worker_registry(tmp_path, 'c')
+    try:
+        first_counter.inc(200)
+        second_counter.inc(200, amount=2)
+        third_histogram.observe(0.5)
+        first.stop()
+        second.stop()
+        third.flush()
+        first_values = (tmp_path / 'a.json').read_bytes()
+
+        third.retire(str(tmp_path), 'a')
+        # A worker file still seen by a scrape after it was folded.
+        (tmp_path / 'a.json').write_bytes(first_values)
+        racing = third.render().splitlines()
+        (tmp_path / 'a.json').unlink()
+        third.retire(str(tmp_path), 'bb')
+        third_counter.inc(200)
+
+        lines = third.render().splitlines()
+    finally:
+        third.stop()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == \
+        ['c.json', 'exited.json']
+    assert 'requests_total{status="200"} 3' in racing
+    assert 'requests_total{status="200"} 4' in lines
+    assert 'latency_count 1' in lines
+    assert 'entries 1' in lines
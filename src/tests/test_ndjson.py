@@ -0,0 +1,70 @@
+import asyncio
+import json
+import os
+
+from dsc_table import DSCTable
+from executor import RefinementExecutor
+from ndjson import iter_lines, refine_ndjson
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            "../.."))
+
+
+async def as_stream(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def collect(iterator):
+    return [item async for item in iterator]
+
+
+def test_iter_lines_across_chunks():
+    chunks = [b'{"a":', b' 1}\n{"b": 2}\r\n', b'\n{"c"', b': 3}']
+
+    lines = asyncio.run(collect(iter_lines(as_stream(chunks))))
+
+    assert lines == [b'{"a": 1}', b'{"b": 2}', b'', b'{"c": 3}']
+
+
+def test_iter_lines_long_line():
+    chunks = [b'x'] * 1000 + [b'\ny']
+
+    lines = asyncio.run(collect(iter_lines(as_stream(chunks))))
+
+    assert lines == [b'x' * 1000, b'y']
+
+
+def test_refine_ndjson():
+    record = {"persistentUrl": "https://doi.org/10.17026/dans-zm4-yfdv",
+              "datasetVersion": {"metadataBlocks": {"citation": {
+                  "fields": []}}}}
+    body = [json.dumps(record).encode() + b'\n', b'not json\n',
+            b'\n', b'{"datasetVersion": {}}\n']
+
+    lines = asyncio.run(collect(refine_ndjson('liss', as_stream(body))))
+    results = [json.loads(line) for line in lines]
+
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert results[0] == {"index": 0, "status": "ok", "metadata": record}
+    assert results[1]["status_code"] == 400
+    assert results[2]["status_code"] == 400
+
+
+def test_refine_ndjson_on_executor():
+    dsc_table = DSCTable(os.path.join(PROJECT_ROOT, "src/data",
+                                      "DSC_table.csv"))
+    executor = RefinementExecutor(dsc_table, mode='thread', max_workers=1,
+                                  size_threshold=0)
+    body = [b'{"datasetVersion": {"metadataBlocks": {}}}\n', b'{}\n']
+    executor.start()
+    try:
+        lines = asyncio.run(collect(refine_ndjson(
+            'cid', as_stream(body), executor=executor)))
+    finally:
+        executor.shutdown()
+
+    results = [json.loads(line) for line in lines]
+    assert [result["index"] for result in results] == [0, 1]
+    assert results[1]["status_code"] == 422
+    assert executor.stats()["submitted"] == 2
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from schema.parsing import parse_refiner_input
+
+DOCUMENT = {"datasetVersion": {"metadataBlocks": {"citation": {
+    "fields": [{"typeName": "title", "value": "x"}]}}}}
+
+
+@pytest.mark.parametrize('mode', ['model', 'fast', 'strict'])
+def test_parse_refiner_input(mode):
+    body = json.dumps({"metadata": DOCUMENT}).encode()
+
+    assert parse_refiner_input(body, mode=mode) == DOCUMENT
+    assert parse_refiner_input(
+        json.dumps({"metadata": [DOCUMENT, {}]}).encode(), batch=True,
+        mode=mode) == [DOCUMENT, {}]
+
+
+@pytest.mark.parametrize('mode', ['model', 'fast', 'strict'])
+def test_parse_refiner_input_invalid(mode):
+    for body in [b'{"metadata": ', b'{}', b'[]']:
+        with pytest.raises(HTTPException) as error:
+            parse_refiner_input(body, mode=mode)
+        assert error.value.status_code == 422
+    with pytest.raises(HTTPException):
+        parse_refiner_input(b'{"metadata": {}}', batch=True, mode=mode)
+
+
+def test_parse_refiner_input_strict_skeleton():
+    body = json.dumps({"metadata": {"datasetVersion": {
+        "metadataBlocks": {"citation": {"fields": [{"value": "x"}]}}}}})
+
+    assert parse_refiner_input(body.encode(), mode='fast')
+    with pytest.raises(HTTPException) as error:
+        parse_refiner_input(body.encode(), mode='strict')
+    assert error.value.detail[0]["loc"] == (
+        'metadata', 'datasetVersion', 'metadataBlocks', 'citation', 'fields',
+        0, 'typeName')
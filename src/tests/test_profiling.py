@@ -0,0 +1,107 @@
+import marshal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from profiling import PROFILE_HEADER, Profiler, ProfileStore, \
+    collapsed_stacks, profile_call, render
+
+
+def leaf(n):
+    return sum(range(n))
+
+
+def branch(n):
+    return leaf(n) + leaf(n)
+
+
+def root():
+    return branch(1000) + leaf(1000)
+
+
+def test_profiler_wants_header_or_sample():
+    assert not Profiler().wants({PROFILE_HEADER: '1'})
+    profiler = Profiler(enabled=True)
+    assert profiler.wants({PROFILE_HEADER: 'true'})
+    assert not profiler.wants({})
+    assert Profiler(enabled=True, sample_rate=1.0).wants({})
+
+    with pytest.raises(ValueError):
+        Profiler(profiler='perf')
+
+
+def test_store_keeps_most_recent():
+    profiler = Profiler(enabled=True, store_size=2)
+    ids = [profiler.record('cid', '/', b'', 0.1).id for _ in range(3)]
+
+    assert [profile.id for profile in profiler.store.recent()] == \
+        ids[:0:-1]
+    assert profiler.store.get(ids[0]) is None
+    assert len(ProfileStore(maxsize=0)) == 0
+
+
+def test_store_is_shared_through_file(tmp_path):
+    filename = str(tmp_path / 'profiles.sqlite3')
+    profile = Profiler(enabled=True, store_path=filename).record(
+        'cid', '/', b'data', 0.1)
+
+    assert ProfileStore(filename).get(profile.id) == profile
+
+
+def test_concurrent_calls_are_not_profiled():
+    started, release = threading.Event(), threading.Event()
+
+    def blocking():
+        started.set()
+        release.wait(10)
+        return root()
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        profiled = pool.submit(profile_call, 'cprofile', blocking)
+        started.wait(10)
+        result, data, _ = profile_call('cprofile', root)
+        release.set()
+        profiled_result, profiled_data, _ = profiled.result()
+
+    assert result == profiled_result == 3 * sum(range(1000))
+    assert data is None
+    assert b'blocking' in profiled_data
+
+
+def test_cprofile_formats():
+    result, data, duration = profile_call('cprofile', root)
+    profile = Profiler(enabled=True).record('cid', '/', data, duration)
+
+    assert result == 3 * sum(range(1000))
+    assert render(profile, 'pstats')[0] == data
+    text, media_type, filename = render(profile, 'text')
+    assert b'branch' in text and media_type == 'text/plain'
+    assert filename == f'{profile.id}.txt'
+    with pytest.raises(ValueError):
+        render(profile, 'html')
+
+
+def test_collapsed_stacks_follow_call_graph():
+    _, data, _ = profile_call('cprofile', root)
+    stacks = [line.rsplit(' ', 1)[0].split(';')
+              for line in collapsed_stacks(marshal.loads(data)).splitlines()]
+
+    names = {tuple(frame.split(' ')[0] for frame in stack)
+             for stack in stacks}
+    assert ('root', 'branch', 'leaf') in names
+    assert ('root', 'leaf') in names
+    assert not any(len(stack) > 1 and stack[0].startswith('leaf')
+                   for stack in stacks)
+
+
+def test_pyinstrument_formats():
+    pytest.importorskip('pyinstrument')
+    _, data, duration = profile_call('pyinstrument', root)
+    profile = Profiler(enabled=True, profiler='pyinstrument').record(
+        'cid', '/', data, duration)
+
+    assert render(profile, 'html')[1] == 'text/html'
+    assert render(profile, 'speedscope')[1] == 'application/json'
+    with pytest.raises(ValueError):
+        render(profile, 'pstats')
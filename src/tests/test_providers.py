@@ -0,0 +1,42 @@
+import pytest
+from fastapi import HTTPException
+
+from providers import refine, refine_item
+
+
+def test_refine_dispatches_to_provider():
+    metadata = {
+        "datasetVersion": {
+            "metadataBlocks": {
+                "citation": {
+                    "fields": [
+                        {
+                            "typeName": "distributionDate",
+                            "value": "2023-10-29T07:58:43.398551"
+                        }
+                    ]
+                }
+            }
+        }
+    }
+
+    refined = refine('cid', metadata)
+
+    assert refined["datasetVersion"]["metadataBlocks"]["citation"][
+               "fields"][0]["value"] == "2023-10-29"
+
+
+def test_refine_unknown_provider():
+    with pytest.raises(HTTPException) as error:
+        refine('unknown', {})
+    assert error.value.status_code == 404
+
+
+def test_refine_item_captures_errors():
+    assert refine_item('cbs', 3, {"datasetVersion": {}}, {}) == {
+        "index": 3, "status": "error", "status_code": 422,
+        "detail": "'metadataBlocks'"}
+    assert refine_item('sicada', 0, {})["status_code"] == 500
+    assert refine_item('cbs', 1, {"datasetVersion": {"metadataBlocks": {}}},
+                       {}) == {"index": 1, "status": "ok", "metadata": {
+        "datasetVersion": {"metadataBlocks": {}}}}
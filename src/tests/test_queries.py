@@ -0,0 +1,49 @@
+import pytest
+
+import queries
+from queries import register_query, require_queries, search
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """ Registrations in a test are undone afterwards. """
+    monkeypatch.setattr(queries, 'QUERIES', dict(queries.QUERIES))
+    monkeypatch.setattr(queries, '_compiled', dict(queries._compiled))
+
+
+def test_search_cbs_id():
+    metadata = {
+        "datasetVersion": {
+            "metadataBlocks": {
+                "citation": {
+                    "fields": [
+                        {
+                            "typeName": "otherId",
+                            "value": [
+                                {"otherIdValue": {"value": "12345"}},
+                                {"otherIdValue": {"value": "67890"}}
+                            ]
+                        }
+                    ]
+                }
+            }
+        }
+    }
+
+    assert search('cbs_id', metadata) == "12345"
+    assert search('cbs_id', {}) is None
+
+
+def test_register_and_require_queries(registry):
+    register_query('test_title', "datasetVersion.title")
+
+    query, = require_queries('test_title')
+
+    assert query.search({"datasetVersion": {"title": "x"}}) == "x"
+    with pytest.raises(KeyError):
+        require_queries('test_title', 'does_not_exist')
+
+
+def test_registrations_are_undone():
+    with pytest.raises(KeyError):
+        require_queries('test_title')
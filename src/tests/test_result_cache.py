@@ -0,0 +1,83 @@
+import pytest
+
+from result_cache import MemoryBackend, ResultCache, SQLiteBackend, \
+    create_result_cache
+from version import get_version
+
+
+def test_result_cache_key_is_canonical():
+    key = ResultCache.key('cbs', {"a": 1, "b": [{"c": 2, "d": 3}]}, 'v1')
+
+    assert key == ResultCache.key('cbs', {"b": [{"d": 3, "c": 2}], "a": 1},
+                                  'v1')
+    assert key != ResultCache.key('cbs', {"a": 1, "b": [{"c": 2, "d": 3}]},
+                                  'v2')
+    assert key != ResultCache.key('cid', {"a": 1, "b": [{"c": 2, "d": 3}]},
+                                  'v1')
+    assert key != ResultCache.key('cbs', {"a": 1, "b": [{"c": 2, "d": 3}]},
+                                  'v1', 'l1')
+    assert key.startswith(f'cbs:{get_version()}:v1:-:')
+
+
+@pytest.mark.parametrize('backend', ['memory', 'sqlite'])
+def test_result_cache_backends_evict(tmp_path, backend):
+    if backend == 'memory':
+        cache = ResultCache(MemoryBackend(maxbytes=6))
+    else:
+        cache = ResultCache(SQLiteBackend(str(tmp_path / 'cache.sqlite3'),
+                                          maxbytes=6))
+
+    cache.put('a', b'11')
+    cache.put('b', b'22')
+    assert cache.get('a') == b'11'
+    cache.put('c', b'3333')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == b'11'
+    assert cache.get('c') == b'3333'
+    # Larger than the whole cache.
+    cache.put('d', b'1234567')
+    assert cache.get('d') is None
+    stats = cache.stats()
+    assert (stats["size"], stats["bytes"], stats["evictions"]) == (2, 6, 1)
+
+
+@pytest.mark.parametrize('backend', ['memory', 'sqlite'])
+def test_result_cache_replace_counts_bytes_once(tmp_path, backend):
+    if backend == 'memory':
+        cache = ResultCache(MemoryBackend(maxbytes=4))
+    else:
+        cache = ResultCache(SQLiteBackend(str(tmp_path / 'cache.sqlite3'),
+                                          maxbytes=4))
+
+    cache.put('a', b'11')
+    cache.put('a', b'22')
+    cache.put('b', b'33')
+
+    assert cache.get('a') == b'22'
+    assert cache.stats()["bytes"] == 4
+
+
+def test_sqlite_backend_shares_usage_and_access_times(tmp_path):
+    filename = str(tmp_path / 'cache.sqlite3')
+    first = SQLiteBackend(filename, maxbytes=6)
+    second = SQLiteBackend(filename, maxbytes=6)
+
+    first.put('a', b'11')
+    second.put('b', b'22')
+    # The hit is only kept in memory until the next put.
+    assert first.get('a') == b'11'
+    first.put('c', b'3333')
+
+    assert second.get('b') is None
+    assert (second.stats()["size"], second.stats()["bytes"]) == (2, 6)
+    reopened = SQLiteBackend(filename, maxbytes=6)
+    assert (reopened.stats()["size"], reopened.stats()["bytes"]) == (2, 6)
+
+
+def test_create_result_cache(tmp_path):
+    assert create_result_cache('off', 10, '') is None
+    assert isinstance(create_result_cache('memory', 10, '').backend,
+                      MemoryBackend)
+    with pytest.raises(ValueError):
+        create_result_cache('redis', 10, '')
@@ -0,0 +1,61 @@
+import refiners.cbs_refiner  # noqa: F401 (registers the rule sets)
+import refiners.cid_refiner  # noqa: F401
+import refiners.liss_refiner  # noqa: F401
+from field_index import FieldIndex
+from rules import RefinementPlan, Rule, plan_for
+
+
+def make_metadata():
+    return {
+        "datasetVersion": {
+            "metadataBlocks": {
+                "citation": {
+                    "fields": [
+                        {"typeName": "title", "value": "a"},
+                        {"typeName": "title", "value": "b"},
+                        {"typeName": "subject"}
+                    ]
+                }
+            }
+        }
+    }
+
+
+def test_plan_refines_first_field():
+    metadata = make_metadata()
+    plan = RefinementPlan([
+        Rule('test', 'citation', 'title',
+             lambda value, context: value + context['suffix']),
+        Rule('test', 'citation', 'title', lambda value, context: value * 2),
+        Rule('test', 'citation', 'subject', lambda value, context: 'x'),
+        Rule('test', 'missing', 'title', lambda value, context: 'x'),
+    ])
+
+    plan.apply(FieldIndex(metadata), {'suffix': '!'})
+
+    assert metadata["datasetVersion"]["metadataBlocks"]["citation"][
+               "fields"] == [{"typeName": "title", "value": "a!a!"},
+                             {"typeName": "title", "value": "b"},
+                             {"typeName": "subject"}]
+
+
+def test_plan_refines_all_fields():
+    metadata = make_metadata()
+    plan = RefinementPlan([
+        Rule('test', 'citation', 'title', lambda value, context: value.upper(),
+             all_fields=True),
+    ])
+
+    plan.apply(FieldIndex(metadata), {})
+
+    assert [field.get("value") for field in
+            metadata["datasetVersion"]["metadataBlocks"]["citation"][
+                "fields"]] == ["A", "B", None]
+
+
+def test_provider_rule_sets():
+    assert set(plan_for('cbs').blocks) == {'citation', 'CBSMetadata'}
+    assert set(plan_for('cid').blocks['citation']) == {'distributionDate'}
+    assert set(plan_for('liss').blocks['citation']) == {
+        'topicClassification'}
+    assert plan_for('unknown').blocks == {}
@@ -0,0 +1,78 @@
+import copy
+
+import pytest
+
+import tracing
+from providers import refine
+
+METADATA = {
+    "persistentUrl": "https://doi.org/10.17026/dans-zm4-yfdv",
+    "datasetVersion": {
+        "dataAccessPlace": "https://dab.surf.nl/dataset",
+        "metadataBlocks": {"citation": {"fields": [
+            {"typeName": "alternativeTitle", "value": ["PS ArbodienstenVV"]},
+            {"typeName": "topicClassification", "value": [
+                {"topicClassValue": {"value": "Politics (LISS)"}}]},
+        ]}},
+    },
+}
+
+
+@pytest.fixture(autouse=True)
+def no_tracer(monkeypatch):
+    """ Tests start without a tracer, whatever TRACING the tests run with,
+    and the tracer is restored afterwards.
+    """
+    monkeypatch.setattr(tracing, '_tracer', None)
+
+
+@pytest.fixture
+def spans():
+    records = []
+    tracing.set_tracer(tracing.RecordingTracer(records.append))
+    return records
+
+
+def test_span_is_noop_without_tracer():
+    assert tracing.get_tracer() is None
+    with tracing.span('step', attribute=1) as span:
+        span.set_attribute('other', 2)
+    assert span is tracing.NOOP_SPAN
+
+
+def test_refiner_steps_are_traced(spans):
+    refine('cbs', copy.deepcopy(METADATA), {})
+
+    assert [(span.name, span.parent) for span in spans] == [
+        ('cbs.alternativeTitle', 'cbs.refine'),
+        ('cbs.keyword', 'cbs.refine'), ('cbs.doi', 'cbs.refine'),
+        ('cbs.refine', None)]
+    assert spans[0].attributes == {'block': 'citation'}
+    assert all(span.duration >= 0 for span in spans)
+
+
+def test_failed_step_is_recorded(spans):
+    with pytest.raises(Exception):
+        refine('liss', {"datasetVersion": {}})
+
+    assert spans[0].name == 'liss.doi'
+    assert spans[0].attributes['error'] == 'KeyError'
+
+
+def test_metrics_tracer_observes_steps():
+    tracing.set_tracer(tracing.create_tracer('metrics'))
+    refine('liss', copy.deepcopy(METADATA))
+
+    samples = '\n'.join(tracing.step_duration.samples())
+    assert 'step="liss.topicClassification"' in samples
+    with pytest.raises(ValueError):
+        tracing.create_tracer('zipkin')
+
+
+def test_opentelemetry_tracer():
+    pytest.importorskip('opentelemetry.trace')
+    tracing.set_tracer(tracing.create_tracer('otel'))
+    refined = refine('liss', copy.deepcopy(METADATA))
+
+    assert refined["datasetVersion"]["metadataBlocks"]["citation"][
+        "fields"][1]["value"][0]["topicClassValue"]["value"] == "Politics"
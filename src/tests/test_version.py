@@ -0,0 +1,22 @@
+import version
+
+
+def test_version_from_pyproject(tmp_path):
+    pyproject = tmp_path / 'pyproject.toml'
+    pyproject.write_text('[tool.poetry]\nname = "x"\nversion = "9.8.7"\n')
+
+    assert version.version_from_pyproject(str(pyproject)) == "9.8.7"
+    assert version.version_from_pyproject(str(tmp_path / 'missing')) is None
+
+
+def test_get_version_is_cached(monkeypatch):
+    version.get_version.cache_clear()
+    calls = []
+    monkeypatch.setattr(version, 'version_from_pyproject',
+                        lambda: calls.append(1) or "1.2.3")
+    try:
+        assert version.get_version() == "1.2.3"
+        assert version.get_version() == "1.2.3"
+        assert len(calls) == 1
+    finally:
+        version.get_version.cache_clear()
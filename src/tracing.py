@@ -0,0 +1,171 @@
+""" Timing spans for the steps of a refinement.
+
+Refiners wrap their steps in `span`:
+
+    with tracing.span('cbs.doi'):
+        ...
+
+What happens to a span is up to the tracer, set with TRACING or
+`set_tracer`:
+
+- `off` (default) - No tracer; `span` returns a shared no-op span.
+- `metrics` - Spans are timed and observed in the
+  refiner_step_duration_seconds histogram, by step.
+- `otel` - Spans are OpenTelemetry spans, exported by whatever the
+  OpenTelemetry SDK is configured with. Needs opentelemetry-api.
+
+A RecordingTracer with any exporter, a callable receiving every finished
+SpanRecord, plugs in other backends.
+"""
+import contextvars
+import os
+import time
+from collections.abc import Mapping
+from typing import Any, Callable, NamedTuple
+
+from metrics import Histogram, registry
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+TRACING = os.environ.get('TRACING', 'off')
+TRACING_MODES = ('off', 'metrics', 'otel')
+
+step_duration = registry.register(Histogram(
+    'refiner_step_duration_seconds',
+    'Duration of refinement steps, with TRACING=metrics.', ('step',)))
+
+
+class SpanRecord(NamedTuple):
+    """ A finished span. """
+    name: str
+    # Name of the enclosing span, if any.
+    parent: str | None
+    # Wall clock start, in seconds since the epoch.
+    start: float
+    duration: float
+    attributes: dict[str, Any]
+
+
+Exporter = Callable[[SpanRecord], None]
+
+
+class NoopSpan:
+    """ The span of a disabled tracer. """
+    __slots__ = ()
+
+    def __enter__(self) -> 'NoopSpan':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        return None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+# The name of the innermost open span of a RecordingTracer.
+_current_span: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    'current_span', default=None)
+
+
+class RecordingSpan:
+    __slots__ = ('exporter', 'name', 'attributes', 'parent', 'start',
+                 '_started', '_token')
+
+    def __init__(self, exporter: Exporter, name: str,
+                 attributes: dict[str, Any]):
+        self.exporter = exporter
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> 'RecordingSpan':
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self.name)
+        self.start = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        duration = time.perf_counter() - self._started
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.exporter(SpanRecord(self.name, self.parent, self.start,
+                                 duration, self.attributes))
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+
+class RecordingTracer:
+    """ Times spans itself and passes them to an exporter when they end. """
+
+    def __init__(self, exporter: Exporter):
+        self.exporter = exporter
+
+    def span(self, name: str, attributes: dict[str, Any]) -> RecordingSpan:
+        return RecordingSpan(self.exporter, name, attributes)
+
+
+class OpenTelemetryTracer:
+    """ Starts OpenTelemetry spans, nested in the current OpenTelemetry
+    context, e.g. the span of an instrumented request.
+    """
+
+    def __init__(self, tracer_provider=None):
+        if otel_trace is None:
+            raise ValueError("TRACING=otel requires opentelemetry-api.")
+        self.tracer = otel_trace.get_tracer('metadata-refiner',
+                                            tracer_provider=tracer_provider)
+
+    def span(self, name: str, attributes: Mapping[str, Any]):
+        return self.tracer.start_as_current_span(name, attributes=attributes)
+
+
+def observe_step(record: SpanRecord) -> None:
+    """ Exporter observing the duration of every span by name. """
+    step_duration.observe(record.duration, record.name)
+
+
+def create_tracer(mode: str):
+    """ The tracer of a TRACING mode, None for `off`.
+
+    :raises ValueError: Raises for an unknown mode.
+    """
+    if mode == 'off':
+        return None
+    if mode == 'metrics':
+        return RecordingTracer(observe_step)
+    if mode == 'otel':
+        return OpenTelemetryTracer()
+    raise ValueError(f"Unknown tracing mode '{mode}', expected one of "
+                     f"{', '.join(TRACING_MODES)}.")
+
+
+_tracer = create_tracer(TRACING)
+
+
+def set_tracer(tracer) -> None:
+    """ Sets the tracer of all spans, None disables tracing. """
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name: str, **attributes):
+    """ A span for a step, used as a context manager.
+
+    With tracing off this only returns NOOP_SPAN, so steps can be wrapped
+    unconditionally.
+    """
+    if _tracer is None:
+        return NOOP_SPAN
+    return _tracer.span(name, attributes)
@@ -1,12 +1,16 @@
 import csv
-import re
+from collections.abc import Iterable
 from typing import Callable
 from urllib.parse import urlparse
 
 from fastapi import HTTPException
 
+from field_index import FieldIndex
+from licenses import resolve_license
 
-def add_contact_email(metadata: dict, contact_email: str) -> dict:
+
+def add_contact_email(metadata: dict, contact_email: str,
+                      field_index: FieldIndex | None = None) -> dict:
     """ Adds a contact email to dataverse JSON.
 
     If metadata exported from a Dataverse is missing the contact email,
@@ -14,12 +18,13 @@ def add_contact_email(metadata: dict, contact_email: str) -> dict:
 
     :param contact_email: Standard contact email to use.
     :param metadata: Dataverse JSON that is missing the contact email.
+    :param field_index: Field index of the metadata, if one already exists.
     :return: dataverse JSON with the contact email added.
     """
-    fields = metadata['datasetVersion']['metadataBlocks']['citation'][
-        'fields']
-    dataset_contact = next((field for field in fields if
-                            field.get('typeName') == 'datasetContact'), None)
+    field_index = field_index or FieldIndex(metadata)
+    if field_index.fields('citation') is None:
+        raise KeyError('citation')
+    dataset_contact = field_index.get('citation', 'datasetContact')
     if dataset_contact:
         for dataset_contact in dataset_contact["value"]:
             dataset_contact["datasetContactEmail"] = {
@@ -29,7 +34,7 @@ def add_contact_email(metadata: dict, contact_email: str) -> dict:
                 "value": contact_email
             }
     else:
-        fields.append({
+        field_index.append('citation', {
             "typeName": "datasetContact",
             "multiple": True,
             "typeClass": "compound",
@@ -49,9 +54,14 @@ def add_contact_email(metadata: dict, contact_email: str) -> dict:
 
 def csv_to_dict(filename: str) -> dict:
     with open(filename, newline='') as csvfile:
-        reader = csv.reader(csvfile, delimiter=';')
-        next(reader)  # skip header row if present
-        return {row[1]: row[0] for row in reader if len(row) >= 2}
+        return csv_lines_to_dict(csvfile)
+
+
+def csv_lines_to_dict(lines: Iterable[str]) -> dict:
+    """ Reads the DSC table from the lines of its CSV. """
+    reader = csv.reader(lines, delimiter=';')
+    next(reader)  # skip header row if present
+    return {row[1]: row[0] for row in reader if len(row) >= 2}
 
 
 def get_field(typename: str, fields: list) -> dict:
@@ -96,36 +106,20 @@ def format_license(ds_license):
 
 
 def retrieve_license_name(license_string):
-    dataset_lic = ''
-    if re.search(r'creativecommons', license_string):
-        if re.search(r'/by/4\.0', license_string):
-            dataset_lic = "CC BY 4.0"
-        elif re.search(r'/by-nc/4\.0', license_string):
-            dataset_lic = "CC BY-NC 4.0"
-        elif re.search(r'/by-sa/4\.0', license_string):
-            dataset_lic = "CC BY-SA 4.0"
-        elif re.search(r'/by-nc-sa/4\.0', license_string):
-            dataset_lic = "CC BY-NC-SA 4.0"
-        elif re.search(r'/by-nc-nd/4\.0', license_string):
-            dataset_lic = "CC BY-NC-ND 4.0"
-        elif re.search(r'/by-nd/4\.0', license_string):
-            dataset_lic = "CC BY-ND 4.0"
-        elif re.search(r'zero/1\.0', license_string):
-            dataset_lic = "CC0 1.0"
-    elif re.search(r'10\.17026/fp39-0x58', license_string):
-        dataset_lic = "DANS Licence"
-    return dataset_lic
-
-
-def refine_field_primitive_to_multiple(metadata, metadataBlock, field):
-    metadataBlocks = metadata['datasetVersion']['metadataBlocks']
-    if metadataBlock in metadataBlocks:
-        fields = metadataBlocks[metadataBlock]['fields']
-
-        field_to_refine = get_field(field, fields)
-        if field_to_refine and field_to_refine['multiple'] is False:
-            field_to_refine['multiple'] = True
-            field_to_refine['value'] = [field_to_refine['value']]
+    """ Returns the license name for a license URI, or '' if it is unknown.
+
+    The URIs and names are configured in the license table, see licenses.py.
+    """
+    return resolve_license(license_string)
+
+
+def refine_field_primitive_to_multiple(metadata, metadataBlock, field,
+                                       field_index: FieldIndex | None = None):
+    field_index = field_index or FieldIndex(metadata)
+    field_to_refine = field_index.get(metadataBlock, field)
+    if field_to_refine and field_to_refine['multiple'] is False:
+        field_to_refine['multiple'] = True
+        field_to_refine['value'] = [field_to_refine['value']]
 
 
 def extract_doi_from_url(url):
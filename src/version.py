@@ -1,14 +1,55 @@
+import functools
+import os
 import subprocess
+from importlib import metadata
 
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
 
-def get_version():
-    result = subprocess.run(
-        ["poetry", "version", "--short"],
-        capture_output=True,
-        text=True
-    )
+PACKAGE_NAME = 'metadata-refiner'
+PYPROJECT_TOML = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              '..', 'pyproject.toml')
+
+
+def version_from_pyproject(filename: str = PYPROJECT_TOML) -> str | None:
+    try:
+        with open(filename, 'rb') as file:
+            return tomllib.load(file)['tool']['poetry']['version']
+    except (OSError, KeyError, tomllib.TOMLDecodeError):
+        return None
+
+
+def version_from_package() -> str | None:
+    try:
+        return metadata.version(PACKAGE_NAME)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def version_from_poetry() -> str:
+    try:
+        result = subprocess.run(
+            ["poetry", "version", "--short"],
+            capture_output=True,
+            text=True
+        )
+    except OSError:
+        return ''
     return result.stdout.strip()
 
 
+@functools.cache
+def get_version():
+    """ Returns the version of the service, resolved once per process.
+
+    The pyproject.toml next to the source is preferred, then the installed
+    package metadata, and only then a (slow) call to poetry.
+    """
+    return (version_from_pyproject() or version_from_package()
+            or version_from_poetry())
+
+
 if __name__ == '__main__':
     print(get_version())